@@ -23,12 +23,13 @@ from urllib.parse import urlencode, quote
 
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseServerError, HttpResponseForbidden, HttpResponseNotModified, StreamingHttpResponse
 from django.utils.http import http_date
+from django.utils.cache import patch_vary_headers
 from django.views.static import was_modified_since, serve
 
 from ..utils.backtrace import GetTraceback
 
 
-__all__ = ['ImageResponse', 'NoCacheHttpResponse', 'ResponseJsonSuccess', 'FileInMemory', 'RobotsTxtFactory', 'SendFileResponse', 'RedirectWithJavaScriptResponse']
+__all__ = ['ImageResponse', 'NoCacheHttpResponse', 'ResponseJsonSuccess', 'FileInMemory', 'RobotsTxtFactory', 'SendFileResponse', 'ImageVariantResponse', 'RedirectWithJavaScriptResponse']
 
 
 log = logging.getLogger(__name__)
@@ -41,23 +42,40 @@ class ImageResponse(StreamingHttpResponse):
 		'JPEG': "image/jpeg",
 		'GIF': "image/gif",
 		'WEBP': "image/webp",
+		'AVIF': "image/avif",
 	}
 
 	STREAM_CHUNK_SIZE = 4096
+	BUFFER_CHUNK_SIZE = 64 * 1024
 
 	def __init__(self, img, format='PNG', nocache=False):
+		""" img - PIL image, file-like object or an encoded image in memory (bytes,
+		memoryview - e.g. from tru.gfx.thumbs.RenderThumb), streamed in slices of the buffer.
+
+		Django copies every slice into bytes (StreamingHttpResponse.make_bytes), so the
+		image is still copied once, only a slice at a time.
+		"""
 
 		if format not in ImageResponse.mimes:
 			raise ValueError("Incorrect image format: '%s', choose one of %r" % (format, list(ImageResponse.mimes.keys())))
 
-		if not hasattr(img, 'read'):
+		if not isinstance(img, (bytes, bytearray, memoryview)) and not hasattr(img, 'read'):
 			buf = BytesIO()
 			img.save(buf, format)
-			img = buf
-		img.seek(0)
-		content = iter(lambda: img.read(self.STREAM_CHUNK_SIZE), b'')
+			img = buf.getbuffer()
+
+		length = None
+		if isinstance(img, (bytes, bytearray, memoryview)):
+			view = memoryview(img).cast('B')
+			length = view.nbytes
+			content = (view[i:i + self.BUFFER_CHUNK_SIZE] for i in range(0, length, self.BUFFER_CHUNK_SIZE))
+		else:
+			img.seek(0)
+			content = iter(lambda: img.read(self.STREAM_CHUNK_SIZE), b'')
 
 		super(ImageResponse, self).__init__(content, content_type=ImageResponse.mimes[format])
+		if length is not None:
+			self['Content-Length'] = length
 		if nocache:
 			self['Cache-Control'] = 'must-revalidate'
 			self['Pragma'] = 'no-cache'
@@ -227,6 +245,26 @@ def SendFileResponse(request, path, nocache=False, download=False, tmp=False, ag
 		return response
 
 
+def ImageVariantResponse(request, image_path, thumb_path, image_type, watermark=None, **kwargs):
+	""" SendFileResponse of the thumbnail in the best format accepted by the browser (WEBP, AVIF),
+	the variant is rendered on the first request. Paths are relative to UPLOAD_DIR.
+	"""
+
+	from ..gfx.variants import GetThumbVariant
+
+	path, content_type = GetThumbVariant(
+		request.META.get('HTTP_ACCEPT'),
+		os.path.join(settings.UPLOAD_DIR, image_path.lstrip('/')),
+		os.path.join(settings.UPLOAD_DIR, thumb_path.lstrip('/')),
+		image_type,
+		watermark=watermark
+	)
+
+	response = SendFileResponse(request, os.path.relpath(path, settings.UPLOAD_DIR), upload_path=True, content_type=content_type, **kwargs)
+	patch_vary_headers(response, ('Accept', ))
+	return response
+
+
 class RobotsTxtFactory:
 	content = ''
 
@@ -0,0 +1,259 @@
+"""
+Content-addressed storage of uploads: every unique content is stored once, in a
+path sharded by its SHA-256 (blobs/ab/cd/abcd...ef.jpg), the uploads are only
+references to it - symlinks or rows of the index:
+
+	store = BlobStore(UPLOAD_DIR, '/var/lib/project/blobs.sqlite')
+	blob_path, digest, created = store.Put(data, '.jpg')
+	store.Link('uploads/src/20/01/02/f3e1....jpg', digest)
+
+	store.Resolve('uploads/src/20/01/02/f3e1....jpg')  # -> blob_path
+
+Thumbnails should be rendered from the blob (Resolve), so all uploads of the
+same content share them. Blobs without references are removed together with
+their thumbnails by GC():
+
+	python -m tru.fs.blobs --root /var/www/uploads --db /var/lib/project/blobs.sqlite gc
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+
+from ..utils.sqlite import LocalConnections
+from .utils import MakeDirs
+
+log = logging.getLogger(__name__)
+
+
+BLOB_DIR = 'blobs'
+
+
+def NewHasher():
+	""" Hash of the content (update() it chunk by chunk, then hexdigest()) """
+	return hashlib.sha256()
+
+
+class BlobStore:
+	""" Blobs under `root` with the index of references (SQLite) counting them.
+
+	symlinks - references are also created as symlinks to the blobs (relative), so
+	           the uploads are still available under their own names.
+	"""
+
+	GRACE = 3600  # seconds; unreferenced blobs younger than that (uploads in progress) are not collected
+
+	def __init__(self, root, db_path, symlinks=True):
+		self.root = root
+		self.db_path = db_path
+		self.symlinks = symlinks
+		self.connections = LocalConnections(self.db_path)
+
+		with self.db as db:
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS blobs (
+					digest TEXT PRIMARY KEY,
+					path TEXT NOT NULL,
+					size INTEGER NOT NULL,
+					refs INTEGER NOT NULL DEFAULT 0,
+					stored REAL NOT NULL
+				)""")
+			db.execute("CREATE INDEX IF NOT EXISTS blobs_refs ON blobs (refs, stored)")
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS refs (
+					name TEXT PRIMARY KEY,
+					digest TEXT NOT NULL
+				)""")
+
+	@property
+	def db(self):
+		return self.connections.Get()
+
+	@staticmethod
+	def GetBlobPath(digest, ext):
+		return '{}/{}/{}/{}{}'.format(BLOB_DIR, digest[:2], digest[2:4], digest, ext)
+
+	def _Register(self, digest, ext, size):
+
+		with self.db as db:
+			row = db.execute("SELECT path FROM blobs WHERE digest = ?", (digest, )).fetchone()
+			path = row[0] if row is not None else self.GetBlobPath(digest, ext)
+			# refreshed, so GC does not take it before it gets referenced
+			db.execute(
+				"""INSERT INTO blobs (digest, path, size, stored) VALUES (?, ?, ?, ?)
+				ON CONFLICT(digest) DO UPDATE SET stored = excluded.stored""",
+				(digest, path, size, time.time())
+			)
+		return path
+
+	def Put(self, data, ext, digest=None):
+		""" Stores the content once, returns (path of the blob relative to root, digest, created) """
+
+		if digest is None:
+			hasher = NewHasher()
+			hasher.update(data)
+			digest = hasher.hexdigest()
+
+		path = self._Register(digest, ext, len(data))
+		filename = os.path.join(self.root, path)
+		if os.path.isfile(filename):
+			return path, digest, False
+
+		MakeDirs(filename)
+		# not named after the blob, GC removes the files of a collected blob by its name
+		tmp = os.path.join(os.path.dirname(filename), '.{}.tmp'.format(uuid.uuid4().hex))
+		with open(tmp, 'wb') as f:
+			f.write(data)
+		os.replace(tmp, filename)
+		return path, digest, True
+
+	def PutFile(self, src, ext, digest=None):
+		""" Put() of the file `src` by moving it (a rename, so it must be on the same filesystem);
+		it stays where it is if the content is already stored.
+		"""
+
+		if digest is None:
+			hasher = NewHasher()
+			with open(src, 'rb') as f:
+				for chunk in iter(lambda: f.read(1 << 16), b''):
+					hasher.update(chunk)
+			digest = hasher.hexdigest()
+
+		path = self._Register(digest, ext, os.path.getsize(src))
+		filename = os.path.join(self.root, path)
+		if os.path.isfile(filename):
+			return path, digest, False
+
+		MakeDirs(filename)
+		os.replace(src, filename)
+		return path, digest, True
+
+	def Link(self, name, digest):
+		""" Adds the reference `name` (relative to root) to the blob, returns the path of the blob """
+
+		with self.db as db:
+			row = db.execute("SELECT path FROM blobs WHERE digest = ?", (digest, )).fetchone()
+			if row is None:
+				raise KeyError("Unknown blob: {}".format(digest))
+			old = db.execute("SELECT digest FROM refs WHERE name = ?", (name, )).fetchone()
+			if old is not None:
+				db.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", old)
+			db.execute("INSERT OR REPLACE INTO refs (name, digest) VALUES (?, ?)", (name, digest))
+			db.execute("UPDATE blobs SET refs = refs + 1 WHERE digest = ?", (digest, ))
+
+		if self.symlinks:
+			filename = os.path.join(self.root, name)
+			MakeDirs(filename)
+			tmp = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+			os.symlink(os.path.relpath(os.path.join(self.root, row[0]), os.path.dirname(filename)), tmp)
+			os.replace(tmp, filename)
+
+		return row[0]
+
+	def Unlink(self, name):
+		""" Removes the reference, returns False for unknown names """
+
+		with self.db as db:
+			row = db.execute("SELECT digest FROM refs WHERE name = ?", (name, )).fetchone()
+			if row is None:
+				return False
+			db.execute("DELETE FROM refs WHERE name = ?", (name, ))
+			db.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", row)
+
+		filename = os.path.join(self.root, name)
+		if self.symlinks and os.path.islink(filename):
+			os.unlink(filename)
+		return True
+
+	def Resolve(self, name):
+		""" Path of the blob (relative to root) referenced by `name` or None """
+
+		row = self.db.execute("SELECT b.path FROM refs r JOIN blobs b ON b.digest = r.digest WHERE r.name = ?", (name, )).fetchone()
+		return row[0] if row is not None else None
+
+	def GC(self, grace=None, limit=1000):
+		""" Removes unreferenced blobs and their thumbnails (`limit` rows at a time until
+		there are none left), returns (removed blobs, bytes)
+
+		A blob is renamed to a tombstone in the transaction deleting its row: Put() of
+		the same content either refreshes the row first (so it is kept) or does not
+		find the file and writes it again.
+		"""
+
+		grace = self.GRACE if grace is None else grace
+		removed, removed_bytes = 0, 0
+		last = ''
+
+		while True:
+			rows = self.db.execute(
+				"SELECT digest, path FROM blobs WHERE refs <= 0 AND stored < ? AND digest > ? ORDER BY digest LIMIT ?",
+				(time.time() - grace, last, limit)
+			).fetchall()
+			if not rows:
+				return removed, removed_bytes
+			last = rows[-1][0]
+
+			for digest, path in rows:
+				filename = os.path.join(self.root, path)
+				tombstone = '{}.{}.gc'.format(filename, uuid.uuid4().hex)
+
+				with self.db as db:
+					# referenced or stored again in the meantime
+					if not db.execute("DELETE FROM blobs WHERE digest = ? AND refs <= 0 AND stored < ?", (digest, time.time() - grace)).rowcount:
+						continue
+					try:
+						os.rename(filename, tombstone)
+					except FileNotFoundError:
+						tombstone = None
+
+				# the blob, its thumbnails (name_1.jpg) and their variants (name_1.jpg.webp)
+				files = [tombstone] if tombstone is not None else []
+				files += [i for i in glob.glob(glob.escape(os.path.splitext(filename)[0]) + '*') if i != filename and i != tombstone]
+				for i in files:
+					try:
+						removed_bytes += os.path.getsize(i)
+						os.unlink(i)
+					except FileNotFoundError:
+						pass
+				removed += 1
+
+	def GetStats(self):
+		blobs, size, unreferenced = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs <= 0), 0) FROM blobs").fetchone()
+		refs, = self.db.execute("SELECT COUNT(*) FROM refs").fetchone()
+		return {'blobs': blobs, 'bytes': size, 'refs': refs, 'unreferenced': unreferenced}
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(prog='python -m tru.fs.blobs', description='Content-addressed storage of uploads')
+	parser.add_argument('--root', required=True, help='directory of the uploads')
+	parser.add_argument('--db', required=True, help='SQLite index')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	gc = sub.add_parser('gc', help='remove unreferenced blobs and their thumbnails')
+	gc.add_argument('--grace', type=int, default=BlobStore.GRACE, help='in seconds')
+
+	sub.add_parser('stats', help='print statistics')
+
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO)
+
+	store = BlobStore(args.root, args.db)
+
+	if args.command == 'gc':
+		blobs, size = store.GC(grace=args.grace)
+		print('Removed: {} blobs, {} bytes'.format(blobs, size))
+	elif args.command == 'stats':
+		print(json.dumps(store.GetStats(), indent=2))
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -218,6 +218,91 @@ class TmpFile:
 		return False
 
 
+class SpoolLimitError(IOError):
+	pass
+
+
+class SpoolFile:
+	""" Streams data (an upload) to a temporary file in `dir`, counting its size, hashing it
+	and keeping its first HEAD_SIZE bytes (for sniffing the type) on the way:
+
+		spool = SpoolFile(dir, max_size=50 << 20, hasher=hashlib.sha256())
+		for chunk in chunks:
+			spool.write(chunk)  # SpoolLimitError over max_size
+		spool.close()
+
+		spool.size, spool.head, spool.hexdigest()
+		Image.open(spool.path)
+		spool.Commit(filepath)  # a rename (the same filesystem), or Discard()
+
+	Not committed files are removed when the object is released.
+	"""
+
+	HEAD_SIZE = 8192
+
+	def __init__(self, dir, max_size=None, hasher=None):
+
+		self.f = self.path = None
+		os.makedirs(dir, exist_ok=True)
+		path = os.path.join(dir, 'spool.RND{}.tmp'.format(random.randrange(0xffffffff)))  # nosec
+		self.f = open(path, 'xb')
+		self.path = path
+		self.max_size = max_size
+		self.hasher = hasher
+		self.size = 0
+		self.head = b''
+
+	def write(self, chunk):
+
+		self.size += len(chunk)
+		if self.max_size is not None and self.size > self.max_size:
+			self.Discard()
+			raise SpoolLimitError('Spooled data exceed {} bytes'.format(self.max_size))
+
+		if len(self.head) < self.HEAD_SIZE:
+			self.head += chunk[:self.HEAD_SIZE - len(self.head)]
+		if self.hasher is not None:
+			self.hasher.update(chunk)
+		self.f.write(chunk)
+
+	def close(self):
+		if self.f is not None:
+			self.f.close()
+			self.f = None
+
+	def hexdigest(self):
+		return self.hasher.hexdigest() if self.hasher is not None else None
+
+	def read(self):
+		""" The whole content (for the code expecting bytes) """
+
+		self.close()
+		with open(self.path, 'rb') as f:
+			return f.read()
+
+	def __len__(self):
+		return self.size
+
+	def Commit(self, filepath):
+
+		self.close()
+		os.replace(self.path, filepath)
+		self.path = None
+
+	def Discard(self):
+
+		self.close()
+		if self.path is not None:
+			try:
+				os.remove(self.path)
+			except FileNotFoundError:
+				pass
+			self.path = None
+
+	def __del__(self):
+		self.Discard()
+
+
 class TmpDir:
 	def __init__(self, base_dir, perms=None):
 
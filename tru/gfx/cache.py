@@ -0,0 +1,297 @@
+"""
+Size-bounded disk cache of generated thumbnails (files created by CreateThumb next
+to the originals, see ImageType.get_path).
+
+Thumbnails are registered by CreateThumb.OnNewImage and accesses are reported by the
+views serving them:
+
+	cache = ThumbCache('/var/lib/project/thumbs.sqlite', max_bytes=20 * 1024 ** 3)
+	CreateThumb.OnNewImage.append(cache.OnNewImage)
+	cache.Start()  # background eviction
+
+	# in the view
+	if os.path.isfile(thumb_path):
+		cache.Hit(thumb_path)
+	else:
+		cache.Miss(thumb_path)
+		CreateThumb(...)
+
+Only registered files are ever removed, files used as a source of any thumbnail
+(also of a registered one) never.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+from ..utils.sqlite import LocalConnections
+
+log = logging.getLogger(__name__)
+
+
+class ThumbCache:
+	""" Index (SQLite) of generated thumbnails with their last access time and
+	number of hits, evicting the least recently (lru) or the least frequently (lfu)
+	used ones when the total size exceeds max_bytes.
+
+	Accesses are counted in memory and written to the index in batches (Flush).
+	"""
+
+	POLICIES = {
+		'lru': 'accessed',
+		'lfu': 'hits, accessed',
+	}
+
+	FLUSH_INTERVAL = 10  # seconds
+	EVICT_BATCH = 100
+
+	def __init__(self, db_path, max_bytes, policy='lru'):
+		if policy not in self.POLICIES:
+			raise ValueError("Unknown policy: {}, choose one of {}".format(policy, list(self.POLICIES)))
+
+		self.db_path = db_path
+		self.max_bytes = max_bytes
+		self.policy = policy
+		self.connections = LocalConnections(self.db_path)
+		self.lock = threading.Lock()
+		self.pending = {}  # path -> [hits, last access, bytes served]
+		self.counters = {'hits': 0, 'misses': 0, 'bytes_served': 0}
+		self.flushed = time.time()
+		self.thread = None
+		self.stopping = threading.Event()
+
+		with self.db as db:
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS thumbs (
+					path TEXT PRIMARY KEY,
+					source TEXT,
+					size INTEGER NOT NULL,
+					created REAL NOT NULL,
+					accessed REAL NOT NULL,
+					hits INTEGER NOT NULL DEFAULT 0
+				)""")
+			db.execute("CREATE INDEX IF NOT EXISTS thumbs_accessed ON thumbs (accessed)")
+			db.execute("CREATE INDEX IF NOT EXISTS thumbs_hits ON thumbs (hits, accessed)")
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS sources (
+					path TEXT PRIMARY KEY
+				)""")
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS stats (
+					name TEXT PRIMARY KEY,
+					value INTEGER NOT NULL
+				)""")
+
+	@property
+	def db(self):
+		return self.connections.Get()
+
+	def Add(self, thumb_path, image_path=None):
+		""" Registers a generated thumbnail """
+
+		try:
+			size = os.path.getsize(thumb_path)
+		except FileNotFoundError:
+			return False
+
+		image_path = image_path if isinstance(image_path, str) else None
+		now = time.time()
+		with self.db as db:
+			if image_path is not None:
+				db.execute("INSERT OR IGNORE INTO sources (path) VALUES (?)", (image_path, ))
+				db.execute("DELETE FROM thumbs WHERE path = ?", (image_path, ))
+			if db.execute("SELECT 1 FROM sources WHERE path = ?", (thumb_path, )).fetchone():
+				return False
+			db.execute(
+				"""INSERT INTO thumbs (path, source, size, created, accessed) VALUES (?, ?, ?, ?, ?)
+				ON CONFLICT(path) DO UPDATE SET source = excluded.source, size = excluded.size, accessed = excluded.accessed""",
+				(thumb_path, image_path, size, now, now)
+			)
+		return True
+
+	def OnNewImage(self, thumb_path, image_path, fmt, params):
+		""" Callback for CreateThumb.OnNewImage """
+		self.Add(thumb_path, image_path)
+
+	def Hit(self, thumb_path, nbytes=None):
+		""" The thumbnail has been served from the cache (nbytes - the size of the response) """
+
+		with self.lock:
+			access = self.pending.setdefault(thumb_path, [0, 0, 0])
+			access[0] += 1
+			access[1] = time.time()
+			access[2] += nbytes or 0
+			self.counters['hits'] += 1
+			self.counters['bytes_served'] += nbytes or 0
+
+		if time.time() - self.flushed > self.FLUSH_INTERVAL and self.thread is None:
+			self.Flush()
+
+	def Miss(self, thumb_path):
+		with self.lock:
+			self.counters['misses'] += 1
+
+	def Flush(self):
+		""" Writes the counted accesses to the index """
+
+		with self.lock:
+			pending, self.pending = self.pending, {}
+			counters = self.counters
+			self.counters = dict.fromkeys(counters, 0)
+			self.flushed = time.time()
+
+		if not pending and not any(counters.values()):
+			return
+
+		with self.db as db:
+			db.executemany(
+				"UPDATE thumbs SET hits = hits + ?, accessed = MAX(accessed, ?) WHERE path = ?",
+				[(hits, accessed, path) for path, (hits, accessed, nbytes) in pending.items()]
+			)
+			# bytes served by the hits without nbytes - the indexed size of the file
+			unknown = [(path, hits) for path, (hits, accessed, nbytes) in pending.items() if not nbytes]
+			for path, hits in unknown:
+				row = db.execute("SELECT size FROM thumbs WHERE path = ?", (path, )).fetchone()
+				if row is not None:
+					counters['bytes_served'] += row[0] * hits
+			self._AddStats(db, counters)
+
+	@staticmethod
+	def _AddStats(db, counters):
+		db.executemany(
+			"INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+			[(name, value) for name, value in counters.items() if value]
+		)
+
+	def GetTotalBytes(self):
+		return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM thumbs").fetchone()[0]
+
+	def Evict(self, max_files=None):
+		""" Removes at most `max_files` cold thumbnails while the cache exceeds max_bytes.
+		Returns (removed files, removed bytes).
+		"""
+
+		max_files = max_files or self.EVICT_BATCH
+
+		while True:
+			excess = self.GetTotalBytes() - self.max_bytes
+			if excess <= 0:
+				return 0, 0
+
+			rows = self.db.execute(
+				"""SELECT path, size FROM thumbs
+				WHERE path NOT IN (SELECT path FROM sources)
+				ORDER BY {} LIMIT ?""".format(self.POLICIES[self.policy]),
+				(max_files, )
+			).fetchall()
+
+			removed, removed_bytes, forgotten, forgotten_bytes = [], 0, [], 0
+			for path, size in rows:
+				if removed_bytes + forgotten_bytes >= excess:
+					break
+				try:
+					os.remove(path)
+					removed.append(path)
+					removed_bytes += size
+				except FileNotFoundError:
+					forgotten.append(path)
+					forgotten_bytes += size
+				except OSError as ex:
+					log.warning("Cannot remove thumbnail %s: %s", path, ex)
+
+			with self.db as db:
+				db.executemany("DELETE FROM thumbs WHERE path = ?", [(path, ) for path in removed + forgotten])
+				self._AddStats(db, {'evicted': len(removed), 'evicted_bytes': removed_bytes})
+
+			# only files removed by someone else (e.g. BlobStore.GC) - the next batch
+			if removed or not forgotten:
+				return len(removed), removed_bytes
+
+	def Start(self, interval=None):
+		""" Flushes the accesses and evicts in a background thread, batch by batch """
+
+		if self.thread is not None:
+			return
+		interval = interval or self.FLUSH_INTERVAL
+		self.stopping.clear()
+
+		def run():
+			while not self.stopping.is_set():
+				try:
+					self.Flush()
+					removed, removed_bytes = self.Evict()
+				except Exception as ex:
+					log.exception("Thumbnails cache maintenance failed: %s", ex)
+					removed = 0
+				# the next batch at once if there is still too much
+				if not removed:
+					self.stopping.wait(interval)
+
+		self.thread = threading.Thread(target=run, name='thumb-cache', daemon=True)
+		self.thread.start()
+
+	def Stop(self):
+		if self.thread is not None:
+			self.stopping.set()
+			self.thread.join()
+			self.thread = None
+		self.Flush()
+
+	def GetStats(self):
+		self.Flush()
+		stats = {'hits': 0, 'misses': 0, 'bytes_served': 0, 'evicted': 0, 'evicted_bytes': 0}
+		stats.update(self.db.execute("SELECT name, value FROM stats").fetchall())
+		files, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM thumbs").fetchone()
+		requests = stats['hits'] + stats['misses']
+		stats.update({
+			'files': files,
+			'bytes': total,
+			'max_bytes': self.max_bytes,
+			'hit_ratio': float(stats['hits']) / requests if requests else None,
+		})
+		return stats
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(prog='python -m tru.gfx.cache', description='Thumbnails disk cache')
+	parser.add_argument('--db', required=True, help='SQLite index')
+	parser.add_argument('--max-bytes', type=int, required=True)
+	parser.add_argument('--policy', choices=sorted(ThumbCache.POLICIES), default='lru')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	evict = sub.add_parser('evict', help='remove cold thumbnails')
+	evict.add_argument('--batch', type=int, default=ThumbCache.EVICT_BATCH)
+
+	add = sub.add_parser('add', help='register existing thumbnails')
+	add.add_argument('paths', nargs='+')
+
+	sub.add_parser('stats', help='print cache statistics')
+
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO)
+
+	cache = ThumbCache(args.db, args.max_bytes, policy=args.policy)
+
+	if args.command == 'evict':
+		files, size = 0, 0
+		while True:
+			removed, removed_bytes = cache.Evict(args.batch)
+			if not removed:
+				break
+			files, size = files + removed, size + removed_bytes
+		print('Removed: {} files, {} bytes'.format(files, size))
+	elif args.command == 'add':
+		print('Added: {}'.format(sum(1 for path in args.paths if cache.Add(os.path.abspath(path)))))
+	elif args.command == 'stats':
+		print(json.dumps(cache.GetStats(), indent=2))
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -3,17 +3,57 @@ import os
 import copy
 import zlib
 import collections
+from hashlib import md5
 from struct import pack, unpack
 from base64 import urlsafe_b64decode, urlsafe_b64encode
 
 import urllib.request
 import urllib.error
 import urllib.parse
-from urllib.parse import quote
+from urllib.parse import quote, unquote
 
 from ..fs.utils import path_replace_ext
-from ..io.hash import Hash, Hash_v1, Distribution, EncodeHash, DecodeHash
-from .thumbs import Operations
+from ..io.hash import Hash, Hash_v1, Hash_v2, Distribution, EncodeHash, DecodeHash
+from ..utils.lru import LRUCache
+from .thumbs import Operations, CanSave
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+def ParseAccept(accept):
+	""" HTTP Accept header -> {mimetype: q} """
+
+	result = {}
+	for item in (accept or '').split(','):
+		mimetype, *params = [i.strip() for i in item.split(';')]
+		if not mimetype:
+			continue
+		q = 1.0
+		for param in params:
+			name, _, value = param.partition('=')
+			if name.strip() == 'q':
+				try:
+					q = float(value)
+				except ValueError:
+					q = 0.0
+		result[mimetype.lower()] = q
+	return result
+
+
+_plain_name_re = re.compile(r'[0-9a-zA-Z_.\-~/]*\Z')
+
+
+def CanonicalFileName(filename):
+	""" The URL quoted form of a file name given quoted or not (str or bytes), as hashed in the tokens """
+
+	if isinstance(filename, bytes):
+		filename = filename.decode('utf8')
+	if _plain_name_re.match(filename):
+		return filename.encode('ascii')  # the same quoted
+	return '/'.join(quote(unquote(i)) for i in filename.split('/')).encode('ascii')
 
 
 class ImageType(object):
@@ -277,7 +317,12 @@ class ImageType(object):
 		def GetNoPictureSizeInts(self):
 			return self.get_size()
 
-	def __init__(self, id, thumb, format='JPEG', descr='', watermark=False, prefix='w', restricted=False, metadata=False, progressive=True, quality=95, optimize=True):
+	# speed tier of the resize (Operations.TransformSize.SPEEDS) and its bits in the format byte
+	speeds = {'best': 0x00, 'balanced': 0x40, 'fast': 0x80}
+	speeds_by_bits = {v: k for k, v in speeds.items()}
+
+	def __init__(self, id, thumb, format='JPEG', descr='', watermark=False, prefix='w', restricted=False, metadata=False, progressive=True, quality=95, optimize=True, speed='best', animated=False, policy=None):
+		assert speed in self.speeds, "Unknown speed: {}".format(speed)
 		self.id = id
 		self.thumb = thumb
 		self.descr = descr
@@ -290,7 +335,9 @@ class ImageType(object):
 		self.deprecated = False
 		self.tmp_preview = False
 		self.is_custom = False
-		self.save_to = Operations.SaveToBuf(format=format, progressive=progressive, quality=quality, optimize=optimize, metadata=metadata)
+		self.speed = speed
+		# policy - EffortPolicy of the encoder (SaveToBuf.policy by default)
+		self.save_to = Operations.SaveToBuf(format=format, progressive=progressive, quality=quality, optimize=optimize, metadata=metadata, animated=animated, policy=policy, stats_key=id)
 
 	def get_path(self, image_path, keep_org_ext=False, postfix=None, force_custom=False, force_format=None):
 
@@ -308,6 +355,8 @@ class ImageType(object):
 			ext = 'jpg'
 		elif fmt == 'WEBP':
 			ext = 'webp'
+		elif fmt == 'AVIF':
+			ext = 'avif'
 		else:
 			if keep_org_ext:
 				ext = None
@@ -329,6 +378,9 @@ class ImageType(object):
 		dict['progressive'] = self.save_to.progressive
 		dict['quality'] = self.save_to.quality
 		dict['optimize'] = self.save_to.optimize
+		dict['speed'] = self.speed
+		if self.save_to.animated:
+			dict['animated'] = True
 		dict['color'] = self.color
 		dict['contrast'] = self.contrast
 		dict['brightness'] = self.brightness
@@ -337,7 +389,12 @@ class ImageType(object):
 	def GetOps(self, watermark=None, allow_resize=True):
 		# Returns list of image transformations
 		if allow_resize is True and isinstance(self.thumb, Operations.Transform):
-			yield self.thumb
+			if isinstance(self.thumb, Operations.TransformSize) and self.thumb.speed != self.speed:
+				thumb = copy.copy(self.thumb)
+				thumb.speed = self.speed
+				yield thumb
+			else:
+				yield self.thumb
 		if self.color:
 			yield Operations.Color(self.color)
 		if self.contrast:
@@ -352,6 +409,19 @@ class ImageType(object):
 			img_w, img_h = i.GetFinalSize(img_w, img_h)
 		return img_w, img_h
 
+	def GetFinalSizes(self, widths, heights, **kwargs):
+		""" GetFinalSize of many images at once (as numpy array operations), returns lists of widths and heights """
+
+		if np is None:
+			sizes = [self.GetFinalSize(w, h, **kwargs) for w, h in zip(widths, heights)]
+			return [w for w, h in sizes], [h for w, h in sizes]
+
+		img_w, img_h = np.asarray(widths, dtype=np.int64), np.asarray(heights, dtype=np.int64)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			for i in self.GetOps(**kwargs):
+				img_w, img_h = i.GetFinalSizes(img_w, img_h)
+		return np.broadcast_to(img_w, len(widths)).tolist(), np.broadcast_to(img_h, len(heights)).tolist()
+
 	def PublicId(self):
 		return self.prefix + str(self.id)
 
@@ -364,9 +434,24 @@ class ImageType(object):
 
 	url_fmt_re = re.compile(r'[0-9a-zA-Z_\-=]+')
 
+	# Tokens start with the encoder version, the legacy ones with the format byte (never 0)
+	ENCODER_VERSION = 0
+
+	# Successfully decoded tokens: (data, filename, key) -> ImageType
+	decoded = LRUCache(max_items=10000)
+
 	@staticmethod
 	def Decode(data, filename, key):
 
+		cache_key = (data, filename, key)
+		it = ImageType.decoded.Get(cache_key)
+		if it is None:
+			it = ImageType.decoded.Set(cache_key, ImageType._Decode(data, filename, key))
+		return copy.copy(it)
+
+	@staticmethod
+	def _Decode(data, filename, key):
+
 		assert isinstance(key, bytes), "Key must be an instance of bytes, got {}".format(repr(key))
 
 		if not ImageType.url_fmt_re.match(data):
@@ -375,7 +460,59 @@ class ImageType(object):
 		filename = filename.encode('utf8') if isinstance(filename, str) else filename
 		data = urlsafe_b64decode(data.encode('ascii') if isinstance(data, str) else data)
 
-		format, quality, op_code, color, contrast, brightness = unpack('!BBBbbb', data[0:6])
+		if len(data) < 10:
+			raise ValueError('Invalid fmt data: {}'.format(data))
+
+		if data[0] == ImageType.ENCODER_VERSION:
+			if unpack('!I', data[-4:])[0] != Hash(key + data[:-4] + CanonicalFileName(filename)) & 0xFFFFFFFF:
+				raise ValueError('Invalid checksum')
+			trx = data[1:-4]
+		else:
+			trx = ImageType._VerifyLegacy(data, filename, key)
+
+		format, quality, op_code, color, contrast, brightness = unpack('!BBBbbb', trx[0:6])
+
+		speed = ImageType.speeds_by_bits.get(format & 0xC0)
+		if speed is None:
+			raise ValueError('Invalid speed bits: {}'.format(format & 0xC0))
+
+		progressive = False
+		animated = False
+		optimize = bool(format & 0x20)
+		tmp_preview = bool(format & 0x10)
+		force_format = format & 0x0F
+		if force_format == 0x01:
+			format = None
+		elif force_format == 0x02:
+			format = 'JPEG'
+		elif force_format == 0x03:
+			format = 'JPEG'
+			progressive = True
+		elif force_format == 0x04:
+			format = 'PNG'
+		elif force_format == 0x05:
+			format = 'GIF'
+		elif force_format == 0x06:
+			format = 'WEBP'
+		elif force_format == 0x07:
+			format = 'AVIF'
+		elif force_format == 0x08:
+			format = 'WEBP'
+			animated = True
+
+		thumb = ImageType.classes_map[op_code].decode(trx[6:])
+		it = ImageType(0x9999, thumb, format, 'Custom format', watermark=False, prefix='', quality=quality, progressive=progressive, optimize=optimize, speed=speed, animated=animated)
+
+		it.color = color
+		it.contrast = contrast
+		it.brightness = brightness
+		it.tmp_preview = tmp_preview
+
+		return it
+
+	@staticmethod
+	def _VerifyLegacy(data, filename, key):
+		""" Tokens without the encoder version, returns the transformation data """
 
 		trx = data[:-4]
 		org_hash = unpack('!I', data[-4:])[0]
@@ -414,36 +551,46 @@ class ImageType(object):
 		if org_hash != trx_hash:
 			raise ValueError('Invalid checksum')
 
-		progressive = False
-		optimize = bool(format & 0x20)
-		tmp_preview = bool(format & 0x10)
-		force_format = format & 0x0F
-		if force_format == 0x01:
-			format = None
-		elif force_format == 0x02:
-			format = 'JPEG'
-		elif force_format == 0x03:
-			format = 'JPEG'
-			progressive = True
-		elif force_format == 0x04:
-			format = 'PNG'
-		elif force_format == 0x05:
-			format = 'GIF'
-		elif force_format == 0x06:
-			format = 'WEBP'
-
-		thumb = ImageType.classes_map[op_code].decode(trx[6:])
-		it = ImageType(0x9999, thumb, format, 'Custom format', watermark=False, prefix='', quality=quality, progressive=progressive, optimize=optimize)
+		return trx
 
-		it.color = color
-		it.contrast = contrast
-		it.brightness = brightness
-		it.tmp_preview = tmp_preview
+	def Encode(self, filename, key, **kwargs):
+		assert isinstance(key, bytes), "Key must be an instance of bytes, got {}".format(repr(key))
 
-		return it
+		trx = self.GetTrx(**kwargs)
+		trx_hash = Hash(key + trx + CanonicalFileName(filename)) & 0xFFFFFFFF
+		return urlsafe_b64encode(trx + pack('!I', trx_hash)).decode('ascii')
 
-	def Encode(self, filename, key, **kwargs):
+	def EncodeMany(self, filenames, key, **kwargs):
+		""" Encode() of many files at once (e.g. all images of a gallery), returns the list of tokens """
 		assert isinstance(key, bytes), "Key must be an instance of bytes, got {}".format(repr(key))
+		if Hash is not Hash_v2:
+			raise NotImplementedError("EncodeMany continues md5 states, Hash is {}".format(Hash.__name__))
+
+		trx = self.GetTrx(**kwargs)
+		prefix = md5(key + trx)
+
+		# len(trx) % 3 == 2: all but the last 2 bytes of trx are the same base64 chars in every token
+		head = urlsafe_b64encode(trx[:-2]).decode('ascii')
+		tail = trx[-2:]
+
+		tokens = []
+		for filename in filenames:
+			m = prefix.copy()
+			m.update(CanonicalFileName(filename))
+			# Hash(...) & 0xFFFFFFFF are the last 4 bytes of the md5 digest
+			tokens.append(head + urlsafe_b64encode(tail + m.digest()[-4:]).decode('ascii'))
+		return tokens
+
+	def GetTrx(self, **kwargs):
+		""" Packed transformation - the constant part of the tokens, memoized """
+
+		state = (
+			self.thumb.op_code, self.thumb._getOpParams(), self.save_to.format, self.save_to.progressive, self.save_to.optimize, self.save_to.quality, self.save_to.animated,
+			self.tmp_preview, self.speed, self.color, self.contrast, self.brightness, tuple(sorted(kwargs.items()))
+		)
+		memo = self.__dict__.get('_trx')
+		if memo is not None and memo[0] == state:
+			return memo[1]
 
 		format = 0x01  # Default
 
@@ -458,6 +605,10 @@ class ImageType(object):
 			format = 0x05
 		elif force_format == 'WEBP':
 			format = 0x06
+			if self.save_to.animated:
+				format = 0x08  # WEBP+animated
+		elif force_format == 'AVIF':
+			format = 0x07
 
 		if self.tmp_preview:
 			format |= 0x10
@@ -465,6 +616,8 @@ class ImageType(object):
 		if self.save_to.optimize:
 			format |= 0x20
 
+		format |= self.speeds[kwargs.get('speed') or self.speed]
+
 		color, contrast, brightness = self.color, self.contrast, self.brightness
 		if 'color' in kwargs:
 			color = kwargs['color']
@@ -473,20 +626,22 @@ class ImageType(object):
 		if 'brightness' in kwargs:
 			brightness = kwargs['brightness']
 
-		trx = pack('!BBBbbb', format, self.save_to.quality, self.thumb.op_code, color, contrast, brightness) + self.thumb._getOpParams()
+		trx = pack('!BBBBbbb', self.ENCODER_VERSION, format, self.save_to.quality, self.thumb.op_code, color, contrast, brightness) + self.thumb._getOpParams()
 
 		if ((len(trx) + 4) % 3):
 			trx += pack('!B', 0) * (3 - ((len(trx) + 4) % 3))
 
-		trx_hash = Hash(key + trx + filename.encode('utf8')) & 0xFFFFFFFF
-		return urlsafe_b64encode(trx + pack('!I', trx_hash)).decode('ascii')
+		self._trx = (state, trx)
+		return trx
 
-	def Clone(self, thumb=None, is_custom=None):
+	def Clone(self, thumb=None, is_custom=None, save_to=None):
 		c = copy.copy(self)
 		if thumb is not None:
 			c.thumb = thumb
 		if is_custom is not None:
 			c.is_custom = is_custom
+		if save_to is not None:
+			c.save_to = save_to
 		return c
 
 	def Upgrade(self, custom_params, imsize, focuspt):
@@ -549,6 +704,8 @@ class ImageType(object):
 			return 'GIF'
 		elif img.endswith('.webp'):
 			return 'WEBP'
+		elif img.endswith('.avif'):
+			return 'AVIF'
 		return None
 
 	def GetMimeType(self, img=None):
@@ -563,9 +720,40 @@ class ImageType(object):
 			return "image/jpeg"
 		elif fmt == 'WEBP':
 			return "image/webp"
+		elif fmt == 'AVIF':
+			return "image/avif"
 
 		return "image/jpeg"
 
+	# Alternative formats served to browsers accepting them (in order of preference)
+	VARIANT_FORMATS = ('AVIF', 'WEBP')
+	VARIANT_SOURCES = {
+		'JPEG': ('AVIF', 'WEBP'),
+		'PNG': ('AVIF', 'WEBP'),
+		'GIF': ('WEBP', ),  # animated
+	}
+	variant_mimes = {'AVIF': 'image/avif', 'WEBP': 'image/webp'}
+
+	def GetVariantFormat(self, accept, img=None):
+		""" The best alternative format accepted by the browser (Accept header), None for the default one """
+
+		formats = self.VARIANT_SOURCES.get(self.save_to.format or self.GetExtFromPath(img) or 'JPEG', ())
+
+		accepted = ParseAccept(accept)
+		for fmt in formats:
+			if accepted.get(self.variant_mimes[fmt], 0) > 0 and CanSave(fmt):
+				return fmt
+		return None
+
+	def GetVariant(self, fmt):
+		""" The same ImageType saved in another format (animations are kept in WEBP) """
+		return self.Clone(save_to=self.save_to.Clone(format=fmt, animated=(fmt == 'WEBP') or None))
+
+	@staticmethod
+	def GetVariantPath(thumb_path, fmt):
+		""" Path of an alternative format of the thumbnail: "name_1.jpg" -> "name_1.jpg.webp" """
+		return '{}.{}'.format(thumb_path, fmt.lower())
+
 	def __str__(self):
 		return 'ImageType.{}({}, {})'.format(self.thumb.__class__.__name__, self.id, self.get_params())
 
@@ -605,5 +793,43 @@ class TemporaryImageType(ImageType):
 			self.contrast = params['contrast']
 		if 'brightness' in params:
 			self.brightness = params['brightness']
+		if params.get('speed') in self.speeds:
+			self.speed = params['speed']
 
 		self.deprecated = True
+
+
+SrcSetItem = collections.namedtuple('SrcSetItem', ('url', 'path', 'width', 'height'))
+
+
+def BuildSrcSets(records, image_types, key, url=None):
+	""" Thumbnails of many images in many ImageTypes at once (e.g. srcset of all images of a gallery).
+
+	records - list of (filename, width, height) of the source images
+	url     - url(filename, token, path) -> str, the token by default
+
+	Returns a list (per record) of lists of SrcSetItem (in the order of image_types), the same
+	as Encode(), get_path() and GetFinalSize() of every item.
+	"""
+
+	filenames = [i[0] for i in records]
+	widths = [i[1] for i in records]
+	heights = [i[2] for i in records]
+
+	result = [[] for i in records]
+	for it in image_types:
+		tokens = it.EncodeMany(filenames, key)
+		sizes = zip(*it.GetFinalSizes(widths, heights))
+		for items, filename, token, (w, h) in zip(result, filenames, tokens, sizes):
+			path = it.get_path(filename)
+			items.append(SrcSetItem(url(filename, token, path) if url is not None else token, path, w, h))
+	return result
+
+
+def FormatSrcSet(items):
+	""" srcset attribute: 'url 320w, url 640w' (thumbnails of the same width are listed once) """
+
+	widths = {}
+	for item in items:
+		widths.setdefault(item.width, item.url)
+	return ', '.join('{} {}w'.format(widths[w], w) for w in sorted(widths))
@@ -0,0 +1,235 @@
+"""
+Background queue for the external image optimizers (see ImageExternalOpt).
+
+Thumbnails are queued by CreateThumb.OnNewImage:
+
+	queue = OptimizerQueue('/var/lib/project/optimizer.sqlite')
+	CreateThumb.OnNewImage.append(queue.OnNewImage)
+
+and optimized by a separate process:
+
+	python -m tru.gfx.optimizer --db /var/lib/project/optimizer.sqlite drain
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ..utils.sqlite import LocalConnections
+from .thumbs import ImageExternalOpt
+
+log = logging.getLogger(__name__)
+
+
+class OptimizerQueue:
+	""" Persistent (SQLite) queue of images waiting for pngquant, jpegoptim, gifsicle or cwebp.
+
+	A path is queued only once, files already optimized (the same path, mtime and
+	size) are skipped. Every tool runs at most `concurrency[tool]` processes at once.
+	"""
+
+	TOOLS = {
+		'image/png': 'pngquant',
+		'image/jpeg': 'jpegoptim',
+		'image/gif': 'gifsicle',
+		'image/webp': 'cwebp',
+	}
+
+	CONCURRENCY = {
+		'pngquant': 2,
+		'jpegoptim': 2,
+		'gifsicle': 1,
+		'cwebp': 1,
+	}
+
+	STALE_TIMEOUT = 15 * 60  # running jobs older than that are queued again
+
+	def __init__(self, db_path, concurrency=None, optimize=None):
+		self.db_path = db_path
+		self.concurrency = dict(self.CONCURRENCY, **(concurrency or {}))
+		self.optimize = optimize or ImageExternalOpt
+		self.connections = LocalConnections(self.db_path)
+
+		with self.db as db:
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS jobs (
+					path TEXT PRIMARY KEY,
+					params TEXT NOT NULL,
+					queued REAL NOT NULL,
+					started REAL
+				)""")
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS done (
+					path TEXT PRIMARY KEY,
+					mtime REAL NOT NULL,
+					size INTEGER NOT NULL,
+					tool TEXT NOT NULL,
+					result TEXT NOT NULL,
+					org_size INTEGER,
+					opt_size INTEGER,
+					finished REAL NOT NULL
+				)""")
+
+	@property
+	def db(self):
+		return self.connections.Get()
+
+	@classmethod
+	def GetTool(cls, path):
+		mimetype, encoding = mimetypes.guess_type(path)
+		return cls.TOOLS.get(mimetype)
+
+	def IsOptimized(self, path):
+		try:
+			st = os.stat(path)
+		except FileNotFoundError:
+			return False
+		row = self.db.execute("SELECT mtime, size FROM done WHERE path = ?", (path, )).fetchone()
+		return row is not None and row[0] == st.st_mtime and row[1] == st.st_size
+
+	def Enqueue(self, path, params=None):
+
+		path = os.path.abspath(path)  # a single job of a file, however it is referred to
+		if self.GetTool(path) is None or self.IsOptimized(path):
+			return False
+
+		with self.db as db:
+			cur = db.execute(
+				"INSERT OR IGNORE INTO jobs (path, params, queued) VALUES (?, ?, ?)",
+				(path, json.dumps(params or {}), time.time())
+			)
+		return cur.rowcount > 0
+
+	def OnNewImage(self, thumb_path, image_path, fmt, params):
+		""" Callback for CreateThumb.OnNewImage """
+		self.Enqueue(thumb_path, {'quality': params['quality']} if 'quality' in params else {})
+
+	def _Claim(self, tools, limit):
+
+		now = time.time()
+		with self.db as db:
+			db.execute("BEGIN IMMEDIATE")
+			db.execute("UPDATE jobs SET started = NULL WHERE started < ?", (now - self.STALE_TIMEOUT, ))
+			rows = db.execute("SELECT path, params FROM jobs WHERE started IS NULL ORDER BY queued").fetchall()
+
+			claimed = []
+			for path, params in rows:
+				tool = self.GetTool(path)
+				if tools.get(tool, 0) > 0:
+					tools[tool] -= 1
+					claimed.append((path, json.loads(params), tool))
+					if len(claimed) >= limit:
+						break
+
+			db.executemany("UPDATE jobs SET started = ? WHERE path = ?", [(now, path) for path, params, tool in claimed])
+		return claimed
+
+	def _Finish(self, path, tool, result, org_size=None, opt_size=None):
+
+		try:
+			st = os.stat(path)
+			mtime, size = st.st_mtime, st.st_size
+		except FileNotFoundError:
+			mtime, size = 0, 0
+			result = 'missing'
+
+		with self.db as db:
+			db.execute("DELETE FROM jobs WHERE path = ?", (path, ))
+			db.execute(
+				"INSERT OR REPLACE INTO done (path, mtime, size, tool, result, org_size, opt_size, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(path, mtime, size, tool, result, org_size, opt_size, time.time())
+			)
+
+	def _Run(self, path, params):
+		if self.IsOptimized(path):
+			return 'skipped', None, None
+		org_size, opt_size = self.optimize(path, params)
+		return 'ok', org_size, opt_size
+
+	def Drain(self, max_jobs=None, wait_for_new=False, poll_interval=1.0):
+		""" Optimizes queued images, returns the number of processed jobs. """
+
+		executors = {tool: ThreadPoolExecutor(max_workers=n) for tool, n in self.concurrency.items() if n > 0}
+		running = {}
+		processed = 0
+
+		try:
+			while True:
+				free = {tool: self.concurrency[tool] - sum(1 for t in running.values() if t[1] == tool) for tool in executors}
+				limit = max_jobs - processed - len(running) if max_jobs is not None else sys.maxsize
+
+				for path, params, tool in (self._Claim(free, limit) if limit > 0 else []):
+					running[executors[tool].submit(self._Run, path, params)] = (path, tool)
+
+				if not running:
+					if wait_for_new and (max_jobs is None or processed < max_jobs):
+						time.sleep(poll_interval)
+						continue
+					break
+
+				finished, pending = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					path, tool = running.pop(future)
+					processed += 1
+					try:
+						self._Finish(path, tool, *future.result())
+					except Exception as ex:
+						log.error("Cannot optimize %s: %s", path, ex)
+						self._Finish(path, tool, 'error: {}'.format(ex))
+		finally:
+			for executor in executors.values():
+				executor.shutdown(wait=True)
+
+		return processed
+
+	def GetStats(self):
+		queued = self.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+		results = self.db.execute("SELECT tool, result, COUNT(*), SUM(org_size), SUM(opt_size) FROM done GROUP BY tool, result").fetchall()
+		return {
+			'queued': queued,
+			'done': [dict(zip(('tool', 'result', 'count', 'org_size', 'opt_size'), row)) for row in results],
+		}
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(prog='python -m tru.gfx.optimizer', description='External image optimizers queue')
+	parser.add_argument('--db', required=True, help='SQLite queue database')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	drain = sub.add_parser('drain', help='optimize queued images')
+	drain.add_argument('--max-jobs', type=int, default=None)
+	drain.add_argument('--forever', action='store_true', help='wait for new jobs')
+	for tool in OptimizerQueue.CONCURRENCY:
+		drain.add_argument('--' + tool, type=int, default=None, metavar='N', help='concurrent {} processes'.format(tool))
+
+	enqueue = sub.add_parser('enqueue', help='queue images')
+	enqueue.add_argument('paths', nargs='+')
+	enqueue.add_argument('--quality', type=int, default=None)
+
+	sub.add_parser('stats', help='print queue statistics')
+
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO)
+
+	if args.command == 'drain':
+		concurrency = {tool: getattr(args, tool) for tool in OptimizerQueue.CONCURRENCY if getattr(args, tool) is not None}
+		queue = OptimizerQueue(args.db, concurrency=concurrency)
+		print('Processed: {}'.format(queue.Drain(max_jobs=args.max_jobs, wait_for_new=args.forever)))
+	elif args.command == 'enqueue':
+		queue = OptimizerQueue(args.db)
+		params = {'quality': args.quality} if args.quality is not None else {}
+		print('Queued: {}'.format(sum(1 for path in args.paths if queue.Enqueue(path, params))))
+	elif args.command == 'stats':
+		print(json.dumps(OptimizerQueue(args.db).GetStats(), indent=2))
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
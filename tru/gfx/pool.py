@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import itertools
+import multiprocessing
+import signal
+import threading
+import concurrent.futures
+from concurrent.futures import Future
+
+from .thumbs import CreateThumb, Operations, ThumbError
+
+log = logging.getLogger(__name__)
+
+
+class RenderQueueFull(ThumbError):
+	""" Raised by RenderPool.submit when the job queue is full - show a placeholder instead. """
+	pass
+
+
+class RenderTimeout(ThumbError):
+	pass
+
+
+class RenderWorkerLost(ThumbError):
+	""" The worker process running the job died (e.g. killed by the OOM killer) """
+	pass
+
+
+def _InitWorker(started=None):
+	# Pre-import all PIL plugins, so the first job doesn't pay for it
+	from PIL import Image
+	Image.init()
+	_InitWorker.started = started
+	if Operations.SaveToBuf.stats is not None:
+		Operations.SaveToBuf.stats.Clear()  # a copy of the parent's ones (fork)
+
+
+def _OnAlarm(signum, frame):
+	raise RenderTimeout("Rendering timed out")
+
+
+def _RunJob(func, args, kwargs, timeout, job_id=None):
+
+	started = getattr(_InitWorker, 'started', None)
+	if started is not None and job_id is not None:
+		# written synchronously (and atomically - a short message to a pipe), before anything can kill the worker
+		started.send((job_id, os.getpid()))
+
+	if timeout:
+		signal.signal(signal.SIGALRM, _OnAlarm)
+		signal.setitimer(signal.ITIMER_REAL, timeout)
+	try:
+		result = func(*args, **kwargs)
+	finally:
+		if timeout:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+
+	# the encoding stats of the job are merged into the parent's ones (see RenderPool._Finish)
+	stats = Operations.SaveToBuf.stats
+	return result, (stats.Drain() if stats is not None else None)
+
+
+def _Render(image_type, src, dst, watermark=None):
+	return CreateThumb(src, dst, image_type.GetOps(watermark=watermark), image_type.save_to)
+
+
+class RenderPool:
+	""" Renders thumbnails in a fixed number of worker processes.
+
+	At most `max_queue` jobs may be pending (queued or running), submit() raises
+	RenderQueueFull above that limit. Workers are recycled after `max_jobs` jobs
+	to cap memory growth. A job running longer than its timeout fails with RenderTimeout.
+
+	Workers report the jobs they start, a job of a worker which died (multiprocessing.Pool
+	replaces it, but the job is lost) fails with RenderWorkerLost after LOST_GRACE seconds.
+
+	The encoding stats of the jobs (SaveToBuf.stats) are sent back with their results
+	and merged into the stats of this process.
+	"""
+
+	PROCESSES = 2
+	MAX_QUEUE = 32
+	MAX_JOBS = 200
+	TIMEOUT = 30
+	WATCH_INTERVAL = 0.5
+	LOST_GRACE = 2.0
+
+	def __init__(self, processes=None, max_queue=None, max_jobs=None, timeout=None):
+		self.processes = processes or self.PROCESSES
+		self.max_queue = max_queue or self.MAX_QUEUE
+		self.max_jobs = max_jobs or self.MAX_JOBS
+		self.timeout = timeout if timeout is not None else self.TIMEOUT
+		self.pending = 0
+		self.lock = threading.Lock()
+		self.jobs = {}  # job id -> [future, pid of the worker, since when the worker is dead]
+		self.ids = itertools.count()
+		self.reports, self.started = multiprocessing.Pipe(duplex=False)
+		self.pool = multiprocessing.Pool(self.processes, initializer=_InitWorker, initargs=(self.started, ), maxtasksperchild=self.max_jobs)
+		self.closed = threading.Event()
+		self.watcher = threading.Thread(target=self._Watch, name='render-pool-watcher', daemon=True)
+		self.watcher.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.shutdown()
+		return False
+
+	def submit(self, image_type, src, dst, watermark=None, timeout=None):
+		return self.Apply(_Render, image_type, src, dst, watermark=watermark, timeout=timeout)
+
+	def Apply(self, func, *args, timeout=None, **kwargs):
+
+		future = Future()
+		future.set_running_or_notify_cancel()
+
+		with self.lock:
+			if self.pending >= self.max_queue:
+				raise RenderQueueFull("Render queue is full ({} jobs)".format(self.pending))
+			self.pending += 1
+			job_id = next(self.ids)
+			self.jobs[job_id] = [future, None, None]
+
+		def done(result):
+			result, stats = result
+			if stats and Operations.SaveToBuf.stats is not None:
+				Operations.SaveToBuf.stats.Merge(stats)
+			self._Finish(job_id, result=result)
+
+		def failed(ex):
+			self._Finish(job_id, ex=ex)
+
+		try:
+			self.pool.apply_async(_RunJob, (func, args, kwargs, timeout or self.timeout, job_id), callback=done, error_callback=failed)
+		except Exception:
+			with self.lock:
+				self.jobs.pop(job_id, None)
+			self._Release()
+			raise
+
+		return future
+
+	def _Release(self):
+		with self.lock:
+			self.pending -= 1
+
+	def _Finish(self, job_id, result=None, ex=None):
+
+		with self.lock:
+			job = self.jobs.pop(job_id, None)
+		if job is None:
+			return  # already failed by the watcher
+		self._Release()
+		if ex is not None:
+			job[0].set_exception(ex)
+		else:
+			job[0].set_result(result)
+
+	def _Watch(self):
+
+		while not self.closed.is_set():
+			try:
+				while self.reports.poll(self.WATCH_INTERVAL):
+					job_id, pid = self.reports.recv()
+					with self.lock:
+						if job_id in self.jobs:
+							self.jobs[job_id][1] = pid
+			except (EOFError, OSError):
+				return
+			self._Reap()
+
+	def _Reap(self):
+
+		now = time.monotonic()
+		lost = []
+		with self.lock:
+			for job_id, job in self.jobs.items():
+				if job[1] is None or _IsAlive(job[1]):
+					continue
+				if job[2] is None:
+					job[2] = now  # the result may be still on its way
+				elif now - job[2] >= self.LOST_GRACE:
+					lost.append((job_id, job[1]))
+
+		for job_id, pid in lost:
+			log.error("Render worker %s died, its job is lost", pid)
+			self._Finish(job_id, ex=RenderWorkerLost("The worker process {} died".format(pid)))
+
+	def shutdown(self, wait=True):
+		self.pool.close()
+		if wait:
+			# Pool.join() would wait forever for the results of the lost jobs,
+			# the workers are idle once all the other jobs are finished
+			with self.lock:
+				futures = [job[0] for job in self.jobs.values()]
+			concurrent.futures.wait(futures)
+		self.pool.terminate()
+		self.closed.set()
+		self.watcher.join()
+		self.started.close()
+		self.reports.close()
+
+
+def _IsAlive(pid):
+	# exited workers are reaped by the pool, so they do not linger as zombies
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
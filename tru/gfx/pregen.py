@@ -0,0 +1,324 @@
+"""
+Bulk (re)generation of thumbnails for whole upload trees, e.g. after adding a new
+ImageType or changing its quality:
+
+	python -m tru.gfx.pregen --manifest /var/tmp/pregen.sqlite --types project.images:IMAGE_TYPES scan run
+
+The manifest (SQLite) holds all (source, ImageType) pairs found under the root
+directory (FileMgr.UPLOAD_DIR by default) and the finished ones, so a killed run
+resumes where it stopped. Thumbnails newer than their source are skipped, unless
+the ImageType changed since they were rendered (its fingerprint, see GetFingerprint).
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import importlib
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from ..utils.sqlite import LocalConnections
+from .coder import ImageType
+from .pool import RenderPool
+from .thumbs import CreateThumbs
+
+log = logging.getLogger(__name__)
+
+
+PENDING, DONE, FRESH, FAILED = 0, 1, 2, 3
+
+
+def LoadObject(spec):
+	""" 'package.module:attr.attr' -> object """
+
+	module, _, attrs = spec.partition(':')
+	obj = importlib.import_module(module)
+	for attr in filter(None, attrs.split('.')):
+		obj = getattr(obj, attr)
+	return obj
+
+
+def GetImageTypes(obj, deprecated=False):
+	""" ImageTypes from a list, tuple, dict or an object with ImageType attributes
+	(deprecated ones too with `deprecated`, e.g. to recognize their thumbnails)
+	"""
+
+	if isinstance(obj, dict):
+		obj = obj.values()
+	elif not isinstance(obj, (list, tuple, set)):
+		obj = [getattr(obj, i) for i in dir(obj) if not i.startswith('_')]
+	return [i for i in obj if isinstance(i, ImageType) and not isinstance(i.thumb, ImageType.Original) and (deprecated or not i.deprecated)]
+
+
+def GetFingerprint(it):
+	""" Changes with the definition of the ImageType (operation, format, quality, ...) """
+	return it.GetTrx().hex()
+
+
+def FindSources(root, image_types):
+	""" Yields the original images under root (their thumbnails and their variants are skipped,
+	so are symlinks - references to the blobs of tru.fs.blobs, rendered from the blobs)
+
+	image_types - all the known ImageTypes, not only the ones to render, otherwise the
+	              thumbnails of the others are taken for sources.
+	"""
+
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames.sort()
+		images = sorted(
+			os.path.join(dirpath, i) for i in filenames
+			if ImageType.GetExtFromPath(i) and '.RND' not in i and not os.path.islink(os.path.join(dirpath, i))
+		)
+		thumbs = {it.get_path(i) for i in images for it in image_types}
+		thumbs.update([ImageType.GetVariantPath(t, fmt) for t in thumbs for fmt in ImageType.VARIANT_FORMATS])
+		for i in images:
+			if i not in thumbs:
+				yield i
+
+
+def _RenderSource(source, jobs, watermark=None, force=False, stale=()):
+	""" Runs in a worker: renders thumbnails of a single source which are older than it
+	(or `stale` - rendered by a previous definition of their ImageType)
+	"""
+
+	src_mtime = os.path.getmtime(source)
+	results = {}
+	todo = []
+	for thumb_path, it in jobs:
+		if not force and thumb_path not in stale and os.path.isfile(thumb_path) and os.path.getmtime(thumb_path) >= src_mtime:
+			results[thumb_path] = FRESH
+		else:
+			todo.append((thumb_path, it))
+
+	if todo:
+		CreateThumbs(source, todo, watermark=watermark, workers=1)
+		results.update((thumb_path, DONE) for thumb_path, it in todo)
+
+	return results
+
+
+class Pregenerator:
+	""" known_types - all the ImageTypes (also deprecated ones and not rendered now) for
+	                  recognizing the thumbnails while scanning, image_types by default.
+	"""
+
+	PROGRESS_INTERVAL = 10  # seconds
+	BATCH = 1000  # rows of the manifest read at once
+
+	def __init__(self, manifest_path, image_types, watermark=None, known_types=None):
+		self.manifest_path = manifest_path
+		self.image_types = {it.id: it for it in image_types}
+		self.known_types = list(known_types) if known_types is not None else list(image_types)
+		self.fingerprints = {it.id: GetFingerprint(it) for it in image_types}
+		self.watermark = watermark
+		self.connections = LocalConnections(self.manifest_path)
+
+		with self.db as db:
+			db.execute("""
+				CREATE TABLE IF NOT EXISTS work (
+					thumb TEXT PRIMARY KEY,
+					source TEXT NOT NULL,
+					type_id INTEGER NOT NULL,
+					status INTEGER NOT NULL DEFAULT 0,
+					error TEXT,
+					fingerprint TEXT
+				)""")
+			if 'fingerprint' not in [i[1] for i in db.execute("PRAGMA table_info(work)")]:
+				# a manifest of an older version: the finished work is taken as rendered by the current types
+				db.execute("ALTER TABLE work ADD COLUMN fingerprint TEXT")
+				db.executemany(
+					"UPDATE work SET fingerprint = ? WHERE type_id = ? AND status IN (?, ?)",
+					[(fingerprint, type_id, DONE, FRESH) for type_id, fingerprint in self.fingerprints.items()]
+				)
+			db.execute("DROP INDEX IF EXISTS work_status")
+			db.execute("CREATE INDEX IF NOT EXISTS work_pending ON work (status, source, thumb)")
+
+			# thumbnails rendered by another definition of their ImageType are rendered again
+			for type_id, fingerprint in self.fingerprints.items():
+				db.execute(
+					"UPDATE work SET status = ? WHERE type_id = ? AND status IN (?, ?) AND fingerprint IS NOT ?",
+					(PENDING, type_id, DONE, FRESH, fingerprint)
+				)
+
+	@property
+	def db(self):
+		return self.connections.Get()
+
+	def Scan(self, root):
+		""" Adds the work found under root to the manifest, returns the number of new items """
+
+		added = 0
+		batch = []
+		for source in FindSources(root, self.known_types):
+			batch.extend((it.get_path(source), source, it.id) for it in self.image_types.values())
+			if len(batch) >= 1000:
+				added += self._Add(batch)
+				batch = []
+		return added + self._Add(batch)
+
+	def _Add(self, batch):
+		with self.db as db:
+			return db.executemany("INSERT OR IGNORE INTO work (thumb, source, type_id) VALUES (?, ?, ?)", batch).rowcount
+
+	def Retry(self):
+		with self.db as db:
+			return db.execute("UPDATE work SET status = ?, error = NULL WHERE status = ?", (PENDING, FAILED)).rowcount
+
+	def GetStats(self):
+		stats = dict.fromkeys(('pending', 'done', 'fresh', 'failed'), 0)
+		names = {PENDING: 'pending', DONE: 'done', FRESH: 'fresh', FAILED: 'failed'}
+		for status, count in self.db.execute("SELECT status, COUNT(*) FROM work GROUP BY status"):
+			stats[names[status]] = count
+		return stats
+
+	def _PendingRows(self):
+		""" Yields (source, thumb, type_id, fingerprint) of the unfinished work, read in batches
+		(keyset pagination, the rows finished meanwhile do not shift the next batches)
+		"""
+
+		last = ('', '')
+		while True:
+			rows = self.db.execute(
+				"""SELECT source, thumb, type_id, fingerprint FROM work
+				WHERE status = ? AND (source > ? OR (source = ? AND thumb > ?))
+				ORDER BY source, thumb LIMIT ?""",
+				(PENDING, last[0], last[0], last[1], self.BATCH)
+			).fetchall()
+			yield from rows
+			if len(rows) < self.BATCH:
+				return
+			last = rows[-1][:2]
+
+	def _PendingSources(self):
+		""" Yields (source, [(thumb_path, ImageType), ...], stale thumbs) of the unfinished work """
+
+		source, jobs, stale = None, [], set()
+		for src, thumb, type_id, fingerprint in self._PendingRows():
+			it = self.image_types.get(type_id)
+			if it is None:
+				continue
+			if src != source and jobs:
+				yield source, jobs, stale
+				jobs, stale = [], set()
+			source = src
+			jobs.append((thumb, it))
+			if fingerprint is not None and fingerprint != self.fingerprints[type_id]:
+				stale.add(thumb)
+		if jobs:
+			yield source, jobs, stale
+
+	def _CountPendingSources(self):
+		ids = list(self.image_types)
+		return self.db.execute(
+			"SELECT COUNT(DISTINCT source) FROM work WHERE status = ? AND type_id IN ({})".format(', '.join('?' * len(ids))),
+			[PENDING] + ids
+		).fetchone()[0]
+
+	def _Finish(self, source, jobs, results=None, error=None):
+		with self.db as db:
+			if error is not None:
+				db.executemany("UPDATE work SET status = ?, error = ? WHERE thumb = ?", [(FAILED, error, thumb) for thumb, it in jobs])
+			else:
+				types = {thumb: it.id for thumb, it in jobs}
+				db.executemany(
+					"UPDATE work SET status = ?, fingerprint = ? WHERE thumb = ?",
+					[(status, self.fingerprints[types[thumb]], thumb) for thumb, status in results.items()]
+				)
+
+	def Run(self, processes=None, timeout=300, force=False, progress=None):
+		""" Renders the pending work in a RenderPool, returns the stats """
+
+		progress = progress or self.PrintProgress
+		total = self._CountPendingSources()
+		started = last_report = time.time()
+		finished = 0
+
+		with RenderPool(processes=processes, timeout=timeout) as pool:
+			running = {}
+			sources = self._PendingSources()
+			exhausted = False
+
+			while running or not exhausted:
+				while not exhausted and len(running) < pool.max_queue:
+					item = next(sources, None)
+					if item is None:
+						exhausted = True
+						break
+					source, jobs, stale = item
+					running[pool.Apply(_RenderSource, source, jobs, watermark=self.watermark, force=force, stale=stale)] = item
+
+				if not running:
+					break
+
+				done, pending = wait(running, return_when=FIRST_COMPLETED)
+				for future in done:
+					source, jobs, stale = running.pop(future)
+					finished += 1
+					try:
+						self._Finish(source, jobs, future.result())
+					except Exception as ex:
+						log.error("Cannot render %s: %s", source, ex)
+						self._Finish(source, jobs, error=str(ex) or ex.__class__.__name__)
+
+				if time.time() - last_report >= self.PROGRESS_INTERVAL:
+					progress(finished, total, time.time() - started)
+					last_report = time.time()
+
+		progress(finished, total, time.time() - started)
+		return self.GetStats()
+
+	@staticmethod
+	def PrintProgress(finished, total, elapsed):
+		rate = finished / elapsed if elapsed > 0 else 0.0
+		eta = (total - finished) / rate if rate > 0 else None
+		print('{}/{} sources, {:.1f}/s, ETA {}'.format(
+			finished, total, rate, time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '-'
+		), flush=True)
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(prog='python -m tru.gfx.pregen', description='Thumbnails pre-generation')
+	parser.add_argument('--manifest', required=True, help='SQLite manifest (progress of the work)')
+	parser.add_argument('--types', required=True, help='ImageTypes to render: module:attribute (list, dict or a class)')
+	parser.add_argument('--only', default=None, help='comma separated ids of the ImageTypes')
+	parser.add_argument('--watermark', default=None, help='watermark operation: module:attribute')
+	parser.add_argument('--root', default=None, help='directory to scan (FileMgr.UPLOAD_DIR by default)')
+	parser.add_argument('--processes', type=int, default=os.cpu_count())
+	parser.add_argument('--timeout', type=int, default=300, help='per source, in seconds')
+	parser.add_argument('--force', action='store_true', help='render also the fresh thumbnails')
+	parser.add_argument('--retry', action='store_true', help='render again the failed ones')
+	parser.add_argument('commands', nargs='+', choices=('scan', 'run', 'stats'))
+
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO)
+
+	known_types = GetImageTypes(LoadObject(args.types), deprecated=True)
+	image_types = [it for it in known_types if not it.deprecated]
+	if args.only:
+		only = set(map(int, args.only.split(',')))
+		image_types = [it for it in image_types if it.id in only]
+	watermark = LoadObject(args.watermark) if args.watermark else None
+
+	pregen = Pregenerator(args.manifest, image_types, watermark=watermark, known_types=known_types)
+
+	for command in args.commands:
+		if command == 'scan':
+			root = args.root
+			if root is None:
+				from ..lib.FilesMgr import FileMgr
+				root = FileMgr.UPLOAD_DIR
+			print('Added: {}'.format(pregen.Scan(root)))
+		elif command == 'run':
+			if args.retry:
+				pregen.Retry()
+			print(pregen.Run(processes=args.processes, timeout=args.timeout, force=args.force))
+		elif command == 'stats':
+			print(pregen.GetStats())
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
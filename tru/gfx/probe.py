@@ -0,0 +1,189 @@
+"""
+Image dimensions read from the file header, without decoding any pixels.
+Supports JPEG, PNG, GIF and WEBP; only the headers (and JPEG segment markers) are read.
+"""
+
+import os
+from struct import unpack
+
+from ..utils.lru import LRUCache
+from ..utils.sqlite import LocalConnections
+
+
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+_PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+
+def _ProbeJPEG(f):
+
+	f.seek(2)
+	while True:
+		b = f.read(1)
+		if not b:
+			return None
+		if b != b'\xff':
+			continue
+
+		marker = f.read(1)
+		while marker == b'\xff':
+			marker = f.read(1)
+		if not marker:
+			return None
+		marker = marker[0]
+
+		if marker == 0xD9 or marker == 0xDA:  # EOI, SOS - no SOF found
+			return None
+		if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # no length
+			continue
+
+		length = f.read(2)
+		if len(length) != 2:
+			return None
+		length = unpack('>H', length)[0]
+
+		if marker in _SOF_MARKERS:
+			data = f.read(6)
+			if len(data) != 6:
+				return None
+			precision, height, width, components = unpack('>BHHB', data)
+			return {'format': 'JPEG', 'width': width, 'height': height, 'mode': _JPEG_MODES.get(components, 'RGB')}
+
+		f.seek(length - 2, os.SEEK_CUR)
+
+
+def _ProbePNG(header):
+	if header[12:16] != b'IHDR':
+		return None
+	width, height, depth, color = unpack('>IIBB', header[16:26])
+	mode = _PNG_MODES.get(color, 'RGB')
+	if color == 0 and depth == 1:
+		mode = '1'
+	elif color == 0 and depth == 16:
+		mode = 'I'
+	return {'format': 'PNG', 'width': width, 'height': height, 'mode': mode}
+
+
+def _ProbeGIF(header):
+	width, height = unpack('<HH', header[6:10])
+	return {'format': 'GIF', 'width': width, 'height': height, 'mode': 'P'}
+
+
+def _ProbeWEBP(header):
+
+	chunk = header[12:16]
+	if chunk == b'VP8 ':
+		if header[23:26] != b'\x9d\x01\x2a':
+			return None
+		width, height = unpack('<HH', header[26:30])
+		return {'format': 'WEBP', 'width': width & 0x3FFF, 'height': height & 0x3FFF, 'mode': 'RGB'}
+	elif chunk == b'VP8L':
+		if header[20] != 0x2F:
+			return None
+		bits = int.from_bytes(header[21:25], 'little')
+		return {'format': 'WEBP', 'width': (bits & 0x3FFF) + 1, 'height': ((bits >> 14) & 0x3FFF) + 1, 'mode': 'RGBA' if bits & (1 << 28) else 'RGB'}
+	elif chunk == b'VP8X':
+		flags = header[20]
+		width = int.from_bytes(header[24:27], 'little') + 1
+		height = int.from_bytes(header[27:30], 'little') + 1
+		return {'format': 'WEBP', 'width': width, 'height': height, 'mode': 'RGBA' if flags & 0x10 else 'RGB'}
+	return None
+
+
+def ProbeImage(stream):
+	""" Returns {'format', 'width', 'height', 'mode'} or None for unsupported/broken files.
+
+	stream - a path or a seekable binary file (its position is not restored).
+	"""
+
+	if not hasattr(stream, 'read'):
+		try:
+			with open(stream, 'rb') as f:
+				return ProbeImage(f)
+		except (IOError, OSError):
+			return None
+
+	try:
+		stream.seek(0)
+		header = stream.read(32)
+
+		if header[:3] == b'\xff\xd8\xff':
+			return _ProbeJPEG(stream)
+		if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) >= 26:
+			return _ProbePNG(header)
+		if header[:6] in (b'GIF87a', b'GIF89a') and len(header) >= 10:
+			return _ProbeGIF(header)
+		if header[:4] == b'RIFF' and header[8:12] == b'WEBP' and len(header) >= 30:
+			return _ProbeWEBP(header)
+	except Exception:
+		pass
+
+	return None
+
+
+def ProbeImageSize(stream):
+	meta = ProbeImage(stream)
+	return (meta['width'], meta['height']) if meta else None
+
+
+class SizeIndex:
+	""" Memoized image sizes keyed by (path, mtime, size).
+
+	An in-process LRU, optionally backed by an SQLite database shared by
+	all workers. `fallback(path)` is called for files the header parser
+	does not support (e.g. PIL based GetImageSize).
+	"""
+
+	_missing = object()
+
+	def __init__(self, max_items=10000, db_path=None, fallback=None):
+		self.cache = LRUCache(max_items=max_items)
+		self.db_path = db_path
+		self.fallback = fallback
+		self.connections = LocalConnections(self.db_path)
+
+		if db_path is not None:
+			with self.db as db:
+				db.execute("""
+					CREATE TABLE IF NOT EXISTS sizes (
+						path TEXT PRIMARY KEY,
+						mtime INTEGER NOT NULL,
+						size INTEGER NOT NULL,
+						width INTEGER,
+						height INTEGER
+					)""")
+
+	@property
+	def db(self):
+		return self.connections.Get()
+
+	def Get(self, path):
+		""" Returns (width, height) or None """
+
+		try:
+			st = os.stat(path)
+		except (IOError, OSError):
+			return None
+
+		key = (path, st.st_mtime_ns, st.st_size)
+		res = self.cache.Get(key, self._missing)
+		if res is not self._missing:
+			return res
+
+		if self.db_path is not None:
+			row = self.db.execute("SELECT width, height FROM sizes WHERE path = ? AND mtime = ? AND size = ?", key).fetchone()
+			if row is not None:
+				return self.cache.Set(key, tuple(row) if row[0] is not None else None)
+
+		res = ProbeImageSize(path)
+		if res is None and self.fallback is not None:
+			res = self.fallback(path)
+
+		if self.db_path is not None:
+			with self.db as db:
+				db.execute(
+					"INSERT OR REPLACE INTO sizes (path, mtime, size, width, height) VALUES (?, ?, ?, ?, ?)",
+					key + (tuple(res) if res else (None, None))
+				)
+
+		return self.cache.Set(key, tuple(res) if res else None)
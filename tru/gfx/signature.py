@@ -0,0 +1,153 @@
+"""
+Placeholders and perceptual hashes of images:
+
+	BlurHash - a compact (~20-30 chars) string of a blurred placeholder, see https://blurha.sh
+	DHash    - 64-bit difference hash (gradients of a 9x8 grayscale image)
+	PHash    - 64-bit DCT hash (low frequencies of a 32x32 grayscale image)
+
+Hashes of similar images differ in a few bits (HammingDistance). All of them
+are computed on a small image, so pass the smallest version you already have.
+"""
+
+import math
+
+from PIL import Image
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+BLURHASH_SIZE = 32  # the source is scaled down to this size first
+PHASH_SIZE = 32
+
+
+def _RequireNumpy():
+	if np is None:
+		raise ImportError("Cannot import numpy module")
+
+
+def _Base83(value, length):
+	return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _Gray(img, size):
+	return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.float64)
+
+
+def _ToInt(bits):
+	return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def DHash(img):
+	_RequireNumpy()
+	pixels = _Gray(img, (9, 8))
+	return _ToInt(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _DCTMatrix(n):
+	k = np.arange(n)
+	m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * math.sqrt(2.0 / n)
+	m[0] /= math.sqrt(2.0)
+	return m
+
+
+_dct = {}
+
+
+def PHash(img):
+	_RequireNumpy()
+	dct = _dct.get(PHASH_SIZE)
+	if dct is None:
+		dct = _dct[PHASH_SIZE] = _DCTMatrix(PHASH_SIZE)
+
+	pixels = _Gray(img, (PHASH_SIZE, PHASH_SIZE))
+	low = (dct @ pixels @ dct.T)[:8, :8]
+	# the DC coefficient does not take part in the median
+	return _ToInt(low > np.median(low.ravel()[1:]))
+
+
+def _SRGBToLinear(values):
+	v = values / 255.0
+	return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _LinearToSRGB(value):
+	v = max(0.0, min(1.0, value))
+	if v <= 0.0031308:
+		return int(v * 12.92 * 255 + 0.5)
+	return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def BlurHash(img, components=(4, 3)):
+	""" BlurHash with components=(x, y) cosine components (1..9 each) """
+
+	_RequireNumpy()
+	cx, cy = components
+	if not (1 <= cx <= 9 and 1 <= cy <= 9):
+		raise ValueError("BlurHash components must be in range 1..9: {}".format(components))
+
+	img = img.convert('RGB')
+	if max(img.size) > BLURHASH_SIZE:
+		img = img.copy()
+		img.thumbnail((BLURHASH_SIZE, BLURHASH_SIZE), Image.BILINEAR)
+
+	pixels = _SRGBToLinear(np.asarray(img, dtype=np.float64))
+	h, w = pixels.shape[:2]
+
+	basis_x = np.cos(np.pi * np.arange(cx)[:, None] * np.arange(w)[None, :] / w)
+	basis_y = np.cos(np.pi * np.arange(cy)[:, None] * np.arange(h)[None, :] / h)
+
+	# factors[j, i] = sum(basis_y[j, y] * basis_x[i, x] * pixels[y, x])
+	factors = np.einsum('jy,ix,yxc->jic', basis_y, basis_x, pixels) / (w * h)
+	factors[1:, :] *= 2
+	factors[0, 1:] *= 2
+	factors = factors.reshape(cx * cy, 3)
+
+	dc, ac = factors[0], factors[1:]
+
+	result = _Base83((cx - 1) + (cy - 1) * 9, 1)
+
+	if len(ac):
+		quant_max = int(max(0, min(82, math.floor(float(np.abs(ac).max()) * 166 - 0.5))))
+		max_value = (quant_max + 1) / 166.0
+		result += _Base83(quant_max, 1)
+	else:
+		max_value = 1.0
+		result += _Base83(0, 1)
+
+	result += _Base83((_LinearToSRGB(dc[0]) << 16) + (_LinearToSRGB(dc[1]) << 8) + _LinearToSRGB(dc[2]), 4)
+
+	scaled = ac / max_value
+	quant = np.clip(np.floor(np.sign(scaled) * np.abs(scaled) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+	for r, g, b in quant:
+		result += _Base83(r * 19 * 19 + g * 19 + b, 2)
+
+	return result
+
+
+def HammingDistance(a, b):
+	return bin(a ^ b).count('1')
+
+
+def HammingDistances(value, hashes):
+	""" Distances between `value` and many hashes at once (array of uint64) """
+
+	_RequireNumpy()
+	xor = np.asarray(hashes, dtype=np.uint64) ^ np.uint64(value)
+	return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def ImageSignature(img, components=(4, 3)):
+	""" {'blurhash', 'dhash', 'phash' (16 hex digits), 'width', 'height'} of the image """
+
+	return {
+		'blurhash': BlurHash(img, components),
+		'dhash': '{:016x}'.format(DHash(img)),
+		'phash': '{:016x}'.format(PHash(img)),
+		'width': img.size[0],
+		'height': img.size[1],
+	}
@@ -0,0 +1,132 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+
+from .thumbs import CreateThumb, ThumbError
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+	""" Coalesces concurrent renderings of the same output file.
+
+	Threads are coordinated in-process, processes by fcntl locks on
+	"<thumb_path>.lock" files placed next to the target. Only the first caller
+	renders, the others wait (up to `timeout` seconds) and get its result.
+	"""
+
+	TIMEOUT = 30
+	POLL_INTERVAL = 0.05
+
+	class _Flight:
+		def __init__(self):
+			self.done = threading.Event()
+			self.error = None
+
+	def __init__(self, timeout=None):
+		self.timeout = timeout or self.TIMEOUT
+		self.lock = threading.Lock()
+		self.flights = {}
+		self.stats = {'rendered': 0, 'coalesced': 0, 'timeouts': 0}
+
+	def _Count(self, name):
+		with self.lock:
+			self.stats[name] += 1
+
+	def GetStats(self):
+		with self.lock:
+			return dict(self.stats)
+
+	def Do(self, thumb_path, render):
+		""" Calls render() unless the same thumb_path is being rendered by someone else. """
+
+		with self.lock:
+			flight = self.flights.get(thumb_path)
+			leader = flight is None
+			if leader:
+				flight = self.flights[thumb_path] = SingleFlight._Flight()
+
+		if not leader:
+			if not flight.done.wait(self.timeout):
+				self._Count('timeouts')
+				raise ThumbError("Timeout while waiting for thumbnail: {}".format(thumb_path))
+			if flight.error is not None:
+				raise flight.error
+			self._Count('coalesced')
+			return thumb_path
+
+		try:
+			return self._DoLocked(thumb_path, render)
+		except Exception as ex:
+			flight.error = ex if isinstance(ex, ThumbError) else ThumbError(str(ex))
+			raise
+		finally:
+			with self.lock:
+				del self.flights[thumb_path]
+			flight.done.set()
+
+	def _DoLocked(self, thumb_path, render):
+
+		started = time.time()
+		fd = self._AcquireFileLock(thumb_path + '.lock', started)
+		try:
+			# Rendered by other process while we were waiting for the lock
+			if fd[1] and os.path.isfile(thumb_path) and os.path.getmtime(thumb_path) >= int(started):
+				self._Count('coalesced')
+				return thumb_path
+
+			result = render()
+			self._Count('rendered')
+			return result
+		finally:
+			self._ReleaseFileLock(thumb_path + '.lock', fd[0])
+
+	def _AcquireFileLock(self, lock_path, started):
+		""" Returns (fd, waited) """
+
+		waited = False
+		os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+
+		while True:
+			fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+			try:
+				while True:
+					try:
+						fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+						break
+					except BlockingIOError:
+						waited = True
+						if time.time() - started > self.timeout:
+							self._Count('timeouts')
+							raise ThumbError("Timeout while waiting for lock: {}".format(lock_path))
+						time.sleep(self.POLL_INTERVAL)
+
+				# The lock file could be removed (and recreated) by the previous owner
+				try:
+					if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+						return fd, waited
+				except FileNotFoundError:
+					pass
+			except BaseException:
+				os.close(fd)
+				raise
+
+			os.close(fd)
+
+	def _ReleaseFileLock(self, lock_path, fd):
+		try:
+			os.remove(lock_path)
+		except FileNotFoundError:
+			pass
+		os.close(fd)
+
+
+default = SingleFlight()
+
+
+def CreateThumbOnce(image_path, thumb_path, operations, save, file_perms=0o644, flight=None):
+	""" CreateThumb coalesced by SingleFlight (`default` instance if not given). """
+
+	return (flight or default).Do(thumb_path, lambda: CreateThumb(image_path, thumb_path, operations, save, file_perms=file_perms))
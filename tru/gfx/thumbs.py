@@ -1,10 +1,13 @@
 import os
 import sys
-from PIL import Image, ImageEnhance
+import PIL
+from PIL import Image, ImageEnhance, GifImagePlugin
 from io import BytesIO
 
 from . import pil_fixes
 
+import time
+import threading
 import datetime
 import logging
 import functools
@@ -12,56 +15,118 @@ import shutil
 import mimetypes
 import subprocess
 import random
+import itertools
+import json
+import queue
+from struct import pack
+from concurrent.futures import ThreadPoolExecutor
 
 from ..utils.backtrace import GetTraceback
 from ..fs.utils import TmpFile
+from ..utils.lru import LRUCache
+from .probe import SizeIndex
+from .signature import ImageSignature
 from ..io.hash import Hash, Distribution, EncodeHash, DecodeHash, coalesce
 
 import mimetypes
 mimetypes.init()
 
 try:
-	import iptcinfo3  # noqa
+	import numpy as np
 except ImportError:
-	iptcinfo3 = None
+	np = None
+
+try:
+	from PIL import _webp
+except ImportError:
+	_webp = None
 
 log = logging.getLogger(__name__)
 
+# GifStreamWriter and WebpStreamWriter use internals of PIL as they are in these versions,
+# Image.save(save_all=True) is used with the other ones
+STREAM_WRITERS_PILLOW = ('9.5', )
+_pillow_tested = '.'.join(PIL.__version__.split('.')[:2]) in STREAM_WRITERS_PILLOW
+
 
 class ThumbError(Exception):
 	pass
 
 
-def Transform(source, ops):
+class FrameLimits:
+	""" Limits for animated sources: the number of frames and the total number of
+	decoded pixels. Animations over the limit are truncated or rejected with ThumbError.
 
-	if source.format == 'GIF':
+	Static sources (see DecodeSource): the number of pixels (from the header) and the
+	memory budget of a single job (in bytes).
+	"""
 
-		im = source
-		last_frame = None
-		all_frames = []
-		try:
-			ops = list(ops)
-			for i in range(0, 0xffffffff):
-				im.seek(i)
-
-				new_frame = im.convert('RGBA')
-				if last_frame is not None and im.disposal_method == 1:
-					updated = new_frame.crop(im.dispose_extent)
-					last_frame.paste(updated, im.dispose_extent, updated)
-					new_frame = last_frame.copy()
-				else:
-					last_frame = new_frame
+	MAX_FRAMES = None
+	MAX_PIXELS = None
+	TRUNCATE = True
+	MAX_SOURCE_PIXELS = 500 * 1000 * 1000
+	MEMORY_BUDGET = 1024 * 1024 * 1024
 
-				for op in ops:
-					new_frame = op(new_frame)
+	def __init__(self, max_frames=None, max_pixels=None, truncate=None, max_source_pixels=None, memory_budget=None):
+		self.max_frames = coalesce(max_frames, self.MAX_FRAMES)
+		self.max_pixels = coalesce(max_pixels, self.MAX_PIXELS)
+		self.truncate = coalesce(truncate, self.TRUNCATE)
+		self.max_source_pixels = coalesce(max_source_pixels, self.MAX_SOURCE_PIXELS)
+		self.memory_budget = coalesce(memory_budget, self.MEMORY_BUDGET)
 
-				new_frame.info['duration'] = im.info.get("duration")
-				all_frames.append(new_frame)
+	def Exceeded(self, frames, pixels):
+		return (self.max_frames is not None and frames > self.max_frames) or (self.max_pixels is not None and pixels > self.max_pixels)
 
+
+def TransformFrames(source, ops, limits=None):
+	""" Yields transformed frames of an animated GIF one by one.
+
+	The size of the source is checked against the limits first (see CheckSource),
+	the frames are decoded in RGBA.
+	"""
+
+	limits = limits or FrameLimits()
+	ops = FuseOps(ops)
+	CheckSource(source, 1, 'RGBA', limits)
+
+	im = source
+	last_frame = None
+	pixels = 0
+	for i in range(0, 0xffffffff):
+		try:
+			im.seek(i)
 		except EOFError:
-			pass
+			return
+
+		pixels += im.size[0] * im.size[1]
+		if limits.Exceeded(i + 1, pixels):
+			if limits.truncate and i > 0:
+				log.warning("Animation truncated to %s frames", i)
+				return
+			raise ThumbError("Animation exceeds the limits: {} frames, {} pixels".format(i + 1, pixels))
+
+		new_frame = im.convert('RGBA')
+		if last_frame is not None and im.disposal_method == 1:
+			updated = new_frame.crop(im.dispose_extent)
+			last_frame.paste(updated, im.dispose_extent, updated)
+			new_frame = last_frame.copy()
+		else:
+			last_frame = new_frame
 
-		return all_frames
+		for op in ops:
+			new_frame = op(new_frame)
+
+		new_frame.info['duration'] = im.info.get("duration")
+		yield new_frame
+
+
+def Transform(source, ops, shrink_on_load=True, limits=None):
+	""" Applies the operations to an opened image; a static JPEG source is reduced
+	in place while decoding (shrink_on_load, see DecodePlan), so it is consumed by the call.
+	"""
+
+	if source.format == 'GIF':
+		return TransformFrames(source, ops, limits)
 
 	"""
 	if source.mode == 'RGBA':
@@ -72,8 +137,9 @@ def Transform(source, ops):
 			bg.paste(source, mask=source.split()[3])  # 3 is the alpha channel
 			source = bg
 	"""
-	if source.mode != 'RGB':
-		source = source.convert('RGBA')
+	ops = FuseOps(ops)
+	scale = DecodePlan(ops).GetScale(*source.size) if shrink_on_load else 1
+	source = DecodeSource(source, scale, limits)
 
 	for op in ops:
 		source = op(source)
@@ -81,18 +147,438 @@ def Transform(source, ops):
 	return source
 
 
+def _Trunc(values):
+	# int() of every item
+	return values.astype(np.int64)
+
+
+def _CropExtent(size, target, div):
+	# size of the crop (int((size - target) / div), int((size - target) / div + target)) of FitAll
+	offset = (size - target) / div
+	return np.maximum(_Trunc(offset + target) - _Trunc(offset), 0)
+
+
 class FakeImage:
 	""" For size calculations """
 
-	def __init__(self, size):
+	def __init__(self, size, resized=None):
 		self.size = size
+		self.resized = resized  # the size requested by the last resize()
 
 	def resize(self, dim, *args, **kwargs):
-		return FakeImage(dim)
+		return FakeImage(dim, dim)
 
 	def crop(self, c):
 		x0, y0, x1, y1 = c
-		return FakeImage((max(x1 - x0, 0), max(y1 - y0, 0)))
+		return FakeImage((max(x1 - x0, 0), max(y1 - y0, 0)), self.resized)
+
+
+def FuseOps(ops):
+	""" Moves Color, Contrast and Brightness after the resize operations (so they run
+	on the smaller image) and fuses consecutive Contrast and Brightness into PointOps.
+	"""
+
+	result = []
+	pending = []
+
+	def flush():
+		for op in pending:
+			if type(op) is Operations.Color:
+				result.append(op)
+			elif result and isinstance(result[-1], Operations.PointOps):
+				result[-1].ops.append(op)
+			else:
+				result.append(Operations.PointOps([op]))
+		del pending[:]
+
+	for op in ops:
+		if type(op) in (Operations.Color, Operations.Contrast, Operations.Brightness):
+			pending.append(op)
+		elif isinstance(op, (Operations.TransformSize, Operations.RotateImage)):
+			result.append(op)
+		else:
+			flush()
+			result.append(op)
+	flush()
+
+	return result
+
+
+class DecodePlan:
+	""" Shrink-on-load: decodes the source at the smallest power-of-two scale
+	which still gives the same final size as the full resolution decoding.
+
+	Only the leading TransformSize operation is taken into account, the source
+	is always kept at least REDUCING_GAP times bigger than its resize target.
+	JPEG files are scaled by libjpeg (Image.draft), other formats by Image.reduce.
+
+	Note: draft() changes the given (not yet loaded) image in place - its size and
+	mode are the reduced ones afterwards, so the image should not be used further.
+	"""
+
+	SCALES = (8, 4, 2)
+	REDUCING_GAP = 2.0
+
+	def __init__(self, ops):
+		ops = list(ops)
+		self.op = ops[0] if ops and isinstance(ops[0], Operations.TransformSize) else None
+
+	@staticmethod
+	def ReducedSize(size, scale):
+		return ((size[0] + scale - 1) // scale, (size[1] + scale - 1) // scale)
+
+	def GetScale(self, img_w, img_h):
+		return self.GetCommonScale([self], (img_w, img_h))
+
+	@classmethod
+	def GetCommonScale(cls, plans, size):
+
+		for scale in cls.SCALES:
+			if min(size) >= scale and all(plan.Allows(size, cls.ReducedSize(size, scale)) for plan in plans):
+				return scale
+
+		return 1
+
+	def Allows(self, src_size, reduced_size):
+		""" Checks if the operation gives the same result on the reduced source. """
+
+		if self.op is None:
+			return False
+
+		res = self.op.Exec(FakeImage(src_size))
+		if res.resized is None:
+			return False
+
+		w, h = reduced_size
+		if w < res.resized[0] * self.REDUCING_GAP or h < res.resized[1] * self.REDUCING_GAP:
+			return False
+
+		reduced = self.op.Exec(FakeImage(reduced_size))
+		return (reduced.size, reduced.resized) == (res.size, res.resized)
+
+	def Apply(self, im, scale=None):
+
+		scale = scale or self.GetScale(*im.size)
+		if scale == 1:
+			return im
+
+		img_w, img_h = im.size
+
+		if im.format == 'JPEG':
+			# the requested size makes draft() choose exactly `scale`
+			im.draft(im.mode, (img_w // scale, img_h // scale))
+			if im.size != (img_w, img_h):
+				return im
+
+		return im.reduce(scale)
+
+
+def WorkingMode(im):
+	""" RGBA only for the sources with transparency """
+	bands = im.getbands()
+	if 'A' in bands or 'a' in bands or 'transparency' in im.info:
+		return 'RGBA'
+	return 'RGB'
+
+
+def _PixelBytes(mode):
+	# the size of a pixel in memory (PIL keeps 3 bands in 4 bytes)
+	if mode in ('1', 'L', 'P'):
+		return 1
+	if mode.startswith('I;16'):
+		return 2
+	return 4
+
+
+def EstimateMemory(source, scale, mode):
+	""" Bytes needed to decode the source reduced `scale` times and to transform it in `mode` """
+
+	draft = min(scale, DRAFT_SCALE) if source.format == 'JPEG' else 1
+	w, h = DecodePlan.ReducedSize(source.size, draft)
+	decoded = w * h * _PixelBytes(source.mode)
+
+	w, h = DecodePlan.ReducedSize(source.size, scale)
+	working = w * h * _PixelBytes(mode)
+	converted = working if scale > 1 or mode != source.mode else 0
+
+	# the decoded source, its reduced/converted copy and a result of an operation
+	return decoded + converted + working
+
+
+DRAFT_SCALE = 8  # the maximal scale of libjpeg
+STRIP_PIXELS = 4 * 1024 * 1024  # source pixels converted and reduced at once
+
+
+def CheckSource(source, scale, mode, limits=None):
+	""" Refuses (ThumbError) sources over limits.max_source_pixels and jobs over
+	limits.memory_budget, from the size in the header (before anything is decoded)
+	"""
+
+	limits = limits or FrameLimits()
+	img_w, img_h = source.size
+
+	if limits.max_source_pixels is not None and img_w * img_h > limits.max_source_pixels:
+		raise ThumbError("Image is too large: {}x{}".format(img_w, img_h))
+
+	if limits.memory_budget is not None and EstimateMemory(source, scale, mode) > limits.memory_budget:
+		raise ThumbError("Image {}x{} does not fit into the memory budget: {} bytes".format(img_w, img_h, limits.memory_budget))
+
+
+def DecodeSource(source, scale=1, limits=None):
+	""" Decodes a static source reduced `scale` times, in RGB or RGBA (only if it has transparency).
+
+	The pixel count from the header is checked before decoding: sources over
+	limits.max_source_pixels or jobs over limits.memory_budget are refused with ThumbError.
+	The scale is never raised above the given one (the thumbnail would not be accurate).
+	JPEG files are reduced by libjpeg while decoding (draft), other formats are decoded
+	in full in their own mode, then converted and reduced in strips - a higher scale
+	reduces only the converted copy of them, not their decoding.
+
+	Note: draft() is called on the given image itself (see DecodePlan), so a source
+	passed in by the caller is changed and should be reopened to be used again.
+	"""
+
+	img_w, img_h = source.size  # nothing is decoded yet
+	mode = WorkingMode(source)
+	CheckSource(source, scale, mode, limits)
+
+	if scale > 1 and source.format == 'JPEG':
+		# the requested size makes draft() choose exactly `scale` (or the maximal one)
+		source.draft(source.mode, (img_w // scale, img_h // scale))
+		for draft in (DRAFT_SCALE, 4, 2):
+			if source.size == DecodePlan.ReducedSize((img_w, img_h), draft):
+				scale //= draft
+				break
+
+	if scale > 1:
+		return _ReduceStrips(source, scale, mode)
+	if source.mode != mode:
+		return source.convert(mode)
+	return source
+
+
+def _ReduceStrips(im, scale, mode):
+
+	if im.mode == mode:
+		return im.reduce(scale)
+
+	img_w, img_h = im.size
+	result = Image.new(mode, DecodePlan.ReducedSize(im.size, scale))
+
+	# strips are aligned to the blocks of reduce(), so the result is the same as of a whole image
+	rows = max(STRIP_PIXELS // img_w // scale, 1) * scale
+	for y in range(0, img_h, rows):
+		strip = im.crop((0, y, img_w, min(y + rows, img_h))).convert(mode)
+		result.paste(strip.reduce(scale), (0, y // scale))
+
+	return result
+
+
+class GifStreamWriter:
+	""" Writes an animated GIF frame by frame, so only the previous frame is kept in memory.
+
+	The frames are encoded by PIL's GIF plugin the same way as by Image.save(save_all=True):
+	identical frames are merged (their durations added up), the others are stored as the
+	rectangles changed since the previous frame, with local color tables.
+	"""
+
+	MAX_DURATION = 0xFFFF * 10  # ms, a GIF frame delay is 16-bit (in 1/100 s)
+	SUPPORTED = _pillow_tested and all(
+		hasattr(GifImagePlugin, i) for i in ('_normalize_mode', '_normalize_palette', '_getbbox', '_get_global_header', '_write_frame_data')
+	)
+
+	def __init__(self, fp, loop=0, optimize=True):
+		self.fp = fp
+		self.encoderinfo = {'loop': loop, 'optimize': optimize}
+		self.pending = None  # (frame, bbox, encoderinfo)
+		self.count = 0
+
+	def Write(self, frame, duration):
+
+		frame = GifImagePlugin._normalize_mode(frame.copy())
+		if self.count == 0:
+			for k, v in frame.info.items():
+				if k != 'transparency':
+					self.encoderinfo.setdefault(k, v)
+		self.count += 1
+
+		encoderinfo = self.encoderinfo.copy()
+		frame = GifImagePlugin._normalize_palette(frame, None, encoderinfo)
+		if 'transparency' in frame.info:
+			encoderinfo.setdefault('transparency', frame.info['transparency'])
+		encoderinfo['duration'] = min(duration or 0, self.MAX_DURATION)
+
+		bbox = None
+		if self.pending is not None:
+			prev, prev_bbox, prev_info = self.pending
+			bbox = GifImagePlugin._getbbox(prev, frame)
+			if not bbox:
+				if prev_info['duration'] + encoderinfo['duration'] <= self.MAX_DURATION:
+					prev_info['duration'] += encoderinfo['duration']
+					return
+				# the delay would overflow, the same frame is shown again
+				bbox = (0, 0, 1, 1)
+			self._WriteFrame(prev, prev_bbox, prev_info)
+
+		self.pending = (frame, bbox, encoderinfo)
+
+	def Close(self):
+		if self.pending is not None:
+			self._WriteFrame(*self.pending)
+			self.pending = None
+		self.fp.write(b';')
+
+	def _WriteFrame(self, frame, bbox, encoderinfo):
+
+		if not bbox:
+			# the first frame: the header with its palette as the global one
+			for s in GifImagePlugin._get_global_header(frame, encoderinfo):
+				self.fp.write(s)
+			offset = (0, 0)
+		else:
+			encoderinfo['include_color_table'] = True
+			frame = frame.crop(bbox)
+			offset = bbox[:2]
+		GifImagePlugin._write_frame_data(self.fp, frame, offset, encoderinfo)
+
+
+class WebpStreamWriter:
+	""" Writes an animated WEBP frame by frame: the frames are passed one by one to the
+	animation encoder of libwebp (the one Image.save(save_all=True) uses, with the same
+	settings), so only the encoded ones are kept until the end.
+	"""
+
+	# the positional arguments of WebPAnimEncoder and add() are the ones of the checked versions
+	SUPPORTED = _pillow_tested and _webp is not None and getattr(_webp, 'HAVE_WEBPANIM', False) and hasattr(_webp, 'WebPAnimEncoder')
+
+	def __init__(self, fp, size, loop=0, background=None, minimize_size=False, lossless=False, quality=80, method=0):
+		if _webp is None or not getattr(_webp, 'HAVE_WEBPANIM', False):
+			raise ThumbError("PIL without animated WEBP support")
+
+		self.fp = fp
+		self.lossless = lossless
+		self.quality = quality
+		self.method = method
+		self.timestamp = 0
+
+		r, g, b, a = background or (0, 0, 0, 0)
+		kmin, kmax = (9, 17) if lossless else (3, 5)  # the defaults of PIL (from gif2webp)
+		self.encoder = _webp.WebPAnimEncoder(size[0], size[1], (a << 24) | (r << 16) | (g << 8) | b, loop, minimize_size, kmin, kmax, False, False)
+
+	@staticmethod
+	def GetBackground(frame):
+		""" The background color the way PIL takes it from the first frame (a GIF color index is not resolved) """
+
+		background = frame.info.get('background', (0, 0, 0, 0))
+		if isinstance(background, int):
+			palette = frame.getpalette()
+			if palette:
+				return tuple(palette[background * 3:(background + 1) * 3]) + (255, )
+			return (background, background, background, 255)
+		return background
+
+	def Write(self, frame, duration):
+
+		rawmode = frame.mode
+		if rawmode not in ('RGB', 'RGBA', 'RGBX'):
+			rawmode = 'RGBA' if 'A' in frame.mode or 'a' in frame.mode or (frame.mode == 'P' and 'A' in frame.im.getpalettemode()) else 'RGB'
+			frame = frame.convert(rawmode)
+		if rawmode == 'RGB':
+			rawmode = 'RGBX'
+
+		self.encoder.add(frame.tobytes('raw', rawmode), round(self.timestamp), frame.size[0], frame.size[1], rawmode, self.lossless, self.quality, self.method)
+		self.timestamp += duration or 0
+
+	def Close(self):
+
+		self.encoder.add(None, round(self.timestamp), 0, 0, '', self.lossless, self.quality, 0)
+		data = self.encoder.assemble('', '', '')
+		if data is None:
+			raise ThumbError("Cannot write an animated WEBP")
+		self.fp.write(data)
+
+
+class EffortPolicy:
+	""" Encoder effort by the format and the number of pixels of the output.
+
+	rules - {format: [(max_pixels, params), ...]}, params of the first rule with
+	        pixels <= max_pixels (None - no limit) are used, missing formats are
+	        taken from RULES. Params: 'progressive' and 'optimize' (JPEG, PNG) turn
+	        off the options of SaveToBuf, 'method' (WEBP), 'speed' (AVIF).
+
+	The defaults come from tests/gfx/bench_effort.py (a photo-like image, quality 85):
+	progressive JPEGs are larger than the baseline ones up to ~256x192 pixels, WEBP
+	method 6 saves over 10% only for images larger than ~2 Mpx.
+	"""
+
+	RULES = {
+		'JPEG': [(100 * 1000, {'progressive': False}), (None, {})],
+		'WEBP': [(2 * 1000 * 1000, {'method': 2}), (None, {'method': 6})],
+	}
+
+	def __init__(self, rules=None, name='default'):
+		self.rules = dict(self.RULES, **(rules or {}))
+		self.name = name
+
+	def Get(self, fmt, pixels):
+		for max_pixels, params in self.rules.get(fmt, ()):
+			if max_pixels is None or pixels <= max_pixels:
+				return params
+		return {}
+
+
+class EncodeStats:
+	""" Encoding times and sizes of the thumbnails, per (ImageType, policy, format) """
+
+	def __init__(self):
+		self.items = {}
+		self.lock = threading.Lock()
+
+	def Record(self, key, policy, fmt, pixels, seconds, nbytes):
+		with self.lock:
+			item = self.items.get((key, policy, fmt))
+			if item is None:
+				item = self.items[(key, policy, fmt)] = {'count': 0, 'pixels': 0, 'seconds': 0.0, 'bytes': 0}
+			item['count'] += 1
+			item['pixels'] += pixels
+			item['seconds'] += seconds
+			item['bytes'] += nbytes
+
+	def GetStats(self):
+		""" [{'key', 'policy', 'format', 'count', 'pixels', 'seconds', 'bytes', 'ms_per_mpx', 'bytes_per_px'}, ...] """
+
+		with self.lock:
+			items = [(k, dict(v)) for k, v in self.items.items()]
+
+		result = []
+		for (key, policy, fmt), item in sorted(items, key=lambda i: tuple(map(str, i[0]))):
+			pixels = item['pixels'] or 1
+			item.update(key=key, policy=policy, format=fmt)
+			item['ms_per_mpx'] = item['seconds'] * 1000 * 1000 * 1000 / pixels
+			item['bytes_per_px'] = float(item['bytes']) / pixels
+			result.append(item)
+		return result
+
+	def Clear(self):
+		with self.lock:
+			self.items.clear()
+
+	def Drain(self):
+		""" Takes the recorded items (e.g. to ship them from a worker process), see Merge """
+
+		with self.lock:
+			items, self.items = self.items, {}
+		return items
+
+	def Merge(self, items):
+		with self.lock:
+			for k, v in items.items():
+				item = self.items.get(k)
+				if item is None:
+					self.items[k] = dict(v)
+				else:
+					for i in item:
+						item[i] += v[i]
 
 
 class Operations(object):
@@ -107,6 +593,17 @@ class Operations(object):
 
 	class TransformSize(Transform):
 
+		# speed tier: (resampling filter, reducing_gap)
+		# With reducing_gap the source is first shrunk by Image.reduce (integer
+		# box filter) to at most reducing_gap times the target size.
+		SPEEDS = {
+			'fast': (Image.BILINEAR, 2.0),
+			'balanced': (Image.ANTIALIAS, 3.0),
+			'best': (Image.ANTIALIAS, None),
+		}
+
+		speed = 'best'
+
 		def __init__(self, width, height):
 			self.w = width
 			self.h = height
@@ -114,6 +611,14 @@ class Operations(object):
 		def GetFinalSize(self, w, h):
 			return (w, h)
 
+		def GetFinalSizes(self, w, h):
+			""" GetFinalSize of many images: numpy arrays of widths and heights """
+			return (w, h)
+
+		def Resize(self, img, size):
+			resample, reducing_gap = self.SPEEDS[self.speed]
+			return img.resize(size, resample, reducing_gap=reducing_gap)
+
 	class RotateImage(Transform):
 
 		def __init__(self):
@@ -152,20 +657,36 @@ class Operations(object):
 				# scale down to fit width
 				if img_w > self.w:
 					new_h = max(int(img_h * self.w / img_w), 1)
-					img = img.resize((self.w, new_h), Image.ANTIALIAS)
+					img = self.Resize(img, (self.w, new_h))
 			else:
 				# scale down
 				if img_w > self.w or img_h > self.h:
 					scale = max(float(img_w) / self.w, float(img_h) / self.h)
 					new_w = max(int(img_w / scale), 1)
 					new_h = max(int(img_h / scale), 1)
-					img = img.resize((new_w, new_h), Image.ANTIALIAS)
+					img = self.Resize(img, (new_w, new_h))
 
 			return img
 
 		def GetFinalSize(self, img_w, img_h):
 			return self.Exec(FakeImage((img_w, img_h))).size
 
+		def GetFinalSizes(self, img_w, img_h):
+
+			if not self.w:
+				return img_w, img_h
+
+			if not self.h:
+				over = img_w > self.w
+				new_h = np.maximum(_Trunc(img_h * self.w / img_w), 1)
+				return np.where(over, self.w, img_w), np.where(over, new_h, img_h)
+
+			over = (img_w > self.w) | (img_h > self.h)
+			scale = np.maximum(img_w / self.w, img_h / self.h)
+			new_w = np.maximum(_Trunc(img_w / scale), 1)
+			new_h = np.maximum(_Trunc(img_h / scale), 1)
+			return np.where(over, new_w, img_w), np.where(over, new_h, img_h)
+
 	class FitAll(TransformSize):
 
 		def Exec(self, img):
@@ -180,11 +701,11 @@ class Operations(object):
 			if img_w > self.w or img_h > self.h:
 
 				if float(img_w) / img_h <= float(self.w) / self.h:
-					img = img.resize((self.w, int(img_h * self.w / img_w)), Image.ANTIALIAS)
+					img = self.Resize(img, (self.w, int(img_h * self.w / img_w)))
 					img_w, img_h = img.size
 					img = img.crop((int((img_w - self.w) / 4), int((img_h - self.h) / 2), int((img_w - self.w) / 4 + self.w), int((img_h - self.h) / 2 + self.h)))
 				else:
-					img = img.resize((int(img_w * self.h / img_h), self.h), Image.ANTIALIAS)
+					img = self.Resize(img, (int(img_w * self.h / img_h), self.h))
 					img_w, img_h = img.size
 					img = img.crop((int((img_w - self.w) / 2), int((img_h - self.h) / 4), int((img_w - self.w) / 2 + self.w), int((img_h - self.h) / 4 + self.h)))
 
@@ -193,6 +714,21 @@ class Operations(object):
 		def GetFinalSize(self, img_w, img_h):
 			return self.Exec(FakeImage((img_w, img_h))).size
 
+		def GetFinalSizes(self, img_w, img_h):
+
+			if not self.w or not self.h:
+				return img_w, img_h
+
+			over = (img_w > self.w) | (img_h > self.h)
+			narrow = img_w / img_h <= float(self.w) / self.h
+
+			# resized to the width (narrow) or to the height, then cropped
+			resized_h = _Trunc(img_h * self.w / img_w)
+			resized_w = _Trunc(img_w * self.h / img_h)
+			new_w = np.where(narrow, self.w, _CropExtent(resized_w, self.w, 2))
+			new_h = np.where(narrow, _CropExtent(resized_h, self.h, 2), self.h)
+			return np.where(over, new_w, img_w), np.where(over, new_h, img_h)
+
 	class MaxBox(TransformSize):
 
 		def Exec(self, img):
@@ -207,13 +743,24 @@ class Operations(object):
 
 				new_w = max(int(img_w * scale), 1)
 				new_h = max(int(img_h * scale), 1)
-				img = img.resize((new_w, new_h), Image.ANTIALIAS)
+				img = self.Resize(img, (new_w, new_h))
 
 			return img
 
 		def GetFinalSize(self, img_w, img_h):
 			return self.Exec(FakeImage((img_w, img_h))).size
 
+		def GetFinalSizes(self, img_w, img_h):
+
+			if not self.w or not self.h:
+				return img_w, img_h
+
+			over = (img_w > self.w) | (img_h > self.h)
+			scale = np.minimum(float(self.w) / img_w, float(self.h) / img_h)
+			new_w = np.maximum(_Trunc(img_w * scale), 1)
+			new_h = np.maximum(_Trunc(img_h * scale), 1)
+			return np.where(over, new_w, img_w), np.where(over, new_h, img_h)
+
 	class Force(TransformSize):
 
 		def Exec(self, img):
@@ -224,13 +771,21 @@ class Operations(object):
 			img_w, img_h = img.size
 
 			if img_w > self.w or img_h > self.h:
-				img = img.resize((self.w, self.h), Image.ANTIALIAS)
+				img = self.Resize(img, (self.w, self.h))
 
 			return img
 
 		def GetFinalSize(self, img_w, img_h):
 			return self.Exec(FakeImage((img_w, img_h))).size
 
+		def GetFinalSizes(self, img_w, img_h):
+
+			if not self.w or not self.h:
+				return img_w, img_h
+
+			over = (img_w > self.w) | (img_h > self.h)
+			return np.where(over, self.w, img_w), np.where(over, self.h, img_h)
+
 	class Manual(TransformSize):
 
 		def __init__(self, width, height, crop):
@@ -245,7 +800,7 @@ class Operations(object):
 			if not self.w or not self.h:
 				return img
 
-			img = img.resize((self.w, self.h), Image.ANTIALIAS)
+			img = self.Resize(img, (self.w, self.h))
 			if self.c:
 				left, top, width, height = self.c
 				if width > 0 and height > 0:
@@ -257,6 +812,15 @@ class Operations(object):
 		def GetFinalSize(self, img_w, img_h):
 			return self.Exec(FakeImage((img_w, img_h))).size
 
+		def GetFinalSizes(self, img_w, img_h):
+
+			if not self.w or not self.h:
+				return img_w, img_h
+
+			# the same size for all the images
+			w, h = self.GetFinalSize(0, 0)
+			return np.full_like(img_w, w), np.full_like(img_h, h)
+
 	class Color(Transform):
 
 		def __init__(self, value):
@@ -273,69 +837,152 @@ class Operations(object):
 		def Exec(self, img):
 			return ImageEnhance.Brightness(img).enhance(self.v)
 
+	class PointOps(Transform):
+		""" Consecutive Contrast and Brightness operations fused into a single
+		lookup table pass (Image.point). The mean used by Contrast is computed
+		from the histogram, so the source is read only once.
+		"""
+
+		# ITU-R 601-2 luma transform, as in Image.convert('L')
+		luma = (0.299, 0.587, 0.114)
+
+		def __init__(self, ops):
+			self.ops = list(ops)
+
+		@staticmethod
+		def _Blend(degenerate, value, factor):
+			# the same arithmetic as in Image.blend
+			value = degenerate + factor * (value - degenerate)
+			return 0 if value <= 0 else 255 if value >= 255 else int(value)
+
+		def GetLUTs(self, img):
+
+			bands = len(img.getbands())
+			colors = 3 if bands >= 3 else 1
+			luts = [list(range(256)) for i in range(colors)]
+
+			hist = None
+			total = float(img.size[0] * img.size[1]) or 1.0
+
+			for op in self.ops:
+				degenerate = 0
+				if type(op) is Operations.Contrast:
+					if hist is None:
+						hist = img.histogram()
+					means = [sum(n * v for n, v in zip(hist[i * 256:(i + 1) * 256], lut)) / total for i, lut in enumerate(luts)]
+					mean = sum(w * m for w, m in zip(self.luma, means)) if colors == 3 else means[0]
+					degenerate = int(mean + 0.5)
+
+				luts = [[self._Blend(degenerate, v, op.v) for v in lut] for lut in luts]
+
+			return luts
+
+		def Exec(self, img):
+
+			luts = self.GetLUTs(img)
+			table = [v for lut in luts for v in lut]
+			# alpha (and other extra bands) stays untouched
+			table += list(range(256)) * (len(img.getbands()) - len(luts))
+			return img.point(table)
+
 	class Watermark(Transform):
 
+		# Resized layers shared by all instances, keyed by the output size and the watermark
+		# images identity (cached values keep references to the images, so the ids stay unique).
+		cache = LRUCache(max_bytes=64 * 1024 * 1024, sizeof=lambda v: sum(l.size[0] * l.size[1] * 4 for l in v[2]))
+
 		def __init__(self, center, frame=None):
 			self.center = center
 			self.frame = frame
 
-		def Exec(self, im):
+		def GetLayers(self, size):
+
+			key = (id(self.center), id(self.frame), size)
+			cached = self.cache.Get(key)
+			if cached is None:
+				cached = self.cache.Set(key, (self.center, self.frame, self.MakeLayers(size)))
+			return cached[2]
+
+		def MakeLayers(self, size):
 
 			mark = self.center
+			layers = []
 
-			if im.mode != 'RGBA':
-				im = im.convert('RGBA')
 			# create a transparent layer the size of the image and draw the
 			# watermark in that layer.
-			layer = Image.new('RGBA', im.size, (0, 0, 0, 0))
-
-			# TODO: cache resized watermarks
+			layer = Image.new('RGBA', size, (0, 0, 0, 0))
 
 			if self.frame:
 
 				frame = self.frame
 
-				frame = frame.resize((int(im.size[0] * .9), int(im.size[1] * .9)), Image.ANTIALIAS)
+				frame = frame.resize((int(size[0] * .9), int(size[1] * .9)), Image.ANTIALIAS)
 				w, h = frame.size
-				layer.paste(frame, (int((im.size[0] - w) / 2), int((im.size[1] - h) / 2)))
-				im = Image.composite(layer, im, layer)
+				layer.paste(frame, (int((size[0] - w) / 2), int((size[1] - h) / 2)))
+				layers.append(layer)
 
-				layer = Image.new('RGBA', im.size, (0, 0, 0, 0))
+				layer = Image.new('RGBA', size, (0, 0, 0, 0))
 
-				ratio = min(float(im.size[0] * 0.9) / mark.size[0], float(im.size[1] * 0.9) / mark.size[1])
+				ratio = min(float(size[0] * 0.9) / mark.size[0], float(size[1] * 0.9) / mark.size[1])
 				ratio = min(ratio, 1.0)
 			else:
-				ratio = min(float(im.size[0] * .9) / mark.size[0], float(im.size[1] * .9) / mark.size[1])
+				ratio = min(float(size[0] * .9) / mark.size[0], float(size[1] * .9) / mark.size[1])
 
 			w = int(mark.size[0] * ratio)
 			h = int(mark.size[1] * ratio)
 			if ratio != 1.0:
 				mark = mark.resize((w, h), Image.ANTIALIAS)
-			layer.paste(mark, (int((im.size[0] - w) / 2), int((im.size[1] - h) / 2)))
+			layer.paste(mark, (int((size[0] - w) / 2), int((size[1] - h) / 2)))
+			layers.append(layer)
+
+			return layers
+
+		def Exec(self, im):
+
+			if im.mode != 'RGBA':
+				im = im.convert('RGBA')
 
-			return Image.composite(layer, im, layer)
+			for layer in self.GetLayers(im.size):
+				im = Image.composite(layer, im, layer)
+
+			return im
 
 	class SaveToBuf(Base):
 
-		def __init__(self, format=None, quality=None, optimize=None, progressive=None, metadata=None, bgcolor=None):
+		# copied from the source JPEG when `metadata` is set: IPTC ('APP13'), optionally XMP ('XMP'),
+		# never Exif (GPS, serial numbers, the preview of the whole original), see GetMetadataSegments
+		METADATA_SEGMENTS = ('APP13', )
+
+		# Encoder effort (EffortPolicy) and the collector of the encoding times and sizes (EncodeStats),
+		# both can be replaced globally or per instance; stats_key identifies the owner (ImageType.id)
+		policy = EffortPolicy()
+		stats = EncodeStats()
+		stats_key = None
+
+		def __init__(self, format=None, quality=None, optimize=None, progressive=None, metadata=None, bgcolor=None, animated=None, policy=None, stats_key=None):
 			self.format = format
 			self.optimize = optimize if optimize is not None else True
 			self.progressive = progressive if progressive is not None else True
 			self.quality = quality if quality is not None else 95
 			self.metadata = metadata if metadata is not None else False
 			self.bgcolor = bgcolor or (255, 255, 255)
+			self.animated = animated if animated is not None else False  # keeps all frames in WEBP
+			if policy is not None:
+				self.policy = policy
+			if stats_key is not None:
+				self.stats_key = stats_key
 
-			# if iptcinfo3 is None and self.metadata:
-			# 	raise ImportError("Cannot import iptcinfo3 module")
-
-		def Clone(self, format=None, quality=None, optimize=None, progressive=None, metadata=None, bgcolor=None):
+		def Clone(self, format=None, quality=None, optimize=None, progressive=None, metadata=None, bgcolor=None, animated=None, policy=None, stats_key=None):
 			return Operations.SaveToBuf(
 				format=coalesce(format, self.format),
 				quality=coalesce(quality, self.quality),
 				optimize=coalesce(optimize, self.optimize),
 				progressive=coalesce(progressive, self.progressive),
 				metadata=coalesce(metadata, self.metadata),
-				bgcolor=coalesce(bgcolor, self.bgcolor)
+				bgcolor=coalesce(bgcolor, self.bgcolor),
+				animated=coalesce(animated, self.animated),
+				policy=coalesce(policy, self.__dict__.get('policy')),
+				stats_key=coalesce(stats_key, self.stats_key)
 			)
 
 		def GetOptParams(self):
@@ -344,22 +991,56 @@ class Operations(object):
 				"progressive": self.progressive,
 				"quality": self.quality,
 				"metadata": self.metadata,
-				"bgcolor": self.bgcolor
+				"bgcolor": self.bgcolor,
+				"animated": self.animated,
+				"policy": self.policy.name
 			}
 
 		def __call__(self, src_path, src, buf, frames):
 
-			first_frame = frames[0] if isinstance(frames, list) else frames
+			if isinstance(frames, Image.Image):
+				first_frame, frames = frames, iter(())
+			else:
+				frames = iter(frames)
+				first_frame = next(frames)
+
+			pixels = first_frame.size[0] * first_frame.size[1]
+			start = time.perf_counter()
+			pos = self._Tell(buf)
+
+			fmt = self.Encode(src, buf, first_frame, frames, pixels)
+
+			if self.stats is not None:
+				# the stats must never break the encoding (e.g. streams without tell())
+				try:
+					end = self._Tell(buf) if pos is not None else None
+					nbytes = end - pos if end is not None else os.path.getsize(buf)
+					self.stats.Record(self.stats_key, self.policy.name, fmt, pixels, time.perf_counter() - start, nbytes)
+				except Exception:
+					log.debug("SaveToBuf: the encoding stats are not recorded", exc_info=True)
+
+			return fmt
+
+		@staticmethod
+		def _Tell(buf):
+			try:
+				return buf.tell()
+			except (AttributeError, OSError, ValueError):
+				return None
+
+		def Encode(self, src, buf, first_frame, frames, pixels):
+			""" Writes the frames to buf, returns the format """
+
 			fmt = self.format or src.format
 
-			if fmt not in ('GIF', 'PNG', 'JPEG', 'WEBP'):
+			if fmt not in ('GIF', 'PNG', 'JPEG', 'WEBP', 'AVIF'):
 				fmt = 'JPEG'
 
-			if fmt != 'GIF':  # or APNG or WEBP - TODO
-				frames = first_frame
+			effort = self.policy.Get(fmt, pixels)
 
 			if fmt == 'GIF':
-				if isinstance(frames, list) and len(frames) > 1:
+				second_frame = next(frames, None)
+				if second_frame is not None:
 					info = src.info
 					"""
 					{
@@ -373,13 +1054,19 @@ class Operations(object):
 					"""
 
 					duration = info.get('duration', 50)
-					save_params = dict(
-						optimize=self.optimize,
-						save_all=True,
-						append_images=frames[1:],
-						loop=info.get('loop', 0),
-						duration=[i.info.get('duration', duration) for i in frames]
-					)
+					if not GifStreamWriter.SUPPORTED:
+						frames = [first_frame, second_frame] + list(frames)
+						first_frame.save(
+							buf, fmt, save_all=True, append_images=frames[1:], optimize=self.optimize, loop=info.get('loop', 0),
+							duration=[min(coalesce(i.info.get('duration'), duration), GifStreamWriter.MAX_DURATION) for i in frames]
+						)
+						return fmt
+
+					writer = GifStreamWriter(buf, loop=info.get('loop', 0), optimize=self.optimize)
+					for frame in itertools.chain((first_frame, second_frame), frames):
+						writer.Write(frame, coalesce(frame.info.get('duration'), duration))
+					writer.Close()
+					return fmt
 				else:
 					# FIXME: dlaczego jest potrzebny poniższy hack
 					first_frame.info['duration'] = 0
@@ -392,10 +1079,18 @@ class Operations(object):
 					first_frame = Image.alpha_composite(background, first_frame)
 					first_frame = first_frame.convert('RGB')
 
-				save_params = dict(progressive=self.progressive, quality=self.quality, optimize=self.optimize)
+				save_params = dict(
+					progressive=self.progressive and effort.get('progressive', True),
+					quality=self.quality,
+					optimize=self.optimize and effort.get('optimize', True)
+				)
+
+				if self.metadata is True and src.format == 'JPEG':
+					# the segments are written by the encoder as they are (right after the JFIF header)
+					save_params['extra'] = GetMetadataSegments(src, self.METADATA_SEGMENTS)
 
 			elif fmt == 'PNG':
-				save_params = dict(progressive=self.progressive, quality=self.quality, optimize=self.optimize)
+				save_params = dict(progressive=self.progressive, quality=self.quality, optimize=self.optimize and effort.get('optimize', True))
 			elif fmt == 'WEBP':
 				# lossless - If present and true, instructs the WebP writer to use lossless compression.
 				# quality - Integer, 1-100, Defaults to 80. For lossy, 0 gives the smallest size and 100 the largest.
@@ -403,52 +1098,201 @@ class Operations(object):
 				#           but gives larger files compared to the slowest, but best, 100.
 				# method - Quality/speed trade-off (0=fast, 6=slower-better). Defaults to 0.
 				# TODO: exif=self.metadata
-				save_params = dict(quality=self.quality, lossless=not self.optimize, icc_procfile=False, method=(6 if self.quality == 0 else 2))
+				save_params = dict(quality=self.quality, lossless=not self.optimize, icc_procfile=False, method=(6 if self.quality == 0 else effort.get('method', 2)))
+
+				second_frame = next(frames, None) if self.animated else None
+				if second_frame is not None and not WebpStreamWriter.SUPPORTED:
+					frames = [first_frame, second_frame] + list(frames)
+					first_frame.save(
+						buf, fmt, save_all=True, append_images=frames[1:], loop=src.info.get('loop', 0), minimize_size=self.optimize,
+						duration=[coalesce(i.info.get('duration'), src.info.get('duration', 50)) for i in frames], **save_params
+					)
+					return fmt
+				elif second_frame is not None:
+					# libwebp chooses the sub-rectangles, blending and disposal of the frames
+					# and merges identical ones; frames are already composed by TransformFrames
+					duration = src.info.get('duration', 50)
+					writer = WebpStreamWriter(
+						buf, first_frame.size, loop=src.info.get('loop', 0), background=WebpStreamWriter.GetBackground(first_frame),
+						minimize_size=self.optimize, lossless=save_params['lossless'], quality=save_params['quality'], method=save_params['method']
+					)
+					writer.Write(first_frame, coalesce(first_frame.info.get('duration'), duration))
+					writer.Write(second_frame, coalesce(second_frame.info.get('duration'), duration))
+					del second_frame
+					for frame in frames:
+						writer.Write(frame, coalesce(frame.info.get('duration'), duration))
+						del frame
+					writer.Close()
+					return fmt
+			elif fmt == 'AVIF':
+				# requires an AVIF plugin (e.g. pillow-avif-plugin), see CanSave
+				save_params = dict(quality=self.quality, speed=effort.get('speed', 4 if self.optimize else 8))
 			else:
 				save_params = {}
 
-			if self.metadata is True and fmt == 'JPEG' and src.format == 'JPEG':
+			first_frame.save(buf, fmt, **save_params)
+			return fmt
 
-				if iptcinfo3 is None:
-					raise ImportError("Cannot import iptcinfo3 module")
 
-				info = iptcinfo3.IPTCInfo(src_path)
-				if len(info.data) >= 4:
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
 
-					buf_tmp = BytesIO()
-					first_frame.save(buf_tmp, fmt, **save_params)
-					buf_tmp.seek(0)
 
-					try:
-						thumb = iptcinfo3.IPTCInfo(buf_tmp, force=True)
-						for k, v in list(info.data.items()):
-							thumb.data[k] = v
-						thumb.saveToBuf(buf)
-						return
-					except Exception as ex:
-						log.error("Cannot set iptc data to JPEG file: %s", ex, exc_info=ex)
+def GetMetadataSegments(src, names=('APP13', )):
+	""" Raw APPn segments (marker, length and payload) of a JPEG, taken from the header already parsed by PIL.
 
-			first_frame.save(buf, fmt, **save_params)
+	names - APPn segments to copy, 'XMP' for the APP1 segments with XMP; APP1 with Exif is never copied.
+	"""
 
+	segments = []
+	for name, payload in getattr(src, 'applist', ()):
+		if name == 'APP1':
+			if 'XMP' not in names or not payload.startswith(XMP_HEADER):
+				continue
+		elif name not in names:
+			continue
+		if len(payload) <= 0xFFFD:
+			segments.append(pack('>BBH', 0xFF, 0xE0 + int(name[3:]), len(payload) + 2) + payload)
+	return b''.join(segments)
 
-def CreateThumb(image_path, thumb_path, operations, save, file_perms=0o644):
 
-	try:
-		source = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
-		frames = Transform(source, operations)
+def CanSave(fmt):
+	""" Checks if PIL can encode images in the format (AVIF needs a plugin) """
+	Image.init()
+	return fmt in Image.SAVE
 
-		if hasattr(thumb_path, 'write'):
-			fmt = save(image_path, source, thumb_path, frames)
-			return thumb_path
 
-		with TmpFile(thumb_path, mode="wb", perms=file_perms) as f:
-			fmt = save(image_path, source, f, frames)
+def _NotifyNewImage(thumb_path, image_path, fmt, save):
+	for f in CreateThumb.OnNewImage:
+		f(thumb_path, image_path, fmt, save.GetOptParams() if hasattr(save, 'GetOptParams') else {})
+
 
-		for f in CreateThumb.OnNewImage:
-			f(thumb_path, image_path, fmt, save.GetOptParams() if hasattr(save, 'GetOptParams') else {})
+def _StoreThumb(image_path, source, thumb_path, frames, save, file_perms):
 
+	if hasattr(thumb_path, 'write'):
+		fmt = save(image_path, source, thumb_path, frames)
 		return thumb_path
 
+	with TmpFile(thumb_path, mode="wb", perms=file_perms) as f:
+		fmt = save(image_path, source, f, frames)
+
+	_NotifyNewImage(thumb_path, image_path, fmt, save)
+
+	return thumb_path
+
+
+def _WriteBack(data, image_path, thumb_path, fmt, save, file_perms, notify):
+	try:
+		with TmpFile(thumb_path, mode="wb", perms=file_perms) as f:
+			f.write(data)
+		if notify:
+			_NotifyNewImage(thumb_path, image_path, fmt, save)
+	except Exception as e:
+		log.exception("Cannot write back thumbnail '{}': {}".format(thumb_path, e))
+		raise
+
+
+def _StoreSignature(signature_path, img, file_perms):
+	""" Writes ImageSignature (placeholder and perceptual hashes) of the image as JSON """
+	with TmpFile(signature_path, mode="w", perms=file_perms) as f:
+		json.dump(ImageSignature(img), f)
+
+
+def _TapFirstFrame(frames, callback):
+	for i, frame in enumerate(frames):
+		if i == 0:
+			callback(frame)
+		yield frame
+
+
+class FrameTee:
+	""" Feeds the frames of a single decoding of an animation to many consumers (threads).
+
+	Every consumer iterates over Iter(i) - the frames transformed by its own operations,
+	Run() (the producer) waits while any of them has `depth` frames not taken yet, so
+	only a few frames per consumer are kept in memory. Consumers call Close(i) when they
+	are done (also after an error), then their frames are not produced any more.
+	"""
+
+	DONE = object()
+
+	def __init__(self, frames, ops_list, depth=2):
+		self.frames = frames
+		self.ops_list = ops_list
+		self.queues = [queue.Queue(depth) for i in ops_list]
+		self.closed = [False] * len(ops_list)
+
+	def Iter(self, i):
+		while True:
+			item = self.queues[i].get()
+			if item is self.DONE:
+				return
+			if isinstance(item, BaseException):
+				raise item
+			yield item
+
+	def Close(self, i):
+		self.closed[i] = True
+
+	def _Put(self, i, item):
+		while not self.closed[i]:
+			try:
+				self.queues[i].put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def Run(self):
+
+		end = self.DONE
+		try:
+			for frame in self.frames:
+				if all(self.closed):
+					break
+				for i, ops in enumerate(self.ops_list):
+					if self.closed[i]:
+						continue
+					new_frame = frame
+					for op in ops:
+						new_frame = op(new_frame)
+					if new_frame is frame:
+						# the frame is reused by the decoder for the next one
+						new_frame = frame.copy()
+					new_frame.info['duration'] = frame.info.get('duration')
+					self._Put(i, new_frame)
+		except Exception as e:
+			end = e
+		finally:
+			for i in range(len(self.queues)):
+				self._Put(i, end)
+
+
+def _StoreTeeThumb(tee, i, *args):
+	try:
+		return _StoreThumb(*args)
+	finally:
+		tee.Close(i)
+
+
+def CreateThumb(image_path, thumb_path, operations, save, file_perms=0o644, shrink_on_load=True, limits=None, signature_path=None):
+	""" signature_path - stores there ImageSignature (BlurHash, dHash, pHash) of the thumbnail """
+
+	try:
+		source = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+		frames = Transform(source, operations, shrink_on_load=shrink_on_load, limits=limits)
+
+		if signature_path is not None:
+			if isinstance(frames, Image.Image):
+				_StoreSignature(signature_path, frames, file_perms)
+			else:
+				frames = _TapFirstFrame(frames, lambda frame: _StoreSignature(signature_path, frame, file_perms))
+
+		return _StoreThumb(image_path, source, thumb_path, frames, save, file_perms)
+
+	except ThumbError as e:
+		# limits, RenderTimeout of tru.gfx.pool - passed as they are, so they can be caught
+		log.warning("Cannot create thumbnail '{}': {}".format(image_path, e))
+		raise
+
 	except IOError as e:
 		log.exception("Cannot store thumbnail '{}': {}".format(image_path, e))
 		raise ThumbError("Cannot store thumbnail: {}".format(e))
@@ -458,8 +1302,143 @@ def CreateThumb(image_path, thumb_path, operations, save, file_perms=0o644):
 		raise ThumbError("Cannot create thumbnail: {}".format(e))
 
 
+def RenderThumb(image_path, operations, save, thumb_path=None, background=False, notify=True, file_perms=0o644, shrink_on_load=True, limits=None):
+	""" Renders the thumbnail in memory, returns (memoryview of the encoded image, format).
+
+	thumb_path - the result is also written to the disk cache, in the RenderThumb.executor
+	             thread when `background` is set (the memoryview must not be modified then).
+	notify     - calls CreateThumb.OnNewImage for the written file.
+	"""
+
+	buf = BytesIO()
+	try:
+		source = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+		frames = Transform(source, operations, shrink_on_load=shrink_on_load, limits=limits)
+		fmt = save(image_path, source, buf, frames)
+
+	except ThumbError as e:
+		log.warning("Cannot render thumbnail '{}': {}".format(image_path, e))
+		raise
+
+	except Exception as e:
+		log.exception("Cannot render thumbnail '{}': {}".format(image_path, e))
+		raise ThumbError("Cannot create thumbnail: {}".format(e))
+
+	data = buf.getbuffer()
+
+	if thumb_path is not None:
+		if background:
+			RenderThumb.executor.submit(_WriteBack, data, image_path, thumb_path, fmt, save, file_perms, notify)
+		else:
+			try:
+				_WriteBack(data, image_path, thumb_path, fmt, save, file_perms, notify)
+			except Exception as e:
+				raise ThumbError("Cannot store thumbnail: {}".format(e))
+
+	return data, fmt
+
+
+# Background writes of RenderThumb(..., background=True)
+RenderThumb.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumb-write-back')
+
+
+def CreateThumbs(image_path, thumbs, watermark=None, file_perms=0o644, workers=4, limits=None, signature_path=None):
+	""" Creates many thumbnails from a single decoding of the source.
+
+	thumbs         - list of (thumb_path, ImageType) pairs.
+	signature_path - stores there ImageSignature of the smallest variant (see CreateThumb).
+
+	Variants are rendered from the largest to the smallest one, each of them is
+	resized from the smallest already rendered intermediate image which still
+	gives the same result (see DecodePlan.Allows). Only uniformly scaled
+	intermediates (FitWidth, MaxBox) are reused. Encoding runs in `workers` threads.
+
+	Frames of an animated GIF are decoded once too and fed to all the variants
+	at the same time (FrameTee), each of them is encoded in its own thread.
+	"""
+
+	try:
+		source = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+
+		jobs = [(thumb_path, it, FuseOps(it.GetOps(watermark=watermark))) for thumb_path, it in thumbs]
+
+		tee = None
+		if source.format == 'GIF':
+			tee = FrameTee(TransformFrames(source, [], limits), [ops for thumb_path, it, ops in jobs])
+			rendered = [(thumb_path, it, tee.Iter(i)) for i, (thumb_path, it, ops) in enumerate(jobs)]
+		else:
+			plans = [DecodePlan(ops) for thumb_path, it, ops in jobs]
+			scale = DecodePlan.GetCommonScale(plans, source.size) if plans else 1
+			base = DecodeSource(source, scale, limits)
+			base.load()  # not lazily by the threads saving the variants
+
+			def area(job):
+				op = DecodePlan(job[2]).op
+				w, h = op.GetFinalSize(*base.size) if op is not None else base.size
+				return w * h
+
+			jobs.sort(key=area, reverse=True)
+
+			rendered = []
+			intermediates = []
+			for thumb_path, it, ops in jobs:
+				plan = DecodePlan(ops)
+
+				frame = base
+				for im in intermediates:
+					if im.width * im.height < frame.width * frame.height and plan.Allows(base.size, im.size):
+						frame = im
+
+				for op in ops:
+					resized = op(frame)
+					if op is plan.op and resized is not frame and isinstance(op, (Operations.FitWidth, Operations.MaxBox)):
+						intermediates.append(resized)
+					frame = resized
+
+				# no-op variants (e.g. an upscale) get the same image, it is saved in many threads
+				if frame is base or any(frame is i[2] for i in rendered):
+					frame = frame.copy()
+				rendered.append((thumb_path, it, frame))
+
+		if signature_path is not None and rendered:
+			thumb_path, it, frames = rendered[-1]  # the smallest one
+			if isinstance(frames, Image.Image):
+				_StoreSignature(signature_path, frames, file_perms)
+			else:
+				rendered[-1] = (thumb_path, it, _TapFirstFrame(frames, lambda frame: _StoreSignature(signature_path, frame, file_perms)))
+
+		if tee is None:
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				results = [
+					executor.submit(_StoreThumb, image_path, source, thumb_path, frames, it.save_to, file_perms)
+					for thumb_path, it, frames in rendered
+				]
+				return [i.result() for i in results]
+
+		# all the consumers of the frames must run at the same time
+		with ThreadPoolExecutor(max_workers=max(len(rendered), 1)) as executor:
+			results = [
+				executor.submit(_StoreTeeThumb, tee, i, image_path, source, thumb_path, frames, it.save_to, file_perms)
+				for i, (thumb_path, it, frames) in enumerate(rendered)
+			]
+			tee.Run()
+			return [i.result() for i in results]
+
+	except ThumbError as e:
+		log.warning("Cannot create thumbnails '{}': {}".format(image_path, e))
+		raise
+
+	except IOError as e:
+		log.exception("Cannot store thumbnails '{}': {}".format(image_path, e))
+		raise ThumbError("Cannot store thumbnail: {}".format(e))
+
+	except Exception as e:
+		log.exception("Cannot create thumbnails '{}': {}".format(image_path, e))
+		raise ThumbError("Cannot create thumbnail: {}".format(e))
+
+
 # Callbacks for image opitmisations: pngquant, gifsicle, jpegoptim;
-# See: CreateThumb, ImageExternalOpt
+# See: CreateThumb, ImageExternalOpt, optimizer.OptimizerQueue
 # For best web performace use background process (like celery).
 CreateThumb.OnNewImage = []
 
@@ -546,10 +1525,7 @@ def ImageExternalOpt(image_path, params={}):
 	return (org_size, opt_size)
 
 
-def GetImageSize(path):
-
-	if not os.path.isfile(path):
-		return None
+def _GetImageSizePIL(path):
 
 	try:
 		with Image.open(path) as im:
@@ -558,3 +1534,16 @@ def GetImageSize(path):
 		pass
 
 	return None
+
+
+def GetImageSize(path):
+
+	if not os.path.isfile(path):
+		return None
+
+	return GetImageSize.index.Get(path)
+
+
+# Sizes are read from the file headers (PIL only for other formats) and memoized by (path, mtime, size).
+# Replace with SizeIndex(db_path=...) to share the sizes between processes.
+GetImageSize.index = SizeIndex(fallback=_GetImageSizePIL)
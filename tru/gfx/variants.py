@@ -0,0 +1,36 @@
+"""
+Alternative formats (WEBP, AVIF) of thumbnails for browsers accepting them.
+
+The variant is stored next to the thumbnail ("name_1.jpg" -> "name_1.jpg.webp", see
+ImageType.GetVariantPath) and rendered on the first request. Responses must be sent
+with "Vary: Accept" (see tru.dj.responses.ImageVariantResponse).
+"""
+
+import os
+
+from .coder import ImageType
+from .singleflight import CreateThumbOnce
+
+
+def _IsFresh(path, source_path):
+	try:
+		return os.path.getmtime(path) >= os.path.getmtime(source_path)
+	except OSError:
+		return False
+
+
+def GetThumbVariant(accept, image_path, thumb_path, image_type, watermark=None, flight=None):
+	""" Returns (path, mimetype) of the thumbnail in the best format accepted by the browser,
+	renders the variant if it does not exist yet (or is older than the source).
+	"""
+
+	fmt = image_type.GetVariantFormat(accept, image_path)
+	if fmt is None:
+		return thumb_path, image_type.GetMimeType(image_path)
+
+	variant_path = ImageType.GetVariantPath(thumb_path, fmt)
+	if not _IsFresh(variant_path, image_path):
+		variant = image_type.GetVariant(fmt)
+		CreateThumbOnce(image_path, variant_path, list(variant.GetOps(watermark=watermark)), variant.save_to, flight=flight)
+
+	return variant_path, ImageType.variant_mimes[fmt]
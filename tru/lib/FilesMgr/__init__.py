@@ -8,7 +8,9 @@ import urllib.parse
 
 from PIL import Image
 from tru.io import converters
-from tru.fs.utils import FileNameExtension
+from tru.fs.utils import FileNameExtension, SpoolFile, SpoolLimitError
+from tru.fs.blobs import BlobStore, NewHasher
+from tru.gfx.probe import ProbeImage
 from tru.dj.WebExceptions import InputException, WebException
 
 
@@ -49,6 +51,20 @@ class FileMgr:
 	FILE_UPLOAD_MAX_SIZE = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
 	UPLOAD_DIR = settings.UPLOAD_DIR
 	NAMESPACE = "uploads-tmp"
+	CHUNK_SIZE = 64 * 1024
+
+	# Content-addressed mode (see tru.fs.blobs): every unique upload is stored once, the paths
+	# returned by StoreFile are references to it - symlinks (BLOB_SYMLINKS) or rows of the index only.
+	CONTENT_ADDRESSED = False
+	BLOB_INDEX = None  # SQLite database, UPLOAD_DIR/blobs.sqlite by default
+	BLOB_SYMLINKS = True
+	blob_store = None
+
+	@classmethod
+	def GetBlobStore(cls):
+		if cls.blob_store is None:
+			cls.blob_store = BlobStore(cls.UPLOAD_DIR, cls.BLOB_INDEX or os.path.join(cls.UPLOAD_DIR, 'blobs.sqlite'), symlinks=cls.BLOB_SYMLINKS)
+		return cls.blob_store
 
 	def IsValidExtension(self, fileName):
 		for i in self.ALLOWED_TYPES:
@@ -56,37 +72,96 @@ class FileMgr:
 				return True
 		return False
 
-	def FetchFile(self, request):
+	def IterRequest(self, request, size):
+		while size > 0:
+			chunk = request.read(min(size, self.CHUNK_SIZE))
+			if not chunk:
+				break
+			size -= len(chunk)
+			yield chunk
+
+	def GetSpoolDir(self, request):
+		""" Uploads are spooled next to their final place, so storing them is a rename """
 
+		return self.UPLOAD_DIR + '/' + self.GetDirName(request)
+
+	def GetUpload(self, request):
+		""" (file name, chunks) of the upload in the request """
+
+		fileName, fileSize, chunks = '', 0, ()
 		if request.META['CONTENT_TYPE'].startswith('multipart/form-data'):
 			if 'upload' in request.FILES:
 				f = request.FILES['upload']
 				fileName = f.name
 				fileSize = f.size
 				# f.content_type
-				data = f.read(fileSize)
+				chunks = f.chunks(self.CHUNK_SIZE)
 			if 'HTTP_X_FILE_NAME' in request.META:
 				fileName = request.META["HTTP_X_FILE_NAME"]
 				fileSize = int(request.META["CONTENT_LENGTH"])
-				data = request.read(fileSize)
+				chunks = self.IterRequest(request, fileSize)
 		elif request.META['CONTENT_TYPE'] == 'application/octet-stream':
 			fileName = urllib.parse.unquote(request.META["HTTP_X_FILE_NAME"])
 			fileSize = int(request.META["CONTENT_LENGTH"])
-			data = request.read(fileSize)
+			chunks = self.IterRequest(request, fileSize)
 		elif 'qqfile' in request.FILES:
 			fileName = request.FILES['qqfile'].name
-			data = request.FILES['qqfile'].read()
-			fileSize = len(data)
-		else:
-			fileName = ''
+			fileSize = request.FILES['qqfile'].size
+			chunks = request.FILES['qqfile'].chunks(self.CHUNK_SIZE)
 
 		if fileSize > self.FILE_UPLOAD_MAX_SIZE:
 			raise InputException('file', 'Plik jest zbyt duży')
 
-		return self.CheckFileType(fileName, data)
+		return fileName, chunks
+
+	def FetchFile(self, request):
+		""" Reads the upload into memory: (data, format, fileName, mimetype, image), see SpoolUpload """
+
+		fileName, chunks = self.GetUpload(request)
+		return self.CheckFileType(fileName, b''.join(chunks))
+
+	def SpoolUpload(self, request):
+		""" FetchFile() streaming the upload to a SpoolFile in place of the bytes (see StoreFile).
+		A SpoolFile not stored by StoreFile is removed when Django closes the request.
+		"""
+
+		fileName, chunks = self.GetUpload(request)
+
+		# the declared size is not trusted, the limit is checked while spooling too
+		spool = SpoolFile(self.GetSpoolDir(request), max_size=self.FILE_UPLOAD_MAX_SIZE, hasher=NewHasher() if self.CONTENT_ADDRESSED else None)
+		self.DiscardOnClose(request, spool)
+		try:
+			for chunk in chunks:
+				spool.write(chunk)
+			spool.close()
+			return self.CheckFileType(fileName, spool)
+		except SpoolLimitError:
+			raise InputException('file', 'Plik jest zbyt duży')
+		except BaseException:
+			spool.Discard()
+			raise
+
+	@staticmethod
+	def DiscardOnClose(request, spool):
+		# Django's handlers close the request (request.close) together with the response
+		close = request.close
+
+		def close_request():
+			try:
+				spool.Discard()
+			finally:
+				close()
+
+		request.close = close_request
 
 	@classmethod
-	def GetImageMeta(cls, stream):
+	def GetImageMeta(cls, stream, verify=True):
+		""" verify=False reads only the file header (format, size and mode), without decoding the pixels. """
+
+		if not verify and not Image.isImageType(stream):
+			meta = ProbeImage(stream)
+			if meta is not None:
+				return meta
 
 		im = stream if Image.isImageType(stream) else Image.open(stream)
 
@@ -101,11 +176,12 @@ class FileMgr:
 		}
 
 	def GetFileMeta(self, mimetype, data):
+		""" data - bytes or SpoolFile (the image is read from its file) """
 
 		im = None
 		meta = {}
 		if mimetype.startswith('image/'):
-			im = Image.open(io.BytesIO(data))
+			im = Image.open(data.path if isinstance(data, SpoolFile) else io.BytesIO(data))
 			meta = self.GetImageMeta(im)
 
 			if meta['format'] not in self.ALLOWED_IMAGE_FORMATS:
@@ -122,7 +198,7 @@ class FileMgr:
 		if not ignoreFileName and not self.IsValidExtension(fileName):
 			raise InputException('file', 'Plik posiada nieprawidłowe rozszerzenie')
 
-		mimetype = magic.from_buffer(data, mime=True) or 'unknown'
+		mimetype = magic.from_buffer(data.head if isinstance(data, SpoolFile) else data, mime=True) or 'unknown'
 
 		for i in self.ALLOWED_TYPES:
 			if mimetype.startswith(i.mimetype):
@@ -169,7 +245,8 @@ class FileMgr:
 		if fs_size is not None and fs_limit is not None and fs_size >= fs_limit:
 			raise InputException('file', 'Zbyt mało wolnej przestrzeni')
 
-	def StoreFile(self, request, data, ext, orgFileName, mimetype, image=None):
+	def StoreFile(self, request, data, ext, orgFileName, mimetype, image=None, digest=None):
+		""" digest - of the data (NewHasher) if already known, used in the content-addressed mode """
 
 		self.CheckFreeSpace(request)
 
@@ -179,13 +256,46 @@ class FileMgr:
 		org_filename = "%s/%s/%s" % (self.UPLOAD_DIR, dest_dir, uniqname + ext)
 		self.uniqname = uniqname
 
-		with open(org_filename, "wb") as file:
-			file.write(data)
+		if self.CONTENT_ADDRESSED:
+			store = self.GetBlobStore()
+			if isinstance(data, SpoolFile):
+				blob_path, digest, created = store.PutFile(data.path, ext, digest or data.hexdigest())
+				data.Discard()  # left if the content was already stored
+			else:
+				blob_path, digest, created = store.Put(data, ext, digest)
+			store.Link('%s/%s%s' % (dest_dir, uniqname, ext), digest)
+			if not created:
+				log.info("Duplicate upload %s/%s%s of %s", dest_dir, uniqname, ext, blob_path)
+		elif isinstance(data, SpoolFile):
+			data.Commit(org_filename)
+		else:
+			with open(org_filename, "wb") as file:
+				file.write(data)
 
 		self.LogUpload(request, '%s/%s%s' % (dest_dir, uniqname, ext))
 
 		return '%s/%s%s' % (dest_dir, uniqname, ext)
 
+	def GetImagePath(self, path):
+		""" The file to render thumbnails from: the blob in the content-addressed mode
+		(its thumbnails are shared by all uploads of the same content).
+		"""
+
+		if self.CONTENT_ADDRESSED:
+			blob_path = self.GetBlobStore().Resolve(path)
+			if blob_path is not None:
+				return blob_path
+		return path
+
+	def DeleteFile(self, path):
+		""" Removes the upload; in the content-addressed mode only the reference (see BlobStore.GC) """
+
+		if self.CONTENT_ADDRESSED and self.GetBlobStore().Unlink(path):
+			return
+		filename = "%s/%s" % (self.UPLOAD_DIR, path)
+		if os.path.isfile(filename):
+			os.unlink(filename)
+
 	def LogUpload(self, request, path):
 		pass
 
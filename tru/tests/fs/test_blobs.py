@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import threading
+
+from tru.fs.blobs import BlobStore, main
+
+
+def store(tmp_path, **kwargs):
+	return BlobStore(str(tmp_path / 'uploads'), str(tmp_path / 'blobs.sqlite'), **kwargs)
+
+
+def test_put_once(tmp_path):
+	s = store(tmp_path)
+	digest = hashlib.sha256(b'content').hexdigest()
+
+	path, d, created = s.Put(b'content', '.jpg')
+	assert (d, created) == (digest, True)
+	assert path == 'blobs/{}/{}/{}.jpg'.format(digest[:2], digest[2:4], digest)
+	assert (tmp_path / 'uploads' / path).read_bytes() == b'content'
+
+	assert s.Put(b'content', '.jpeg', digest) == (path, digest, False)
+	assert s.GetStats() == {'blobs': 1, 'bytes': 7, 'refs': 0, 'unreferenced': 1}
+
+
+def test_put_file(tmp_path):
+	s = store(tmp_path)
+	src = tmp_path / 'upload.tmp'
+	src.write_bytes(b'content')
+
+	path, digest, created = s.PutFile(str(src), '.jpg')
+	assert (digest, created) == (hashlib.sha256(b'content').hexdigest(), True)
+	assert not src.exists()  # moved
+	assert (tmp_path / 'uploads' / path).read_bytes() == b'content'
+
+	src.write_bytes(b'content')
+	assert s.PutFile(str(src), '.jpg', digest) == (path, digest, False)
+	assert src.exists()
+	assert s.Put(b'content', '.jpg') == (path, digest, False)
+	assert s.GetStats()['blobs'] == 1
+
+
+def test_references(tmp_path):
+	s = store(tmp_path)
+	path, digest, created = s.Put(b'content', '.jpg')
+
+	assert s.Link('img/a.jpg', digest) == path
+	s.Link('img/b.jpg', digest)
+	assert s.Resolve('img/a.jpg') == path
+	assert s.Resolve('img/c.jpg') is None
+
+	link = tmp_path / 'uploads' / 'img' / 'a.jpg'
+	assert os.path.islink(str(link)) and not os.path.isabs(os.readlink(str(link)))
+	assert link.read_bytes() == b'content'
+	assert s.GetStats() == {'blobs': 1, 'bytes': 7, 'refs': 2, 'unreferenced': 0}
+
+	assert s.Unlink('img/a.jpg')
+	assert not s.Unlink('img/a.jpg')
+	assert not link.exists()
+	assert s.GetStats()['refs'] == 1
+
+	# relinked to another content
+	path2, digest2, created = s.Put(b'other', '.jpg')
+	s.Link('img/b.jpg', digest2)
+	assert (tmp_path / 'uploads' / 'img' / 'b.jpg').read_bytes() == b'other'
+	assert s.GetStats() == {'blobs': 2, 'bytes': 12, 'refs': 1, 'unreferenced': 1}
+
+
+def test_index_only(tmp_path):
+	s = store(tmp_path, symlinks=False)
+	path, digest, created = s.Put(b'content', '.jpg')
+	s.Link('img/a.jpg', digest)
+	assert s.Resolve('img/a.jpg') == path
+	assert not (tmp_path / 'uploads' / 'img').exists()
+
+
+def test_gc(tmp_path):
+	s = store(tmp_path)
+	path, digest, created = s.Put(b'content', '.jpg')
+	kept, kept_digest, created = s.Put(b'kept', '.jpg')
+	s.Link('img/a.jpg', digest)
+	s.Link('img/b.jpg', kept_digest)
+
+	blob = tmp_path / 'uploads' / path
+	thumbs = [blob.with_name(blob.stem + '_1.jpg'), blob.with_name(blob.stem + '_1.jpg.webp')]
+	for i in thumbs:
+		i.write_bytes(b'thumb')
+
+	s.Unlink('img/a.jpg')
+	assert s.GC() == (0, 0)  # in the grace period
+	assert blob.exists()
+
+	assert s.GC(grace=-1) == (1, 7 + 5 + 5)
+	assert not blob.exists() and not any(i.exists() for i in thumbs)
+	assert (tmp_path / 'uploads' / kept).exists()
+	assert s.Resolve('img/b.jpg') == kept
+	assert s.GetStats() == {'blobs': 1, 'bytes': 4, 'refs': 1, 'unreferenced': 0}
+
+	# stored again
+	assert s.Put(b'content', '.jpg') == (path, digest, True)
+
+
+def test_cli(tmp_path, capsys):
+	s = store(tmp_path)
+	s.Put(b'content', '.jpg')
+	args = ['--root', str(tmp_path / 'uploads'), '--db', str(tmp_path / 'blobs.sqlite')]
+
+	assert main(args + ['stats']) == 0
+	assert '"unreferenced": 1' in capsys.readouterr().out
+
+	assert main(args + ['gc', '--grace', '-1']) == 0
+	assert 'Removed: 1 blobs, 7 bytes' in capsys.readouterr().out
+
+	for i in range(5):
+		s.Put(b'content %d' % i, '.jpg')
+	assert main(args + ['gc', '--grace', '-1']) == 0
+	assert 'Removed: 5 blobs, 45 bytes' in capsys.readouterr().out
+
+
+def test_gc_batches(tmp_path):
+	s = store(tmp_path)
+	kept = [s.Put(b'kept %d' % i, '.jpg')[1] for i in range(3)]
+	for i, digest in enumerate(kept):
+		s.Link('img/{}.jpg'.format(i), digest)
+	for i in range(5):
+		s.Put(b'content %d' % i, '.jpg')
+
+	assert s.GC(grace=-1, limit=2) == (5, 5 * 9)
+	assert s.GetStats() == {'blobs': 3, 'bytes': 3 * 6, 'refs': 3, 'unreferenced': 0}
+
+
+def test_gc_concurrent_put(tmp_path, monkeypatch):
+	s = store(tmp_path)
+	path, digest, created = s.Put(b'content', '.jpg')
+	blob = tmp_path / 'uploads' / path
+
+	rename = os.rename
+	renamed = threading.Event()
+	put = []
+
+	def slow_rename(src, dst):
+		rename(src, dst)
+		renamed.set()
+		time.sleep(0.3)  # the row is deleted, but not committed yet
+
+	def upload():
+		renamed.wait(10)
+		put.append(s.Put(b'content', '.jpg'))
+
+	monkeypatch.setattr(os, 'rename', slow_rename)
+	t = threading.Thread(target=upload)
+	t.start()
+	assert s.GC(grace=-1) == (1, 7)
+	t.join()
+
+	# Put waited for GC and stored the content again
+	assert put == [(path, digest, True)]
+	assert blob.read_bytes() == b'content'
+	assert s.GetStats()['blobs'] == 1
@@ -0,0 +1,71 @@
+import gc
+import os
+import hashlib
+
+import pytest
+from PIL import Image
+
+from tru.fs.utils import SpoolFile, SpoolLimitError
+
+
+def chunks(data, size=1000):
+	for i in range(0, len(data), size):
+		yield data[i:i + size]
+
+
+def test_spool_and_commit(tmp_path):
+	data = os.urandom(20000)
+	spool = SpoolFile(str(tmp_path / 'dir'), hasher=hashlib.sha256())
+	for chunk in chunks(data):
+		spool.write(chunk)
+	spool.close()
+
+	assert os.path.dirname(spool.path) == str(tmp_path / 'dir')
+	assert len(spool) == spool.size == 20000
+	assert spool.head == data[:SpoolFile.HEAD_SIZE]
+	assert spool.hexdigest() == hashlib.sha256(data).hexdigest()
+	assert spool.read() == data
+
+	tmp = spool.path
+	spool.Commit(str(tmp_path / 'dir' / 'file.bin'))
+	assert (tmp_path / 'dir' / 'file.bin').read_bytes() == data
+	assert not os.path.exists(tmp)
+
+	del spool
+	gc.collect()
+	assert (tmp_path / 'dir' / 'file.bin').exists()
+
+
+def test_limit(tmp_path):
+	spool = SpoolFile(str(tmp_path), max_size=2500)
+	spool.write(b'x' * 2000)
+	with pytest.raises(SpoolLimitError):
+		spool.write(b'x' * 1000)
+	assert os.listdir(str(tmp_path)) == []
+	assert spool.hexdigest() is None
+
+
+def test_released(tmp_path):
+	spool = SpoolFile(str(tmp_path))
+	spool.write(b'data')
+	assert len(os.listdir(str(tmp_path))) == 1
+	del spool
+	gc.collect()
+	assert os.listdir(str(tmp_path)) == []
+
+
+def test_image_from_file(tmp_path):
+	src = tmp_path / 'src.png'
+	Image.new('RGB', (30, 20), (1, 2, 3)).save(str(src))
+
+	spool = SpoolFile(str(tmp_path / 'spool'))
+	for chunk in chunks(src.read_bytes(), 100):
+		spool.write(chunk)
+	spool.close()
+
+	assert spool.head.startswith(b'\x89PNG')
+	im = Image.open(spool.path)
+	im.load()
+	assert (im.format, im.size) == ('PNG', (30, 20))
+	spool.Discard()
+	assert os.listdir(str(tmp_path / 'spool')) == []
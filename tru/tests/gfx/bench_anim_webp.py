@@ -0,0 +1,61 @@
+"""
+Animated thumbnails: GIF vs animated WEBP (bytes and encode time).
+
+	cd tru && python tests/gfx/bench_anim_webp.py [--images tests/gfx/img/*.gif] [--width 200] [--qualities 60,80,95]
+
+WEBP is measured lossy at the given qualities and lossless (optimize=False).
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from PIL import GifImagePlugin, features  # noqa
+
+from tru.gfx.thumbs import CreateThumb, Operations  # noqa
+
+
+def encode(path, ops, save, runs):
+	times = []
+	for i in range(runs):
+		out = BytesIO()
+		# tru.gfx.pil_fixes replaces the GIF plugin, use the original one for reading
+		src = GifImagePlugin.GifImageFile(path)
+		start = time.perf_counter()
+		CreateThumb(src, out, ops, save)
+		times.append(time.perf_counter() - start)
+	return min(times), len(out.getvalue())
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--images', nargs='*', default=sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'img', '*.gif'))))
+	parser.add_argument('--width', type=int, default=200)
+	parser.add_argument('--qualities', default='60,80,95')
+	parser.add_argument('--runs', type=int, default=3)
+	args = parser.parse_args()
+
+	if not features.check('webp_anim'):
+		sys.exit('PIL without animated WEBP support')
+
+	ops = [Operations.FitWidth(args.width, 0)]
+	saves = [('GIF', Operations.SaveToBuf(format='GIF'))]
+	saves += [('WEBP q{}'.format(q), Operations.SaveToBuf(format='WEBP', quality=q, animated=True)) for q in map(int, args.qualities.split(','))]
+	saves.append(('WEBP lossless', Operations.SaveToBuf(format='WEBP', optimize=False, animated=True)))
+
+	print('{:>24} {:>14} {:>10} {:>10} {:>8}'.format('image', 'format', 'time [ms]', 'bytes', 'saved'))
+	for path in args.images:
+		gif_size = None
+		for name, save in saves:
+			t, size = encode(path, ops, save, args.runs)
+			gif_size = gif_size or size
+			print('{:>24} {:>14} {:>10.1f} {:>10} {:>+7.0%}'.format(os.path.basename(path)[-24:], name, t * 1000, size, size / float(gif_size) - 1))
+
+
+if __name__ == '__main__':
+	main()
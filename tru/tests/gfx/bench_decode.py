@@ -0,0 +1,70 @@
+"""
+Throughput of ImageType.Decode (decoded tokens per second).
+
+	cd tru && python tests/gfx/bench_decode.py [--tokens 1000] [--runs 5]
+
+Measured: current tokens (cold: the cache is cleared before every run, and cached),
+legacy tokens (verified by the md5 of the url-encoded filename - the 4th of the
+legacy checks) and a rejected token.
+"""
+
+import argparse
+import os
+import sys
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from struct import pack
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from tru.gfx.coder import ImageType  # noqa
+from tru.io.hash import Hash  # noqa
+
+
+KEY = b'5f1d6e0c9a8b7f3e2d1c0b9a8f7e6d5c'
+
+
+def legacy(it, filename):
+	trx = urlsafe_b64decode(it.Encode(filename, KEY).encode('ascii'))[1:-4]
+	return urlsafe_b64encode(trx + pack('!I', Hash(KEY + trx + quote(filename).encode('ascii')) & 0xFFFFFFFF)).decode('ascii')
+
+
+def measure(items, runs, clear):
+	best = None
+	for i in range(runs):
+		if clear:
+			ImageType.decoded.Clear()
+		start = time.perf_counter()
+		for token, filename in items:
+			try:
+				ImageType.Decode(token, filename, KEY)
+			except ValueError:
+				pass
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return len(items) / best
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--tokens', type=int, default=1000)
+	parser.add_argument('--runs', type=int, default=5)
+	args = parser.parse_args()
+
+	it = ImageType(1, ImageType.MaxBox(640, 480), 'JPEG', quality=85)
+	filenames = ['upload/2020/{:04}/zdjęcie {}.jpg'.format(i % 97, i) for i in range(args.tokens)]
+
+	current = [(it.Encode(i, KEY), i) for i in filenames]
+	old = [(legacy(it, i), i) for i in filenames]
+	rejected = [(token, 'other.jpg') for token, i in current]
+
+	print('{:>20} {:>14}'.format('tokens', 'decodes/s'))
+	print('{:>20} {:>14,.0f}'.format('current (cold)', measure(current, args.runs, True)))
+	print('{:>20} {:>14,.0f}'.format('current (cached)', measure(current, args.runs, False)))
+	print('{:>20} {:>14,.0f}'.format('legacy (cold)', measure(old, args.runs, True)))
+	print('{:>20} {:>14,.0f}'.format('rejected', measure(rejected, args.runs, True)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+"""
+Encoder effort sweep: time and bytes of the encoder options by the output size,
+the source of the defaults of tru.gfx.thumbs.EffortPolicy.
+
+	cd tru && python tests/gfx/bench_effort.py [--image path] [--sides 64,128,256,512,1024,2048] [--quality 85]
+
+Suggested thresholds: the largest size at which progressive JPEG is not smaller
+than the baseline (optimized) one, and the smallest size at which WEBP method 6
+saves at least --min-saving (10%) against method 2.
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from PIL import Image  # noqa
+
+from bench_variants import synthetic  # noqa
+
+
+def encode(img, fmt, runs, **params):
+	times = []
+	for i in range(runs):
+		buf = BytesIO()
+		start = time.perf_counter()
+		img.save(buf, fmt, **params)
+		times.append(time.perf_counter() - start)
+	return min(times) * 1000, len(buf.getvalue())
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--image', default=None, help='source image (synthetic by default)')
+	parser.add_argument('--sides', default='64,128,256,512,1024,2048', help='widths of the outputs (4:3)')
+	parser.add_argument('--quality', type=int, default=85)
+	parser.add_argument('--min-saving', type=float, default=0.1)
+	parser.add_argument('--runs', type=int, default=3)
+	args = parser.parse_args()
+
+	sides = list(map(int, args.sides.split(',')))
+	src = Image.open(args.image).convert('RGB') if args.image else synthetic((max(sides) * 3 // 2, max(sides) * 9 // 8))
+
+	jpeg = [('baseline', {}), ('optimize', {'optimize': True}), ('progressive', {'progressive': True}), ('opt+prog', {'optimize': True, 'progressive': True})]
+	webp = [('method {}'.format(m), {'method': m}) for m in (0, 2, 4, 6)]
+
+	progressive_below = webp_above = None
+
+	print('{:>6} {:>10} {:>14} {:>10} {:>10}'.format('format', 'pixels', 'options', 'time [ms]', 'bytes'))
+	for side in sides:
+		img = src.resize((side, side * 3 // 4), Image.LANCZOS)
+		pixels = img.width * img.height
+
+		results = {}
+		for fmt, variants in (('JPEG', jpeg), ('WEBP', webp)):
+			for name, params in variants:
+				t, size = results[name] = encode(img, fmt, args.runs, quality=args.quality, **params)
+				print('{:>6} {:>10} {:>14} {:>10.2f} {:>10}'.format(fmt, pixels, name, t, size))
+
+		if results['opt+prog'][1] >= results['optimize'][1]:
+			progressive_below = pixels
+		if webp_above is None and results['method 6'][1] <= results['method 2'][1] * (1 - args.min_saving):
+			webp_above = pixels
+
+	print()
+	print('progressive JPEG does not pay off up to: {} pixels'.format(progressive_below))
+	print('WEBP method 6 pays off from: {} pixels'.format(webp_above))
+
+
+if __name__ == '__main__':
+	main()
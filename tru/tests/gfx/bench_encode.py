@@ -0,0 +1,62 @@
+"""
+Thumbnail tokens of a gallery page: ImageType.Encode per image vs ImageType.EncodeMany,
+and srcset of every image in a few widths: a loop over Encode, get_path and GetFinalSize
+vs BuildSrcSets.
+
+	cd tru && python tests/gfx/bench_encode.py [--images 300] [--runs 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from tru.gfx.coder import ImageType, BuildSrcSets  # noqa
+
+
+KEY = b'5f1d6e0c9a8b7f3e2d1c0b9a8f7e6d5c'
+
+
+def measure(func, runs):
+	best = None
+	for i in range(runs):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--images', type=int, default=300)
+	parser.add_argument('--runs', type=int, default=20)
+	args = parser.parse_args()
+
+	it = ImageType(1, ImageType.MaxBox(640, 480), 'JPEG', quality=85)
+	filenames = ['upload/2020/{:04}/zdjęcie {}.jpg'.format(i % 97, i) for i in range(args.images)]
+	assert it.EncodeMany(filenames, KEY) == [it.Encode(i, KEY) for i in filenames]
+
+	single = measure(lambda: [it.Encode(i, KEY) for i in filenames], args.runs)
+	many = measure(lambda: it.EncodeMany(filenames, KEY), args.runs)
+
+	print('{:>12} {:>12} {:>12}'.format('', 'ms/page', 'tokens/s'))
+	print('{:>12} {:>12.3f} {:>12,.0f}'.format('Encode', single * 1000, args.images / single))
+	print('{:>12} {:>12.3f} {:>12,.0f}'.format('EncodeMany', many * 1000, args.images / many))
+
+	types = [ImageType(i, ImageType.FitWidth(w), 'JPEG') for i, w in enumerate((320, 640, 960, 1280, 1920))]
+	records = [(name, 400 + i * 7 % 3000, 300 + i * 13 % 2000) for i, name in enumerate(filenames)]
+
+	def loop():
+		return [[(it.Encode(name, KEY), it.get_path(name), it.GetFinalSize(w, h)) for it in types] for name, w, h in records]
+
+	single = measure(loop, args.runs)
+	many = measure(lambda: BuildSrcSets(records, types, KEY), args.runs)
+	print('{:>12} {:>12.3f}'.format('srcset loop', single * 1000))
+	print('{:>12} {:>12.3f}'.format('BuildSrcSets', many * 1000))
+
+
+if __name__ == '__main__':
+	main()
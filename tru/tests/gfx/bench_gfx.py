@@ -0,0 +1,203 @@
+"""
+Benchmark suite for tru.gfx.thumbs: all Operations, the GIF path of Transform and
+SaveToBuf for every format/quality, on synthetic images of several sizes and modes.
+
+	cd tru
+	python tests/gfx/bench_gfx.py --save baseline.json               # record a baseline
+	python tests/gfx/bench_gfx.py --compare baseline.json            # exit code 1 on regressions
+	python tests/gfx/bench_gfx.py --filter Fit --sizes 640x480       # a subset
+
+Timings are the best of --repeat runs. Results are normalized by a short pure
+Python calibration loop, so a baseline recorded on another machine is still usable
+(with a generous --threshold).
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+import PIL  # noqa
+from PIL import GifImagePlugin, Image, ImageDraw  # noqa
+
+from tru.gfx.thumbs import FuseOps, Operations, Transform  # noqa
+
+
+SIZES = ['640x480', '1920x1080', '4000x3000']
+MODES = ['RGB', 'RGBA']
+
+
+def synthetic(size, mode):
+	im = Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 64).convert('RGB')
+	draw = ImageDraw.Draw(im)
+	for i in range(0, size[0], max(size[0] // 40, 1)):
+		draw.line((i, 0, size[0] - i, size[1]), fill=(i % 255, 200, 80), width=3)
+	if mode == 'RGBA':
+		im.putalpha(Image.linear_gradient('L').resize(size))
+	return im
+
+
+def synthetic_gif(size, frames=20):
+	base = synthetic(size, 'RGB')
+	all_frames = []
+	for i in range(frames):
+		im = base.copy()
+		ImageDraw.Draw(im).ellipse((i * 5, i * 3, i * 5 + size[0] // 4, i * 3 + size[1] // 4), fill=(255, 255, 0))
+		all_frames.append(im.convert('P', palette=Image.ADAPTIVE))
+	buf = BytesIO()
+	all_frames[0].save(buf, 'GIF', save_all=True, append_images=all_frames[1:], duration=50, loop=0)
+	return buf.getvalue()
+
+
+def operations(size):
+	w, h = size
+	watermark = synthetic((200, 80), 'RGBA')
+	fast, balanced = Operations.MaxBox(800, 800), Operations.MaxBox(800, 800)
+	fast.speed, balanced.speed = 'fast', 'balanced'
+	return [
+		('FitWidth', Operations.FitWidth(300, 0)),
+		('FitAll', Operations.FitAll(300, 300)),
+		('MaxBox', Operations.MaxBox(800, 800)),
+		('MaxBox[balanced]', balanced),
+		('MaxBox[fast]', fast),
+		('Force', Operations.Force(300, 200)),
+		('Manual', Operations.Manual(w // 2, h // 2, (10, 10, w // 4, h // 4))),
+		('RotateImage', Operations.RotateImage()),
+		('Color', Operations.Color(30)),
+		('Contrast', Operations.Contrast(30)),
+		('Brightness', Operations.Brightness(-20)),
+		('PointOps', FuseOps([Operations.Contrast(30), Operations.Brightness(-20)])[0]),
+		('Watermark', Operations.Watermark(watermark)),
+		('Watermark+frame', Operations.Watermark(watermark, frame=watermark)),
+	]
+
+
+SAVES = [
+	('JPEG', dict(quality=75)),
+	('JPEG', dict(quality=95)),
+	('JPEG', dict(quality=85, optimize=False, progressive=False)),
+	('PNG', dict()),
+	('PNG', dict(optimize=False)),
+	('GIF', dict()),
+	('WEBP', dict(quality=75)),
+	('WEBP', dict(quality=0)),
+	('WEBP', dict(quality=90, optimize=False)),
+]
+
+
+def cases(sizes, modes):
+
+	for size_name in sizes:
+		size = tuple(map(int, size_name.split('x')))
+
+		for mode in modes:
+			img = synthetic(size, mode)
+			for name, op in operations(size):
+				if name == 'Watermark+frame':
+					# the layers are cached, measure the cold path
+					yield 'op/{}/{}/{}'.format(name, size_name, mode), lambda op=op, img=img: (Operations.Watermark.cache.Clear(), op(img))
+				else:
+					yield 'op/{}/{}/{}'.format(name, size_name, mode), lambda op=op, img=img: op(img)
+
+			thumb = Operations.MaxBox(800, 800)(img)
+			for fmt, params in SAVES:
+				save = Operations.SaveToBuf(format=fmt, **params)
+				name = 'save/{}/{}/{}/{}'.format(fmt, ','.join('{}={}'.format(k, v) for k, v in sorted(params.items())) or 'default', size_name, mode)
+				yield name, lambda save=save, img=thumb, src=img: save(None, src, BytesIO(), img)
+
+		gif = synthetic_gif((min(size[0], 800), min(size[1], 600)))
+		for name, ops in (('FitWidth', [Operations.FitWidth(200, 0)]), ('FitAll', [Operations.FitAll(150, 150)])):
+			save = Operations.SaveToBuf(format='GIF')
+
+			def gif_transform(ops=ops, save=save, gif=gif):
+				# like in tests: pil_fixes.AnimatedGifImageFile does not work with the recent Pillow
+				src = GifImagePlugin.GifImageFile(BytesIO(gif))
+				save(None, src, BytesIO(), Transform(src, ops))
+
+			yield 'gif/{}/{}'.format(name, size_name), gif_transform
+
+
+def measure(func, repeat):
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+
+def calibrate():
+	def loop():
+		x = 0
+		for i in range(300000):
+			x += i * i
+		return x
+	return measure(loop, 5)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', default=','.join(SIZES))
+	parser.add_argument('--modes', default=','.join(MODES))
+	parser.add_argument('--filter', default=None, help='regexp of benchmark names')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--save', default=None, metavar='JSON', help='store results as a baseline')
+	parser.add_argument('--compare', default=None, metavar='JSON', help='compare with a baseline')
+	parser.add_argument('--threshold', type=float, default=0.3, help='allowed slowdown (0.3 = 30%%)')
+	args = parser.parse_args()
+
+	name_re = re.compile(args.filter) if args.filter else None
+	calibration = calibrate()
+
+	results = {}
+	for name, func in cases(args.sizes.split(','), args.modes.split(',')):
+		if name_re is not None and not name_re.search(name):
+			continue
+		func()  # warm up
+		results[name] = measure(func, args.repeat)
+		print('{:<60} {:>10.2f} ms'.format(name, results[name] * 1000))
+
+	report = {
+		'python': platform.python_version(),
+		'pillow': PIL.__version__,
+		'machine': platform.machine(),
+		'calibration': calibration,
+		'results': results,
+	}
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+
+		speed = calibration / baseline['calibration']
+		regressions = []
+		print('\n{:<60} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+		for name, value in sorted(results.items()):
+			if name not in baseline['results']:
+				continue
+			expected = baseline['results'][name] * speed
+			change = value / expected - 1
+			flag = ' !' if change > args.threshold else ''
+			print('{:<60} {:>9.2f} ms {:>9.2f} ms {:>+7.0%}{}'.format(name, expected * 1000, value * 1000, change, flag))
+			if flag:
+				regressions.append(name)
+
+		if regressions:
+			print('\n{} regression(s) over {:.0%}'.format(len(regressions), args.threshold))
+			return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
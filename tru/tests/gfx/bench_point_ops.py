@@ -0,0 +1,57 @@
+"""
+Color/Contrast/Brightness: chained ImageEnhance passes vs FuseOps.
+
+	cd tru && python tests/gfx/bench_point_ops.py [--size 3000x2000] [--runs 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from PIL import Image  # noqa
+
+from tru.gfx.thumbs import FuseOps, Operations  # noqa
+
+
+def chain(img, ops):
+	for op in ops:
+		img = op(img)
+	return img
+
+
+def best(func, runs):
+	times = []
+	for i in range(runs):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times) * 1000
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', default='3000x2000')
+	parser.add_argument('--runs', type=int, default=5)
+	args = parser.parse_args()
+
+	size = tuple(map(int, args.size.split('x')))
+	img = Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 100).convert('RGB')
+
+	cases = (
+		('Contrast+Brightness', [Operations.Contrast(20), Operations.Brightness(-10)]),
+		('Color+Contrast+Brightness', [Operations.Color(30), Operations.Contrast(20), Operations.Brightness(-10)]),
+		('... before FitWidth(300)', [Operations.Color(30), Operations.Contrast(20), Operations.Brightness(-10), Operations.FitWidth(300, 0)]),
+	)
+
+	print('source: {}x{} RGB, {} runs'.format(size[0], size[1], args.runs))
+	print('{:<28} {:>12} {:>12}'.format('operations', 'chain [ms]', 'fused [ms]'))
+	for name, ops in cases:
+		fused = FuseOps(ops)
+		print('{:<28} {:>12.1f} {:>12.1f}'.format(name, best(lambda: chain(img, ops), args.runs), best(lambda: chain(img, fused), args.runs)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,86 @@
+"""
+Shrink-on-load benchmark: time and peak memory per thumbnail.
+
+	cd tru && python tests/gfx/bench_shrink_on_load.py [--size 6000x4000] [--runs 5]
+
+Every variant runs in a fresh (spawned) process, peak memory is the growth of
+VmHWM (ru_maxrss survives exec, so it would include the parent process).
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+
+def make_source(path, size):
+	from PIL import Image, ImageDraw
+
+	im = Image.new('RGB', size, (40, 90, 160))
+	draw = ImageDraw.Draw(im)
+	for i in range(0, size[0], 97):
+		draw.line((i, 0, size[0] - i, size[1]), fill=(i % 255, 200, 80), width=9)
+	im.save(path, 'JPEG', quality=92)
+
+
+def peak_rss():
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith('VmHWM:'):
+				return int(line.split()[1])
+	return 0
+
+
+def run(args):
+	src, op_name, op_args, shrink_on_load, runs = args
+
+	from io import BytesIO
+	from tru.gfx.thumbs import CreateThumb, Operations
+
+	op = getattr(Operations, op_name)(*op_args)
+	save = Operations.SaveToBuf(format='JPEG', quality=85)
+
+	base_rss = peak_rss()
+	times = []
+	for i in range(runs):
+		start = time.perf_counter()
+		CreateThumb(src, BytesIO(), [op], save, shrink_on_load=shrink_on_load)
+		times.append(time.perf_counter() - start)
+	peak = peak_rss()
+
+	return min(times), (peak - base_rss) / 1024.0
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', default='6000x4000')
+	parser.add_argument('--runs', type=int, default=5)
+	args = parser.parse_args()
+
+	size = tuple(map(int, args.size.split('x')))
+	ctx = multiprocessing.get_context('spawn')
+
+	with tempfile.TemporaryDirectory() as tmp:
+		src = os.path.join(tmp, 'source.jpg')
+		make_source(src, size)
+
+		print('source: {}x{} JPEG, {} runs'.format(size[0], size[1], args.runs))
+		print('{:<22} {:>12} {:>12} {:>12} {:>12}'.format('operation', 'before [ms]', 'after [ms]', 'before [MB]', 'after [MB]'))
+
+		for op_name, op_args in (('FitWidth', (300, 0)), ('FitAll', (300, 300)), ('MaxBox', (800, 800)), ('Force', (300, 200)), ('Manual', (300, 200, None))):
+			res = []
+			for shrink_on_load in (False, True):
+				with ctx.Pool(1) as pool:
+					res.append(pool.apply(run, ((src, op_name, op_args, shrink_on_load, args.runs), )))
+
+			(t0, m0), (t1, m1) = res
+			print('{:<22} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+				'{}{}'.format(op_name, op_args), t0 * 1000, t1 * 1000, m0, m1))
+
+
+if __name__ == '__main__':
+	main()
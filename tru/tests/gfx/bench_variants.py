@@ -0,0 +1,71 @@
+"""
+Alternative formats of thumbnails: encode time vs bytes saved (against JPEG at the same quality).
+
+	cd tru && python tests/gfx/bench_variants.py [--image path] [--size 800x600] [--qualities 60,75,85,95]
+
+AVIF is measured only when PIL can encode it (an AVIF plugin is installed).
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+from PIL import Image, ImageDraw  # noqa
+
+from tru.gfx.thumbs import CanSave, Operations  # noqa
+
+
+def synthetic(size):
+	im = Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 128).convert('RGB')
+	noise = Image.effect_noise(size, 24).convert('RGB')
+	im = Image.blend(im, noise, 0.15)
+	draw = ImageDraw.Draw(im)
+	for i in range(0, size[0], max(size[0] // 20, 1)):
+		draw.ellipse((i, i // 2, i + size[0] // 8, i // 2 + size[1] // 8), outline=(i % 255, 80, 200), width=3)
+	return im
+
+
+def encode(img, fmt, quality, runs):
+	save = Operations.SaveToBuf(format=fmt, quality=quality)
+	times = []
+	for i in range(runs):
+		buf = BytesIO()
+		start = time.perf_counter()
+		save(None, img, buf, img)
+		times.append(time.perf_counter() - start)
+	return min(times), len(buf.getvalue())
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--image', default=None, help='source image (synthetic by default)')
+	parser.add_argument('--size', default='800x600', help='size of the thumbnail')
+	parser.add_argument('--qualities', default='60,75,85,95')
+	parser.add_argument('--runs', type=int, default=3)
+	args = parser.parse_args()
+
+	size = tuple(map(int, args.size.split('x')))
+	img = Image.open(args.image).convert('RGB') if args.image else synthetic(size)
+	img = Operations.MaxBox(*size)(img)
+
+	formats = [fmt for fmt in ('WEBP', 'AVIF') if CanSave(fmt)]
+
+	print('{:>8} {:>8} {:>10} {:>10} {:>8} {:>10}'.format('format', 'quality', 'time [ms]', 'bytes', 'saved', 'ms/kB'))
+	for quality in map(int, args.qualities.split(',')):
+		jpeg_time, jpeg_size = encode(img, 'JPEG', quality, args.runs)
+		print('{:>8} {:>8} {:>10.1f} {:>10} {:>8} {:>10}'.format('JPEG', quality, jpeg_time * 1000, jpeg_size, '-', '-'))
+		for fmt in formats:
+			t, size = encode(img, fmt, quality, args.runs)
+			saved = jpeg_size - size
+			print('{:>8} {:>8} {:>10.1f} {:>10} {:>+7.0%} {:>10}'.format(
+				fmt, quality, t * 1000, size, -saved / float(jpeg_size),
+				'{:.2f}'.format((t - jpeg_time) * 1000 / (saved / 1024.0)) if saved > 0 else '-'
+			))
+
+
+if __name__ == '__main__':
+	main()
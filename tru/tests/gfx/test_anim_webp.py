@@ -0,0 +1,144 @@
+import weakref
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat, GifImagePlugin, features
+
+from tru.gfx.coder import ImageType
+from tru.gfx.thumbs import CreateThumb, Operations, Transform, WebpStreamWriter
+
+
+pytestmark = pytest.mark.skipif(not features.check('webp_anim'), reason='PIL without animated WEBP support')
+
+KEY = b'secret'
+
+
+def animation(count=6, size=(200, 150), durations=None, loop=0, transparent=False):
+	frames = []
+	for i in range(count):
+		im = Image.new('RGBA' if transparent else 'RGB', size, (0, 0, 0, 0) if transparent else (20, 50, 100))
+		ImageDraw.Draw(im).rectangle((i * 20, 20, i * 20 + 30, 60), fill=(255, 255, 0))
+		frames.append(im)
+	buf = BytesIO()
+	frames[0].save(buf, 'GIF', save_all=True, append_images=frames[1:], duration=durations or 80, loop=loop, disposal=2 if transparent else 0)
+	buf.seek(0)
+	return buf
+
+
+def render(src, save, ops=None):
+	# tru.gfx.pil_fixes replaces the GIF plugin, use the original one for reading
+	out = BytesIO()
+	CreateThumb(GifImagePlugin.GifImageFile(src), out, ops or [Operations.FitWidth(100, 0)], save)
+	out.seek(0)
+	return Image.open(out)
+
+
+def frames(im):
+	for i in range(im.n_frames):
+		im.seek(i)
+		frame = im.convert('RGBA')  # info of the frame is set by load()
+		yield im.info.get('duration'), frame
+
+
+def test_animated_webp():
+	durations = [100, 200, 50, 50, 300, 120]
+	res = render(animation(durations=durations, loop=3), Operations.SaveToBuf(format='WEBP', quality=90, animated=True))
+
+	assert res.format == 'WEBP'
+	assert res.n_frames == 6
+	assert res.info['loop'] == 3
+	assert [d for d, frame in frames(res)] == durations
+
+	org = GifImagePlugin.GifImageFile(animation())
+	for (d, frame), i in zip(frames(res), range(6)):
+		org.seek(i)
+		expected = org.convert('RGBA').resize(frame.size, Image.ANTIALIAS)
+		assert max(ImageStat.Stat(ImageChops.difference(frame, expected)).mean[:3]) < 4
+
+
+def test_transparency_and_disposal():
+	res = render(animation(transparent=True), Operations.SaveToBuf(format='WEBP', optimize=False, animated=True))
+	assert res.n_frames == 6
+
+	def visible(frame):
+		return frame.getchannel('A').point(lambda a: 255 if a > 128 else 0).getbbox()
+
+	# the frames composed by the GIF reader are stored as they are (transparency kept)
+	expected = Transform(GifImagePlugin.GifImageFile(animation(transparent=True)), [Operations.FitWidth(100, 0)])
+	for (d, frame), org in zip(frames(res), expected):
+		assert visible(frame) == visible(org)
+	assert visible(next(frames(res))[1]) == (0, 10, 16, 30)
+
+
+def test_static_webp_by_default():
+	res = render(animation(), Operations.SaveToBuf(format='WEBP'))
+	assert getattr(res, 'n_frames', 1) == 1
+
+
+def test_single_frame():
+	src = BytesIO()
+	Image.new('RGB', (200, 150), (1, 2, 3)).save(src, 'GIF')
+	src.seek(0)
+	res = render(src, Operations.SaveToBuf(format='WEBP', animated=True))
+	assert getattr(res, 'n_frames', 1) == 1
+	assert res.size == (100, 75)
+
+
+def test_encode_decode():
+	it = ImageType(1, ImageType.FitWidth(100), 'WEBP', animated=True)
+	token = it.Encode('a.gif', KEY)
+	decoded = ImageType.Decode(token, 'a.gif', KEY)
+	assert decoded.save_to.format == 'WEBP' and decoded.save_to.animated
+	assert decoded.Encode('a.gif', KEY) == token
+	assert it.get_path('a.gif').endswith('a_1.webp')
+
+	static = ImageType(1, ImageType.FitWidth(100), 'WEBP')
+	assert static.Encode('a.gif', KEY) != token
+	assert not ImageType.Decode(static.Encode('a.gif', KEY), 'a.gif', KEY).save_to.animated
+
+
+def test_same_as_save_all():
+	frames = list(Transform(GifImagePlugin.GifImageFile('tests/gfx/img/giphy.gif'), [Operations.FitWidth(200, 0)]))
+	durations = [frame.info.get('duration') or 50 for frame in frames]
+
+	expected = BytesIO()
+	frames[0].save(expected, 'WEBP', save_all=True, append_images=frames[1:], duration=durations, loop=0, minimize_size=True, quality=80, method=2)
+
+	out = BytesIO()
+	writer = WebpStreamWriter(out, frames[0].size, loop=0, background=WebpStreamWriter.GetBackground(frames[0]), minimize_size=True, quality=80, method=2)
+	for frame, duration in zip(frames, durations):
+		writer.Write(frame, duration)
+	writer.Close()
+	assert out.getvalue() == expected.getvalue()
+
+
+def test_frames_released():
+	alive = []
+	refs = []
+
+	def frames():
+		for i in range(20):
+			alive.append(sum(1 for r in refs if r() is not None))
+			frame = Image.new('RGBA', (100, 80), (i * 10, 0, 0, 255))
+			frame.info['duration'] = 40
+			refs.append(weakref.ref(frame))
+			yield frame
+
+	out = BytesIO()
+	Operations.SaveToBuf(format='WEBP', animated=True)(None, Image.new('RGB', (100, 80)), out, frames())
+	assert max(alive) <= 2  # the first frame and the previous one
+	out.seek(0)
+	assert Image.open(out).n_frames == 20
+
+
+def test_other_pillow(monkeypatch):
+	def save():
+		out = BytesIO()
+		CreateThumb(GifImagePlugin.GifImageFile('tests/gfx/img/giphy.gif'), out, [Operations.FitWidth(200, 0)], Operations.SaveToBuf(format='WEBP', animated=True))
+		return out.getvalue()
+
+	streamed = save()
+	# the encoder of libwebp is not used directly with other versions of PIL, save_all is used then
+	monkeypatch.setattr(WebpStreamWriter, 'SUPPORTED', False)
+	monkeypatch.setattr(WebpStreamWriter, 'Write', None)
+	assert save() == streamed
@@ -0,0 +1,102 @@
+from PIL import Image, ImageChops, ImageDraw, GifImagePlugin
+
+from tru.gfx.coder import ImageType
+from tru.gfx.thumbs import CreateThumb, CreateThumbs
+
+
+def source(path, size=(2400, 1600)):
+	im = Image.new('RGB', size, (40, 90, 160))
+	draw = ImageDraw.Draw(im)
+	for i in range(0, size[0], 50):
+		draw.line((i, 0, size[0] - i, size[1]), fill=(i % 255, 200, 80), width=7)
+	im.save(path, 'JPEG', quality=92)
+	return path
+
+
+variants = [
+	ImageType(1, ImageType.FitWidth(120), 'PNG'),
+	ImageType(2, ImageType.MaxBox(1000, 1000), 'PNG'),
+	ImageType(3, ImageType.FitAll(160, 160), 'PNG'),
+	ImageType(4, ImageType.FitWidth(400), 'PNG'),
+	ImageType(5, ImageType.Force(300, 200), 'PNG'),
+	ImageType(6, ImageType.Original(), 'PNG'),
+]
+
+
+def test_same_as_create_thumb(tmp_path):
+	src = source(str(tmp_path / 'src.jpg'))
+
+	thumbs = [(it.get_path(src, force_custom=True), it) for it in variants]
+	res = CreateThumbs(src, thumbs)
+	assert sorted(res) == sorted(path for path, it in thumbs)
+
+	for path, it in thumbs:
+		single = str(tmp_path / 'single_{}.png'.format(it.id))
+		CreateThumb(src, single, it.GetOps(), it.save_to)
+
+		a = Image.open(path).convert('RGB')
+		b = Image.open(single).convert('RGB')
+		assert a.size == b.size
+		diff = ImageChops.difference(a.resize((20, 20)), b.resize((20, 20)))
+		assert max(max(px) for px in diff.getdata()) <= 8
+
+
+def test_on_new_image(tmp_path):
+	src = source(str(tmp_path / 'src.jpg'), (800, 600))
+
+	calls = []
+	CreateThumb.OnNewImage.append(lambda thumb_path, image_path, fmt, params: calls.append(thumb_path))
+	try:
+		thumbs = [(it.get_path(src, force_custom=True), it) for it in variants]
+		CreateThumbs(src, thumbs)
+	finally:
+		CreateThumb.OnNewImage.pop()
+
+	assert sorted(calls) == sorted(path for path, it in thumbs)
+
+
+def test_gif(tmp_path):
+	src = 'tests/gfx/img/wittenberga.gif'
+	thumbs = [(str(tmp_path / 'a.gif'), ImageType(1, ImageType.FitWidth(100), 'GIF')), (str(tmp_path / 'b.gif'), ImageType(2, ImageType.FitWidth(50), 'GIF'))]
+	CreateThumbs(src, thumbs)
+	assert Image.open(thumbs[0][0]).width == 100
+	assert Image.open(thumbs[1][0]).width == 50
+
+
+def test_animated_gif_decoded_once(tmp_path):
+	src = 'tests/gfx/img/giphy.gif'
+	types = [
+		ImageType(1, ImageType.FitWidth(120), 'GIF'),
+		ImageType(2, ImageType.FitWidth(60), 'GIF'),
+		ImageType(3, ImageType.FitWidth(80), 'PNG'),  # takes only the first frame
+	]
+	thumbs = [(str(tmp_path / '{}.{}'.format(it.id, it.save_to.format.lower())), it) for it in types]
+
+	# tru.gfx.pil_fixes replaces the GIF plugin, use the original one for reading
+	im = GifImagePlugin.GifImageFile(src)
+	n_frames = im.n_frames
+	seeks = []
+	seek = im.seek
+	im.seek = lambda i: seeks.append(i) or seek(i)
+	CreateThumbs(im, thumbs)
+	assert len(seeks) <= n_frames + 1
+
+	for path, it in thumbs:
+		single = str(tmp_path / 'single_{}.{}'.format(it.id, it.save_to.format.lower()))
+		CreateThumb(GifImagePlugin.GifImageFile(src), single, it.GetOps(), it.save_to)
+		assert open(path, 'rb').read() == open(single, 'rb').read()
+
+
+def test_upscale_variants(tmp_path):
+	# the source is smaller than all the targets: every variant gets the decoded source as it is
+	src = source(str(tmp_path / 'src.jpg'), (800, 600))
+	types = [ImageType(i, ImageType.FitWidth(1000 + i), 'JPEG') for i in range(8)]
+	thumbs = [(str(tmp_path / '{}.jpg'.format(it.id)), it) for it in types]
+
+	for i in range(5):
+		assert CreateThumbs(src, thumbs) == [path for path, it in thumbs]
+
+	for path, it in thumbs:
+		single = str(tmp_path / 'single_{}.jpg'.format(it.id))
+		CreateThumb(src, single, it.GetOps(), it.save_to)
+		assert open(path, 'rb').read() == open(single, 'rb').read()
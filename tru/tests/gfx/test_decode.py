@@ -0,0 +1,121 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from struct import pack
+from urllib.parse import quote
+
+import pytest
+
+from tru.gfx import coder
+from tru.gfx.coder import ImageType
+from tru.io.hash import Hash, Hash_v1
+
+
+KEY = b'secret'
+
+
+def legacy(it, filename, quoted=False, adler=False):
+	""" Token as encoded before the encoder version (adler32 ones with a 64-bit hash) """
+	trx = urlsafe_b64decode(it.Encode(filename, KEY))[1:-4].rstrip(b'\0')
+	trx += b'\0' * ((3 - ((len(trx) + (8 if adler else 4)) % 3)) % 3)
+	if quoted:
+		filename = quote(filename)
+	if adler:
+		return urlsafe_b64encode(trx + pack('!q', Hash_v1(KEY + trx + filename.encode('utf8')))).decode('ascii')
+	return urlsafe_b64encode(trx + pack('!I', Hash(KEY + trx + filename.encode('utf8')) & 0xFFFFFFFF)).decode('ascii')
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+	ImageType.decoded.Clear()
+	yield
+	ImageType.decoded.Clear()
+
+
+def test_version():
+	it = ImageType(1, ImageType.MaxBox(300, 200), 'JPEG', quality=80)
+	token = it.Encode('a/b.jpg', KEY)
+	assert urlsafe_b64decode(token)[0] == ImageType.ENCODER_VERSION
+	assert '=' not in token
+
+	decoded = ImageType.Decode(token, 'a/b.jpg', KEY)
+	assert decoded.thumb.get_size() == (300, 200)
+	assert decoded.save_to.quality == 80
+	assert decoded.Encode('a/b.jpg', KEY) == token
+
+
+def test_single_hash(monkeypatch):
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG')
+	token = it.Encode('ą/b.png', KEY)
+
+	calls = []
+	monkeypatch.setattr(coder, 'Hash', lambda data: calls.append(data) or Hash(data))
+	monkeypatch.setattr(coder, 'Hash_v1', None)  # legacy fallbacks are not called
+
+	assert ImageType.Decode(token, 'ą/b.png', KEY).save_to.format == 'PNG'
+	assert len(calls) == 1
+
+	with pytest.raises(ValueError):
+		ImageType.Decode(token, 'other.png', KEY)
+	with pytest.raises(ValueError):
+		ImageType.Decode(token, 'ą/b.png', b'other')
+	assert len(calls) == 3
+
+
+@pytest.mark.parametrize('quoted', [False, True])
+@pytest.mark.parametrize('adler', [False, True])
+def test_legacy(quoted, adler):
+	it = ImageType(1, ImageType.FitAll(120, 80), 'WEBP', speed='fast')
+	token = legacy(it, 'zdjęcia/a b.jpg', quoted=quoted, adler=adler)
+	assert not token.startswith('AA')
+
+	decoded = ImageType.Decode(token, 'zdjęcia/a b.jpg', KEY)
+	assert decoded.thumb.get_size() == (120, 80)
+	assert decoded.save_to.format == 'WEBP' and decoded.speed == 'fast'
+
+	with pytest.raises(ValueError):
+		ImageType.Decode(token, 'zdjęcia/c.jpg', KEY)
+
+
+@pytest.mark.parametrize('filename', ['zdjęcia/a b.jpg', 'a/b.jpg', 'a/100%.jpg'])
+def test_quoted_filename(filename):
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	token = it.Encode(quote(filename), KEY)
+	assert it.Encode(filename, KEY) == token
+	assert it.EncodeMany([filename, quote(filename)], KEY) == [token, token]
+
+	for name in (filename, quote(filename)):
+		assert ImageType.Decode(token, name, KEY).thumb.get_size()[0] == 100
+	with pytest.raises(ValueError):
+		ImageType.Decode(token, 'zdjęcia/c.jpg', KEY)
+
+
+def test_cache():
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	token = it.Encode('a.jpg', KEY)
+	hits = ImageType.decoded.hits
+
+	first = ImageType.Decode(token, 'a.jpg', KEY)
+	first.color = 50
+	second = ImageType.Decode(token, 'a.jpg', KEY)
+	assert second is not first and second.color == 0
+	assert ImageType.decoded.hits == hits + 1 and len(ImageType.decoded) == 1
+
+	# failures are not cached
+	for i in range(2):
+		with pytest.raises(ValueError):
+			ImageType.Decode(token, 'b.jpg', KEY)
+	assert len(ImageType.decoded) == 1
+
+
+def test_cache_is_bounded(monkeypatch):
+	monkeypatch.setattr(ImageType.decoded, 'max_items', 10)
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	for i in range(30):
+		name = '{}.jpg'.format(i)
+		ImageType.Decode(it.Encode(name, KEY), name, KEY)
+	assert len(ImageType.decoded) == 10
+
+
+def test_invalid():
+	for token in ('', 'AAAA', '!!', 'AAAAAAAAAAAAAAAA'):
+		with pytest.raises(ValueError):
+			ImageType.Decode(token, 'a.jpg', KEY)
@@ -0,0 +1,64 @@
+from io import BytesIO
+from itertools import product
+
+import pytest
+from PIL import Image
+
+from tru.gfx.thumbs import Operations, DecodePlan, CreateThumb
+
+
+def jpeg(size):
+	buf = BytesIO()
+	Image.new('RGB', size, color=(120, 30, 200)).save(buf, 'JPEG')
+	buf.seek(0)
+	return buf
+
+
+def thumb_size(src, op, shrink_on_load):
+	out = BytesIO()
+	CreateThumb(Image.open(src), out, [op], Operations.SaveToBuf(format='PNG'), shrink_on_load=shrink_on_load)
+	out.seek(0)
+	return Image.open(out).size
+
+
+sizes = [(4000, 3000), (3001, 1999), (1999, 3001), (1023, 767), (641, 480), (100, 100)]
+ops = [
+	Operations.FitWidth(300, 0),
+	Operations.FitWidth(300, 300),
+	Operations.FitAll(160, 160),
+	Operations.FitAll(500, 25),
+	Operations.MaxBox(200, 120),
+	Operations.Force(160, 160),
+	Operations.Manual(160, 192, (18, 18, 131, 59)),
+]
+
+
+def test_scale_keeps_final_size():
+	for (w, h), op in product(sizes, ops):
+		scale = DecodePlan([op]).GetScale(w, h)
+		reduced = ((w + scale - 1) // scale, (h + scale - 1) // scale)
+		assert op.GetFinalSize(*reduced) == op.GetFinalSize(w, h)
+
+
+def test_scale_noop():
+	assert DecodePlan([]).GetScale(4000, 3000) == 1
+	assert DecodePlan([Operations.Color(10)]).GetScale(4000, 3000) == 1
+	assert DecodePlan([Operations.MaxBox(5000, 5000)]).GetScale(4000, 3000) == 1
+	assert DecodePlan([Operations.MaxBox(300, 300)]).GetScale(4000, 3000) == 4
+
+
+def test_jpeg_draft():
+	im = Image.open(jpeg((4000, 3000)))
+	res = DecodePlan([Operations.MaxBox(300, 300)]).Apply(im)
+	assert res is im
+	assert im.size == (1000, 750)
+
+
+@pytest.mark.parametrize("size", sizes)
+def test_same_size_as_full_decode(size):
+	src = jpeg(size)
+	for op in ops:
+		src.seek(0)
+		full = thumb_size(src, op, False)
+		src.seek(0)
+		assert thumb_size(src, op, True) == full
@@ -0,0 +1,113 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from tru.gfx.coder import ImageType
+from tru.gfx.thumbs import CreateThumb, EffortPolicy, EncodeStats, Operations
+
+
+@pytest.fixture
+def stats(monkeypatch):
+	stats = EncodeStats()
+	monkeypatch.setattr(Operations.SaveToBuf, 'stats', stats)
+	return stats
+
+
+def source(size):
+	return Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 64).convert('RGB')
+
+
+def render(it, size):
+	out = BytesIO()
+	CreateThumb(source(size), out, list(it.GetOps()), it.save_to)
+	out.seek(0)
+	return out
+
+
+def test_default_policy():
+	it = ImageType(1, ImageType.FitWidth(2000), 'JPEG')
+	assert 'progressive' not in Image.open(render(it, (200, 150))).info
+	assert Image.open(render(it, (800, 600))).info.get('progressive')
+
+	# the policy does not turn on what is turned off
+	it = ImageType(2, ImageType.FitWidth(2000), 'JPEG', progressive=False)
+	assert 'progressive' not in Image.open(render(it, (800, 600))).info
+
+	policy = EffortPolicy()
+	assert policy.Get('WEBP', 1000) == {'method': 2}
+	assert policy.Get('WEBP', 3000 * 2000) == {'method': 6}
+	assert policy.Get('GIF', 1000) == {}
+
+
+def test_custom_policy():
+	calls = []
+
+	class Policy(EffortPolicy):
+		def Get(self, fmt, pixels):
+			calls.append((fmt, pixels))
+			return super().Get(fmt, pixels)
+
+	hero = Policy({'JPEG': [(None, {})]}, name='hero')
+	it = ImageType(1, ImageType.FitWidth(2000), 'JPEG', policy=hero)
+	assert Image.open(render(it, (200, 150))).info.get('progressive')
+	assert calls == [('JPEG', 200 * 150)]
+	assert hero.rules['WEBP'] == EffortPolicy.RULES['WEBP']
+
+	# kept by the variants
+	assert it.GetVariant('WEBP').save_to.policy is hero
+	assert ImageType(2, ImageType.FitWidth(100)).save_to.policy is Operations.SaveToBuf.policy
+
+
+def test_stats(stats, tmp_path):
+	it = ImageType(7, ImageType.FitWidth(300), 'JPEG')
+	sizes = [len(render(it, (400, 300)).getvalue()) for i in range(2)]
+
+	path = str(tmp_path / 'a.webp')
+	webp = ImageType(8, ImageType.FitWidth(300), 'WEBP', policy=EffortPolicy(name='webp'))
+	CreateThumb(source((400, 300)), path, list(webp.GetOps()), webp.save_to)
+
+	jpeg, webp = stats.GetStats()
+	assert (jpeg['key'], jpeg['policy'], jpeg['format'], jpeg['count']) == (7, 'default', 'JPEG', 2)
+	assert jpeg['bytes'] == sum(sizes)
+	assert jpeg['pixels'] == 2 * 300 * 225
+	assert jpeg['seconds'] > 0 and jpeg['ms_per_mpx'] > 0
+	assert jpeg['bytes_per_px'] == pytest.approx(sum(sizes) / (2 * 300 * 225.0))
+
+	assert (webp['key'], webp['policy'], webp['format'], webp['count']) == (8, 'webp', 'WEBP', 1)
+	assert webp['bytes'] == os.path.getsize(path)
+
+	stats.Clear()
+	assert stats.GetStats() == []
+
+
+class Unseekable:
+	def __init__(self):
+		self.data = b''
+
+	def write(self, data):
+		self.data += data
+
+	def tell(self):
+		raise OSError('Illegal seek')
+
+
+def test_stats_unseekable(stats):
+	im = source((400, 300))
+	out = Unseekable()
+	assert Operations.SaveToBuf(format='JPEG')(None, im, out, im) == 'JPEG'
+	assert Image.open(BytesIO(out.data)).size == (400, 300)
+	assert stats.GetStats() == []
+
+
+def test_stats_merge(stats):
+	it = ImageType(7, ImageType.FitWidth(300), 'JPEG')
+	render(it, (400, 300))
+	items = stats.Drain()
+	assert stats.GetStats() == []
+
+	stats.Merge(items)
+	stats.Merge(items)
+	item, = stats.GetStats()
+	assert (item['count'], item['pixels']) == (2, 2 * 300 * 225)
@@ -0,0 +1,65 @@
+import pytest
+
+from tru.gfx import coder
+from tru.gfx.coder import ImageType
+from tru.io.hash import Hash_crc32
+
+
+KEY = b'secret'
+FILENAMES = ['a.jpg', 'upload/2020/zdjęcie 1.jpg', 'x/' * 50 + 'long name.png', '']
+
+
+@pytest.mark.parametrize('it', [
+	ImageType(1, ImageType.FitWidth(100), 'JPEG'),
+	ImageType(2, ImageType.MaxBox(640, 480), 'WEBP', quality=80, speed='fast', animated=True),
+	ImageType(3, ImageType.FitAll(256, 256), None, optimize=False),
+	ImageType(4, ImageType.Manual(300, 200, (10, 20, 600, 400)), 'PNG'),
+	ImageType(5, ImageType.Original(), 'AVIF'),
+])
+def test_same_as_encode(it):
+	assert it.EncodeMany(FILENAMES, KEY) == [it.Encode(i, KEY) for i in FILENAMES]
+	assert it.EncodeMany(FILENAMES, KEY, speed='balanced', color=10) == [it.Encode(i, KEY, speed='balanced', color=10) for i in FILENAMES]
+	for token, filename in zip(it.EncodeMany(FILENAMES, KEY), FILENAMES):
+		assert ImageType.Decode(token, filename, KEY).Encode(filename, KEY) == token
+
+
+def test_memoized_trx():
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG', quality=90)
+	trx = it.GetTrx()
+	assert it.GetTrx() is trx
+
+	it.color = 20
+	assert it.GetTrx() != trx
+	it.save_to.quality = 70
+	assert it.EncodeMany(['a.jpg'], KEY) == [it.Encode('a.jpg', KEY)]
+	assert ImageType.Decode(it.Encode('a.jpg', KEY), 'a.jpg', KEY).save_to.quality == 70
+
+	clone = it.Clone(ImageType.FitWidth(200))
+	assert clone.Encode('a.jpg', KEY) != it.Encode('a.jpg', KEY)
+	assert ImageType.Decode(clone.Encode('a.jpg', KEY), 'a.jpg', KEY).thumb.get_size()[0] == 200
+
+
+def test_empty():
+	assert ImageType(1, ImageType.FitWidth(100)).EncodeMany([], KEY) == []
+
+
+def test_single():
+	it = ImageType(1, ImageType.FitWidth(100))
+	for filename in FILENAMES:
+		assert it.EncodeMany([filename], KEY) == [it.Encode(filename, KEY)]
+
+
+def test_other_hash(monkeypatch):
+	monkeypatch.setattr(coder, 'Hash', Hash_crc32)
+	with pytest.raises(NotImplementedError):
+		ImageType(1, ImageType.FitWidth(100)).EncodeMany(['a.jpg'], KEY)
+
+
+def test_thumb_changed_in_place():
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	token = it.Encode('a.jpg', KEY)
+
+	it.thumb.w = 300
+	assert it.Encode('a.jpg', KEY) != token
+	assert ImageType.Decode(it.Encode('a.jpg', KEY), 'a.jpg', KEY).thumb.get_size()[0] == 300
+	assert it.EncodeMany(['a.jpg'], KEY) == [it.Encode('a.jpg', KEY)]
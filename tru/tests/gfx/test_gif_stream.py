@@ -0,0 +1,126 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat, GifImagePlugin
+
+from tru.gfx.thumbs import CreateThumb, FrameLimits, GifStreamWriter, Operations, ThumbError, Transform
+
+
+def animation(count=10, size=(200, 150), transparent=False):
+	frames = []
+	for i in range(count):
+		im = Image.new('RGBA' if transparent else 'RGB', size, (0, 0, 0, 0) if transparent else (20, 50, 100))
+		ImageDraw.Draw(im).rectangle((i * 10, 20, i * 10 + 30, 60), fill=(255, 255, 0))
+		frames.append(im)
+	buf = BytesIO()
+	frames[0].save(buf, 'GIF', save_all=True, append_images=frames[1:], duration=80, loop=0, disposal=2 if transparent else 0)
+	buf.seek(0)
+	return buf
+
+
+def open_gif(buf):
+	# tru.gfx.pil_fixes replaces the GIF plugin, use the original one for reading
+	buf.seek(0)
+	return GifImagePlugin.GifImageFile(buf)
+
+
+def render(src, ops, **kwargs):
+	out = BytesIO()
+	CreateThumb(open_gif(src), out, ops, Operations.SaveToBuf(format='GIF'), **kwargs)
+	return open_gif(out)
+
+
+def test_frames_are_identical():
+	src = animation()
+	res = render(src, [Operations.FitWidth(100, 0)])
+	assert res.n_frames == 10
+	assert res.info['loop'] == 0
+
+	org = open_gif(src)
+	for i in range(10):
+		org.seek(i)
+		res.seek(i)
+		expected = org.convert('RGB').resize((100, 75), Image.ANTIALIAS)
+		assert res.info['duration'] == 80
+		# quantized to the palette the same way as by Image.save(save_all=True)
+		diff = ImageChops.difference(expected, res.convert('RGB'))
+		assert max(ImageStat.Stat(diff).mean) < 2
+		assert max(hi for lo, hi in diff.getextrema()) <= 20
+
+
+def test_transparency():
+	res = render(animation(5, transparent=True), [Operations.FitWidth(100, 0)])
+	assert res.n_frames == 5
+	for i in range(5):
+		res.seek(i)
+		alpha = res.convert('RGBA').getchannel('A')
+		assert alpha.getpixel((0, 0)) == 0
+		assert alpha.getpixel((i * 5 + 7, 20)) == 255
+
+
+def test_limits():
+	assert render(animation(), [], limits=FrameLimits(max_frames=3)).n_frames == 3
+	assert render(animation(), [], limits=FrameLimits(max_pixels=200 * 150 * 4)).n_frames == 4
+
+	with pytest.raises(ThumbError):
+		render(animation(), [], limits=FrameLimits(max_frames=3, truncate=False))
+
+
+def test_lazy_frames():
+	calls = []
+
+	def op(im):
+		calls.append(im.size)
+		return im
+
+	frames = Transform(open_gif(animation()), [op])
+	assert calls == []
+
+	out = BytesIO()
+	Operations.SaveToBuf(format='PNG')(None, open_gif(animation()), out, frames)
+	assert len(calls) == 1
+
+
+def test_same_as_save_all():
+	frames = list(Transform(open_gif(open('tests/gfx/img/giphy.gif', 'rb')), [Operations.FitWidth(200, 0)]))
+	durations = [frame.info.get('duration') or 50 for frame in frames]
+
+	expected = BytesIO()
+	frames[0].save(expected, 'GIF', save_all=True, append_images=frames[1:], optimize=True, loop=0, duration=durations)
+
+	out = BytesIO()
+	writer = GifStreamWriter(out, loop=0, optimize=True)
+	for frame, duration in zip(frames, durations):
+		writer.Write(frame, duration)
+	writer.Close()
+	assert out.getvalue() == expected.getvalue()
+
+
+def test_long_durations():
+	frame = Image.new('RGBA', (20, 20), (10, 20, 30, 255))
+	out = BytesIO()
+	writer = GifStreamWriter(out)
+	writer.Write(frame, 400000)
+	writer.Write(frame.copy(), 400000)  # identical, but the delays cannot be merged
+	writer.Write(frame.copy(), 10000000)
+	writer.Close()
+
+	res = open_gif(out)
+	durations = []
+	for i in range(res.n_frames):
+		res.seek(i)
+		durations.append(res.info['duration'])
+	assert durations == [400000, 400000, GifStreamWriter.MAX_DURATION]
+
+
+def test_other_pillow(monkeypatch):
+	def save():
+		out = BytesIO()
+		CreateThumb(open_gif(open('tests/gfx/img/giphy.gif', 'rb')), out, [Operations.FitWidth(200, 0)], Operations.SaveToBuf(format='GIF'))
+		return out.getvalue()
+
+	streamed = save()
+	# PIL's internals used by GifStreamWriter are not checked for other versions, save_all is used then
+	monkeypatch.setattr(GifStreamWriter, 'SUPPORTED', False)
+	monkeypatch.setattr(GifStreamWriter, 'Write', None)
+	assert save() == streamed
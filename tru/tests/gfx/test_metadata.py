@@ -0,0 +1,103 @@
+from io import BytesIO
+from struct import pack
+
+from PIL import Image
+
+from tru.gfx.thumbs import CreateThumb, CreateThumbs, GetMetadataSegments, Operations
+from tru.gfx.coder import ImageType
+
+
+XMP = b'http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta xmlns:x="adobe:ns:meta/"><dc:creator>Author</dc:creator></x:xmpmeta>'
+
+
+def iptc(caption):
+	record = b'\x1c\x02\x78' + pack('>H', len(caption)) + caption  # 2:120 Caption
+	resource = b'8BIM\x04\x04\x00\x00' + pack('>I', len(record)) + record
+	return b'Photoshop 3.0\x00' + resource
+
+
+def source(caption=b'A caption'):
+	exif = Image.Exif()
+	exif[0x013B] = 'Photographer'  # Artist
+	xmp = pack('>BBH', 0xFF, 0xE1, len(XMP) + 2) + XMP
+	app13 = iptc(caption)
+	app13 = pack('>BBH', 0xFF, 0xED, len(app13) + 2) + app13
+
+	buf = BytesIO()
+	Image.new('RGB', (400, 300), (120, 60, 30)).save(buf, 'JPEG', exif=exif.tobytes(), extra=xmp + app13)
+	buf.seek(0)
+	return buf
+
+
+def segments(im):
+	return [(name, data) for name, data in im.applist if name in ('APP1', 'APP13')]
+
+
+def render(src, save):
+	out = BytesIO()
+	CreateThumb(Image.open(src), out, [Operations.FitWidth(100, 0)], save)
+	out.seek(0)
+	return Image.open(out)
+
+
+def test_round_trip():
+	org = Image.open(source())
+	res = render(source(), Operations.SaveToBuf(format='JPEG', metadata=True))
+
+	assert res.size == (100, 75)
+	# IPTC only
+	assert segments(res) == [('APP13', iptc(b'A caption'))] == segments(org)[2:]
+	assert 0x013B not in res.getexif()
+	assert res.applist[0][0] == 'APP0'  # JFIF stays the first one
+	res.load()
+
+
+def test_xmp():
+	save = Operations.SaveToBuf(format='JPEG', metadata=True)
+	save.METADATA_SEGMENTS = ('APP13', 'XMP')
+	res = render(source(), save)
+	assert segments(res) == [('APP1', XMP), ('APP13', iptc(b'A caption'))]
+
+	# Exif is never copied
+	save.METADATA_SEGMENTS = ('APP1', 'APP13', 'XMP')
+	assert 0x013B not in render(source(), save).getexif()
+
+
+def test_without_metadata():
+	res = render(source(), Operations.SaveToBuf(format='JPEG'))
+	assert segments(res) == []
+
+
+def test_only_to_jpeg():
+	res = render(source(), Operations.SaveToBuf(format='PNG', metadata=True))
+	assert res.format == 'PNG'
+
+	src = BytesIO()
+	Image.new('RGB', (400, 300)).save(src, 'PNG')
+	src.seek(0)
+	assert segments(render(src, Operations.SaveToBuf(format='JPEG', metadata=True))) == []
+
+
+def test_segments_bytes():
+	data = source().getvalue()
+	raw = GetMetadataSegments(Image.open(source()), ('APP13', 'XMP'))
+	# the same bytes as in the source file, without Exif
+	copied = segments(Image.open(source()))[1:]
+	assert len(raw) == sum(len(payload) + 4 for name, payload in copied)
+	for name, payload in copied:
+		assert pack('>H', len(payload) + 2) + payload in raw
+		assert pack('>H', len(payload) + 2) + payload in data
+	assert GetMetadataSegments(Image.open(source())).startswith(b'\xff\xed')
+	assert GetMetadataSegments(Image.new('RGB', (1, 1))) == b''
+
+
+def test_many_thumbs(tmp_path):
+	src = tmp_path / 'src.jpg'
+	src.write_bytes(source(b'Many').getvalue())
+
+	types = [ImageType(1, ImageType.FitWidth(200), 'JPEG', metadata=True), ImageType(2, ImageType.FitWidth(100), 'JPEG')]
+	CreateThumbs(str(src), [(str(tmp_path / '{}.jpg'.format(it.id)), it) for it in types])
+
+	org = Image.open(str(src))
+	assert segments(Image.open(str(tmp_path / '1.jpg'))) == segments(org)[2:]
+	assert segments(Image.open(str(tmp_path / '2.jpg'))) == []
@@ -95,3 +95,21 @@ def test_RotateImage_img():
 
 
 
+
+def test_Watermark_cache():
+	img = Image.open("tests/gfx/op/linux.png")
+	watermark = Image.open("tests/gfx/op/watermark.png")
+	Operations.Watermark.cache.Clear()
+
+	op = Operations.Watermark(watermark, frame=watermark)
+	res = op(img)
+	assert len(Operations.Watermark.cache) == 1
+	res2 = Operations.Watermark(watermark, frame=watermark)(img)
+	assert len(Operations.Watermark.cache) == 1
+	assert ImageChops.difference(res, res2).getbbox() is None
+	assert ImageChops.difference(res, Operations.Watermark(watermark.copy(), frame=watermark.copy())(img)).getbbox() is None
+
+	assert len(Operations.Watermark.cache) == 2
+
+	Operations.Watermark(watermark)(img.resize((100, 100)))
+	assert len(Operations.Watermark.cache) == 3
@@ -0,0 +1,125 @@
+import time
+import threading
+
+from tru.gfx.optimizer import OptimizerQueue, main
+from tru.gfx.thumbs import CreateThumb
+from tru.gfx.coder import ImageType
+
+
+def touch(path, data=b'0123456789'):
+	with open(path, 'wb') as f:
+		f.write(data)
+	return str(path)
+
+
+class FakeOptimizer:
+
+	def __init__(self, delay=0):
+		self.delay = delay
+		self.calls = []
+		self.running = {}
+		self.max_running = {}
+		self.lock = threading.Lock()
+
+	def __call__(self, path, params):
+		tool = OptimizerQueue.GetTool(path)
+		with self.lock:
+			self.calls.append((path, params))
+			self.running[tool] = self.running.get(tool, 0) + 1
+			self.max_running[tool] = max(self.max_running.get(tool, 0), self.running[tool])
+		time.sleep(self.delay)
+		with open(path, 'wb') as f:
+			f.write(b'01234')
+		with self.lock:
+			self.running[tool] -= 1
+		return (10, 5)
+
+
+def test_dedup_and_skip_optimized(tmp_path):
+	opt = FakeOptimizer()
+	queue = OptimizerQueue(str(tmp_path / 'q.sqlite'), optimize=opt)
+	img = touch(tmp_path / 'a.png')
+
+	assert queue.Enqueue(img, {'quality': 80})
+	assert not queue.Enqueue(img)
+	assert not queue.Enqueue(touch(tmp_path / 'a.txt'))
+	assert queue.Drain() == 1
+	assert opt.calls == [(img, {'quality': 80})]
+
+	# already optimized
+	assert queue.IsOptimized(img)
+	assert not queue.Enqueue(img)
+
+	# changed file
+	touch(img, b'changed content')
+	assert queue.Enqueue(img)
+	assert queue.Drain() == 1
+	assert len(opt.calls) == 2
+
+	stats = queue.GetStats()
+	assert stats['queued'] == 0
+	assert stats['done'] == [{'tool': 'pngquant', 'result': 'ok', 'count': 1, 'org_size': 10, 'opt_size': 5}]
+
+
+def test_concurrency(tmp_path):
+	opt = FakeOptimizer(delay=0.1)
+	queue = OptimizerQueue(str(tmp_path / 'q.sqlite'), concurrency={'pngquant': 2, 'jpegoptim': 1}, optimize=opt)
+	for i in range(6):
+		queue.Enqueue(touch(tmp_path / '{}.png'.format(i)))
+		queue.Enqueue(touch(tmp_path / '{}.jpg'.format(i)))
+
+	assert queue.Drain(max_jobs=8) == 8
+	assert queue.Drain() == 4
+	assert opt.max_running == {'pngquant': 2, 'jpegoptim': 1}
+
+
+def test_persistent(tmp_path):
+	db = str(tmp_path / 'q.sqlite')
+	OptimizerQueue(db).Enqueue(touch(tmp_path / 'a.gif'))
+
+	opt = FakeOptimizer()
+	assert OptimizerQueue(db, optimize=opt).Drain() == 1
+	assert len(opt.calls) == 1
+
+
+def test_errors(tmp_path):
+	def broken(path, params):
+		raise ValueError("no pngquant")
+
+	queue = OptimizerQueue(str(tmp_path / 'q.sqlite'), optimize=broken)
+	queue.Enqueue(touch(tmp_path / 'a.png'))
+	assert queue.Drain() == 1
+	assert queue.GetStats()['done'][0]['result'] == 'error: no pngquant'
+
+
+def test_relative_path(tmp_path, monkeypatch):
+	queue = OptimizerQueue(str(tmp_path / 'q.sqlite'), optimize=FakeOptimizer())
+	img = touch(tmp_path / 'a.png')
+	monkeypatch.chdir(str(tmp_path))
+
+	assert queue.Enqueue('a.png')
+	assert not queue.Enqueue(img)
+	assert not queue.Enqueue('./a.png')
+	assert queue.db.execute("SELECT path FROM jobs").fetchall() == [(img, )]
+
+
+def test_on_new_image(tmp_path):
+	queue = OptimizerQueue(str(tmp_path / 'q.sqlite'), optimize=FakeOptimizer())
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG', quality=70)
+
+	CreateThumb.OnNewImage.append(queue.OnNewImage)
+	try:
+		CreateThumb('tests/gfx/op/linux.png', str(tmp_path / 'thumb.png'), it.GetOps(), it.save_to)
+	finally:
+		CreateThumb.OnNewImage.remove(queue.OnNewImage)
+
+	assert queue.GetStats()['queued'] == 1
+	assert queue.db.execute("SELECT path, params FROM jobs").fetchall() == [(str(tmp_path / 'thumb.png'), '{"quality": 70}')]
+
+
+def test_cli(tmp_path, capsys):
+	db = str(tmp_path / 'q.sqlite')
+	main(['--db', db, 'enqueue', touch(tmp_path / 'a.png'), touch(tmp_path / 'b.png')])
+	assert 'Queued: 2' in capsys.readouterr().out
+	main(['--db', db, 'stats'])
+	assert '"queued": 2' in capsys.readouterr().out
@@ -0,0 +1,70 @@
+from itertools import product
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from tru.gfx.thumbs import FuseOps, Operations
+
+# max difference of a channel value between the fused and the chained operations
+tolerance = 2
+# max mean difference of channels when the operations are moved after the resize
+# (clipping does not commute with resampling, so single pixels on sharp edges may differ more)
+reorder_tolerance = 4
+
+values = [-100, -50, -10, 0, 25, 80]
+
+
+def source(mode):
+	img = Image.open("tests/gfx/op/linux.png").convert('RGBA')
+	if mode == 'RGB':
+		bg = Image.new('RGBA', img.size, (200, 120, 40, 255))
+		img = Image.alpha_composite(bg, img).convert('RGB')
+	return img
+
+
+def chain(img, ops):
+	for op in ops:
+		img = op(img)
+	return img
+
+
+def max_diff(a, b):
+	return max(ImageChops.difference(a, b).getextrema(), key=lambda e: e[1])[1]
+
+
+@pytest.mark.parametrize("mode", ['RGB', 'RGBA'])
+def test_fused_within_tolerance(mode):
+	img = source(mode)
+	for contrast, brightness in product(values, values):
+		for ops in ([Operations.Contrast(contrast), Operations.Brightness(brightness)], [Operations.Brightness(brightness), Operations.Contrast(contrast)]):
+			fused = FuseOps(ops)
+			assert len(fused) == 1
+			assert max_diff(chain(img, ops), chain(img, fused)) <= tolerance, (mode, contrast, brightness)
+
+
+def test_alpha_untouched():
+	img = source('RGBA')
+	res = Operations.PointOps([Operations.Brightness(-100)])(img)
+	assert res.getchannel('A').tobytes() == img.getchannel('A').tobytes()
+
+
+def test_reorder():
+	fit = Operations.FitWidth(100, 0)
+	mark = Operations.Watermark(Image.new('RGBA', (10, 10)))
+	color, contrast, brightness = Operations.Color(10), Operations.Contrast(20), Operations.Brightness(30)
+
+	ops = FuseOps([contrast, brightness, fit, color, mark])
+	assert ops[0] is fit
+	assert isinstance(ops[1], Operations.PointOps) and ops[1].ops == [contrast, brightness]
+	assert ops[2:] == [color, mark]
+
+	ops = FuseOps([fit, contrast, color, brightness, mark, contrast])
+	assert [type(i) for i in ops] == [Operations.FitWidth, Operations.PointOps, Operations.Color, Operations.PointOps, Operations.Watermark, Operations.PointOps]
+
+
+def test_reordered_within_tolerance():
+	img = source('RGB')
+	for contrast, brightness in [(40, -20), (80, 25), (-50, -50)]:
+		ops = [Operations.Contrast(contrast), Operations.Brightness(brightness), Operations.FitWidth(100, 0)]
+		diff = ImageChops.difference(chain(img, ops), chain(img, FuseOps(ops)))
+		assert max(ImageStat.Stat(diff).mean) <= reorder_tolerance
@@ -0,0 +1,167 @@
+import os
+import time
+
+from PIL import Image
+
+from tru.gfx.coder import ImageType
+from tru.gfx.pregen import Pregenerator, FindSources, GetImageTypes, main, DONE
+
+
+IMAGE_TYPES = [
+	ImageType(1, ImageType.FitWidth(100), 'PNG'),
+	ImageType(2, ImageType.FitAll(50, 50), 'JPEG'),
+	ImageType(3, ImageType.Original()),
+]
+
+
+def make_tree(root, n=4):
+	sources = []
+	for i in range(n):
+		d = root / 'uploads' / str(i % 2)
+		d.mkdir(parents=True, exist_ok=True)
+		path = str(d / 'img{}.png'.format(i))
+		Image.new('RGB', (300, 200), (i * 40, 100, 50)).save(path)
+		sources.append(path)
+	return sources
+
+
+def quiet(*args):
+	pass
+
+
+def test_find_sources(tmp_path):
+	sources = make_tree(tmp_path)
+	types = GetImageTypes(IMAGE_TYPES)
+	assert [it.id for it in types] == [1, 2]
+
+	# existing thumbnails are not sources
+	Image.new('RGB', (10, 10)).save(types[0].get_path(sources[0]))
+	assert sorted(FindSources(str(tmp_path), types)) == sorted(sources)
+
+	# references of the content-addressed uploads
+	os.symlink(sources[0], str(tmp_path / 'uploads' / 'link.png'))
+	assert sorted(FindSources(str(tmp_path), types)) == sorted(sources)
+
+
+def test_scan_and_run(tmp_path):
+	sources = make_tree(tmp_path)
+	types = GetImageTypes(IMAGE_TYPES)
+	pregen = Pregenerator(str(tmp_path / 'manifest.sqlite'), types)
+
+	assert pregen.Scan(str(tmp_path / 'uploads')) == 8
+	assert pregen.Scan(str(tmp_path / 'uploads')) == 0
+
+	stats = pregen.Run(processes=2, progress=quiet)
+	assert stats == {'pending': 0, 'done': 8, 'fresh': 0, 'failed': 0}
+
+	for src in sources:
+		assert Image.open(types[0].get_path(src)).width == 100
+		assert Image.open(types[1].get_path(src)).size == (50, 50)
+
+	# nothing to do
+	assert pregen.Run(processes=1, progress=quiet)['done'] == 8
+
+
+def test_resume_and_skip_fresh(tmp_path):
+	sources = make_tree(tmp_path)
+	types = GetImageTypes(IMAGE_TYPES)
+	pregen = Pregenerator(str(tmp_path / 'manifest.sqlite'), types)
+	pregen.Scan(str(tmp_path / 'uploads'))
+
+	# an interrupted run: the first source finished
+	first = [types[0].get_path(sources[0]), types[1].get_path(sources[0])]
+	with pregen.db as db:
+		db.executemany("UPDATE work SET status = ? WHERE thumb = ?", [(DONE, i) for i in first])
+
+	# a fresh thumbnail
+	fresh = types[0].get_path(sources[1])
+	Image.new('RGB', (7, 7)).save(fresh)
+	future = time.time() + 100
+	os.utime(fresh, (future, future))
+
+	calls = []
+	stats = pregen.Run(processes=1, progress=lambda *args: calls.append(args))
+	assert stats == {'pending': 0, 'done': 7, 'fresh': 1, 'failed': 0}
+	assert calls[-1][:2] == (3, 3)
+
+	assert not any(os.path.exists(i) for i in first)
+	assert Image.open(fresh).size == (7, 7)
+
+
+def test_failed_and_retry(tmp_path):
+	sources = make_tree(tmp_path, 2)
+	with open(sources[1], 'wb') as f:
+		f.write(b'broken')
+
+	types = GetImageTypes(IMAGE_TYPES)
+	pregen = Pregenerator(str(tmp_path / 'manifest.sqlite'), types)
+	pregen.Scan(str(tmp_path / 'uploads'))
+
+	assert pregen.Run(processes=1, progress=quiet) == {'pending': 0, 'done': 2, 'fresh': 0, 'failed': 2}
+
+	Image.new('RGB', (300, 200)).save(sources[1], 'PNG')
+	assert pregen.Retry() == 2
+	assert pregen.Run(processes=1, progress=quiet)['done'] == 4
+
+
+def test_cli(tmp_path, capsys):
+	sources = make_tree(tmp_path, 2)
+	args = ['--manifest', str(tmp_path / 'manifest.sqlite'), '--types', 'test_pregen:IMAGE_TYPES', '--only', '1', '--root', str(tmp_path / 'uploads'), '--processes', '1']
+	assert main(args + ['scan', 'run']) == 0
+	assert 'Added: 2' in capsys.readouterr().out
+	assert os.path.isfile(IMAGE_TYPES[0].get_path(sources[0]))
+	assert not os.path.isfile(IMAGE_TYPES[1].get_path(sources[0]))
+
+	# the thumbnails of the first type are not the sources of the second one
+	args[args.index('--only') + 1] = '2'
+	assert main(args + ['scan', 'run']) == 0
+	assert 'Added: 2' in capsys.readouterr().out
+	assert os.path.isfile(IMAGE_TYPES[1].get_path(sources[0]))
+	assert not os.path.exists(IMAGE_TYPES[1].get_path(IMAGE_TYPES[0].get_path(sources[0])))
+
+
+def test_thumbs_of_other_types(tmp_path):
+	sources = make_tree(tmp_path, 2)
+	types = GetImageTypes(IMAGE_TYPES)
+	for src in sources:
+		Image.new('RGB', (10, 10)).save(types[0].get_path(src))
+
+	# only the second type is rendered, the thumbnails of the first one are not sources
+	pregen = Pregenerator(str(tmp_path / 'manifest.sqlite'), types[1:], known_types=types)
+	assert pregen.Scan(str(tmp_path / 'uploads')) == 2
+	pregen.Run(processes=1, progress=quiet)
+	assert not any(os.path.exists(types[1].get_path(types[0].get_path(src))) for src in sources)
+
+
+def test_batches(tmp_path):
+	sources = make_tree(tmp_path, 5)
+	pregen = Pregenerator(str(tmp_path / 'manifest.sqlite'), GetImageTypes(IMAGE_TYPES))
+	pregen.BATCH = 3
+	pregen.Scan(str(tmp_path / 'uploads'))
+
+	items = list(pregen._PendingSources())
+	assert sorted(source for source, jobs, stale in items) == sorted(sources)
+	assert all(len(jobs) == 2 for source, jobs, stale in items)
+	assert pregen.Run(processes=1, progress=quiet)['done'] == 10
+
+
+def test_changed_type(tmp_path):
+	sources = make_tree(tmp_path, 2)
+	manifest = str(tmp_path / 'manifest.sqlite')
+	types = [ImageType(1, ImageType.FitWidth(100), 'JPEG', quality=90), ImageType(2, ImageType.FitWidth(50), 'JPEG')]
+	pregen = Pregenerator(manifest, types)
+	pregen.Scan(str(tmp_path / 'uploads'))
+	assert pregen.Run(processes=1, progress=quiet)['done'] == 4
+
+	# the same definitions: nothing to do
+	assert Pregenerator(manifest, types).GetStats()['pending'] == 0
+
+	changed = [ImageType(1, ImageType.FitWidth(120), 'JPEG', quality=90), types[1]]
+	pregen = Pregenerator(manifest, changed)
+	assert pregen.GetStats() == {'pending': 2, 'done': 2, 'fresh': 0, 'failed': 0}
+	assert pregen.Run(processes=1, progress=quiet) == {'pending': 0, 'done': 4, 'fresh': 0, 'failed': 0}
+	assert all(Image.open(changed[0].get_path(src)).width == 120 for src in sources)
+
+	# the quality only
+	pregen = Pregenerator(manifest, [ImageType(1, ImageType.FitWidth(120), 'JPEG', quality=60), types[1]])
+	assert pregen.GetStats()['pending'] == 2
@@ -0,0 +1,108 @@
+import os
+import glob
+from io import BytesIO
+
+import pytest
+from PIL import Image, features
+
+from tru.gfx.probe import ProbeImage, ProbeImageSize, SizeIndex
+
+
+class CountingFile:
+
+	def __init__(self, data):
+		self.f = BytesIO(data)
+		self.read_bytes = 0
+
+	def read(self, n=-1):
+		data = self.f.read(n)
+		self.read_bytes += len(data)
+		return data
+
+	def seek(self, *args):
+		return self.f.seek(*args)
+
+
+def encode(im, fmt, **kwargs):
+	buf = BytesIO()
+	im.save(buf, fmt, **kwargs)
+	return buf.getvalue()
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob('tests/gfx/img/*.*') + glob.glob('tests/gfx/op/*.png')))
+def test_same_as_pil(path):
+	with Image.open(path) as im:
+		if im.format in ('JPEG', 'PNG', 'GIF', 'WEBP'):
+			assert ProbeImageSize(path) == im.size
+		else:
+			assert ProbeImageSize(path) is None
+
+
+@pytest.mark.parametrize("mode,fmt,kwargs", [
+	('RGB', 'JPEG', {}),
+	('L', 'JPEG', {}),
+	('CMYK', 'JPEG', {}),
+	('RGB', 'JPEG', {'progressive': True}),
+	('RGB', 'PNG', {}),
+	('RGBA', 'PNG', {}),
+	('P', 'PNG', {}),
+	('L', 'PNG', {}),
+	('P', 'GIF', {}),
+	('RGB', 'WEBP', {}),
+	('RGBA', 'WEBP', {}),
+	('RGB', 'WEBP', {'lossless': True}),
+	('RGBA', 'WEBP', {'lossless': True}),
+])
+def test_formats(mode, fmt, kwargs):
+	if fmt == 'WEBP' and not features.check('webp'):
+		pytest.skip("no WEBP support")
+
+	data = encode(Image.new(mode, (1234, 567)), fmt, **kwargs)
+	meta = ProbeImage(BytesIO(data))
+	im = Image.open(BytesIO(data))
+	# PIL opens GIFs with grayscale palettes as "L"
+	assert meta == {'format': im.format, 'width': 1234, 'height': 567, 'mode': im.mode if fmt != 'GIF' else 'P'}
+
+
+def test_jpeg_reads_only_headers():
+	exif = Image.Exif()
+	exif[0x010e] = 'x' * 60000  # ImageDescription
+	data = encode(Image.new('RGB', (640, 480)), 'JPEG', exif=exif.tobytes())
+	f = CountingFile(data)
+	assert ProbeImageSize(f) == (640, 480)
+	assert f.read_bytes < 4096
+
+
+def test_broken():
+	assert ProbeImage(BytesIO(b'')) is None
+	assert ProbeImage(BytesIO(b'\xff\xd8\xff\xe0\x00')) is None
+	assert ProbeImage(BytesIO(b'not an image')) is None
+	assert ProbeImage('/no/such/file.jpg') is None
+
+
+def test_index(tmp_path):
+	path = str(tmp_path / 'a.png')
+	Image.new('RGB', (30, 20)).save(path)
+
+	db = str(tmp_path / 'sizes.sqlite')
+	index = SizeIndex(db_path=db)
+	assert index.Get(path) == (30, 20)
+	assert index.Get(path) == (30, 20)
+	assert index.cache.hits == 1
+
+	# shared by other processes
+	assert SizeIndex(db_path=db, fallback=lambda path: 1 / 0).Get(path) == (30, 20)
+
+	# file changed
+	Image.new('RGB', (300, 200)).save(path)
+	os.utime(path, ns=(1, 1))
+	assert index.Get(path) == (300, 200)
+
+	assert index.Get(str(tmp_path / 'missing.png')) is None
+
+
+def test_index_fallback(tmp_path):
+	path = str(tmp_path / 'a.tif')
+	Image.new('RGB', (30, 20)).save(path)
+	assert SizeIndex().Get(path) is None
+	assert SizeIndex(fallback=lambda path: Image.open(path).size).Get(path) == (30, 20)
@@ -0,0 +1,102 @@
+import os
+import time
+import signal
+
+import pytest
+from PIL import Image
+
+from tru.gfx.coder import ImageType
+from tru.gfx.pool import RenderPool, RenderQueueFull, RenderTimeout, RenderWorkerLost
+from tru.gfx.thumbs import EncodeStats, Operations, ThumbError
+
+
+def worker_pid(*args):
+	return os.getpid()
+
+
+def kill_worker():
+	os.kill(os.getpid(), signal.SIGKILL)  # as the OOM killer does
+
+
+def test_submit(tmp_path):
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG')
+	with RenderPool(processes=2) as pool:
+		futures = [pool.submit(it, 'tests/gfx/op/linux.png', str(tmp_path / '{}.png'.format(i))) for i in range(4)]
+		for i, f in enumerate(futures):
+			assert f.result(timeout=30) == str(tmp_path / '{}.png'.format(i))
+			assert Image.open(f.result()).width == 100
+
+
+def test_invalid_source(tmp_path):
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG')
+	with RenderPool(processes=1) as pool:
+		f = pool.submit(it, str(tmp_path / 'missing.png'), str(tmp_path / 'out.png'))
+		with pytest.raises(ThumbError):
+			f.result(timeout=30)
+
+
+def test_queue_full():
+	with RenderPool(processes=1, max_queue=2) as pool:
+		pool.Apply(time.sleep, 0.5)
+		pool.Apply(time.sleep, 0.5)
+		with pytest.raises(RenderQueueFull):
+			pool.Apply(time.sleep, 0.5)
+
+
+def test_timeout():
+	with RenderPool(processes=1, timeout=0.2) as pool:
+		f = pool.Apply(time.sleep, 5)
+		with pytest.raises(RenderTimeout):
+			f.result(timeout=30)
+		assert pool.pending == 0
+
+
+def test_workers_recycled():
+	with RenderPool(processes=1, max_jobs=2) as pool:
+		pids = [pool.Apply(worker_pid).result(timeout=30) for i in range(6)]
+	assert len(set(pids)) == 3
+
+
+def slow_thumb(src, dst):
+	from tru.gfx import thumbs
+
+	class Slow(thumbs.Operations.Transform):
+		def Exec(self, im):
+			time.sleep(5)
+			return im
+
+	return thumbs.CreateThumb(src, dst, [Slow()], thumbs.Operations.SaveToBuf(format='PNG'))
+
+
+def test_render_timeout(tmp_path):
+	with RenderPool(processes=1, timeout=0.3) as pool:
+		f = pool.Apply(slow_thumb, 'tests/gfx/op/linux.png', str(tmp_path / 'out.png'))
+		with pytest.raises(RenderTimeout):
+			f.result(timeout=30)
+
+
+def test_worker_lost():
+	with RenderPool(processes=1) as pool:
+		f = pool.Apply(kill_worker)
+		with pytest.raises(RenderWorkerLost):
+			f.result(timeout=30)
+		assert pool.pending == 0
+		assert pool.Apply(worker_pid).result(timeout=30) != os.getpid()
+
+
+def test_stats(tmp_path, monkeypatch):
+	stats = EncodeStats()
+	stats.Record('parent', 'default', 'PNG', 1, 0.0, 1)
+	monkeypatch.setattr(Operations.SaveToBuf, 'stats', stats)
+
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG')
+	with RenderPool(processes=2) as pool:
+		for f in [pool.submit(it, 'tests/gfx/op/linux.png', str(tmp_path / '{}.png'.format(i))) for i in range(3)]:
+			f.result(timeout=30)
+
+	# sent back by the workers (without the copies of the parent's stats)
+	items = {i['key']: i for i in stats.GetStats()}
+	assert items['parent']['count'] == 1
+	item = items[1]
+	assert (item['format'], item['count']) == ('PNG', 3)
+	assert item['bytes'] == sum(os.path.getsize(str(tmp_path / '{}.png'.format(i))) for i in range(3))
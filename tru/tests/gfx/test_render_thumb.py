@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from tru.gfx.thumbs import Operations, CreateThumb, RenderThumb, ThumbError
+
+
+tmp_dir = 'tests/gfx/tmp/render'
+src_path = os.path.join(tmp_dir, 'source.jpg')
+
+
+def setup_module():
+	os.makedirs(tmp_dir, exist_ok=True)
+	Image.linear_gradient('L').resize((640, 480)).convert('RGB').save(src_path, 'JPEG')
+
+
+def test_render_in_memory():
+	data, fmt = RenderThumb(src_path, [Operations.MaxBox(200, 200)], Operations.SaveToBuf(format='PNG'))
+	assert isinstance(data, memoryview)
+	assert fmt == 'PNG'
+
+	out = BytesIO()
+	CreateThumb(src_path, out, [Operations.MaxBox(200, 200)], Operations.SaveToBuf(format='PNG'))
+	assert bytes(data) == out.getvalue()
+
+
+def test_format_of_source():
+	data, fmt = RenderThumb(src_path, [Operations.FitWidth(100, 0)], Operations.SaveToBuf())
+	assert fmt == 'JPEG'
+	assert Image.open(BytesIO(data)).format == 'JPEG'
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_write_back(background):
+	thumb_path = os.path.join(tmp_dir, 'write_back_{}.jpg'.format(background))
+	if os.path.exists(thumb_path):
+		os.remove(thumb_path)
+
+	notified = []
+
+	def callback(thumb_path, image_path, fmt, params):
+		notified.append((thumb_path, fmt))
+
+	executor = RenderThumb.executor
+	RenderThumb.executor = ThreadPoolExecutor(max_workers=1)
+	CreateThumb.OnNewImage.append(callback)
+	try:
+		data, fmt = RenderThumb(src_path, [Operations.FitWidth(100, 0)], Operations.SaveToBuf(format='JPEG'), thumb_path=thumb_path, background=background)
+		RenderThumb.executor.shutdown(wait=True)
+	finally:
+		CreateThumb.OnNewImage.remove(callback)
+		RenderThumb.executor = executor
+
+	with open(thumb_path, 'rb') as f:
+		assert f.read() == bytes(data)
+	assert notified == [(thumb_path, 'JPEG')]
+
+
+def test_write_back_without_notify():
+	notified = []
+	CreateThumb.OnNewImage.append(lambda *args: notified.append(args))
+	try:
+		RenderThumb(src_path, [Operations.FitWidth(100, 0)], Operations.SaveToBuf(format='JPEG'), thumb_path=os.path.join(tmp_dir, 'silent.jpg'), notify=False)
+	finally:
+		CreateThumb.OnNewImage.pop()
+	assert notified == []
+
+
+def test_error():
+	with pytest.raises(ThumbError):
+		RenderThumb('tests/gfx/img/missing.jpg', [], Operations.SaveToBuf())
@@ -0,0 +1,85 @@
+import copy
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from tru.gfx.coder import ImageType
+from tru.gfx.thumbs import Operations, CreateThumb
+
+
+KEY = b'secret'
+
+
+def gradient(size):
+	return Image.linear_gradient('L').resize(size).convert('RGB')
+
+
+def render(op, speed, src):
+	op = copy.copy(op)
+	op.speed = speed
+	return op(src)
+
+
+ops = [
+	Operations.FitWidth(300, 0),
+	Operations.FitWidth(300, 300),
+	Operations.FitAll(160, 160),
+	Operations.MaxBox(200, 120),
+	Operations.Force(160, 160),
+	Operations.Manual(160, 192, (18, 18, 131, 59)),
+]
+
+
+@pytest.mark.parametrize('op', ops)
+def test_speeds_same_size(op):
+	src = gradient((2400, 1800))
+	best = render(op, 'best', src)
+	for speed in ('balanced', 'fast'):
+		res = render(op, speed, src)
+		assert res.size == best.size == op.GetFinalSize(*src.size)
+		diff = ImageStat.Stat(ImageChops.difference(res, best)).mean
+		assert max(diff) < 3
+
+
+def test_best_is_unchanged():
+	src = gradient((1200, 900))
+	assert ImageChops.difference(render(Operations.MaxBox(200, 200), 'best', src), src.resize((200, 150), Image.ANTIALIAS)).getbbox() is None
+
+
+@pytest.mark.parametrize('speed', ['best', 'balanced', 'fast'])
+def test_encode_decode(speed):
+	it = ImageType(1, ImageType.FitAll(200, 100), quality=85, speed=speed)
+	token = it.Encode('a/b.jpg', KEY)
+	decoded = ImageType.Decode(token, 'a/b.jpg', KEY)
+	assert decoded.speed == speed
+	assert decoded.Encode('a/b.jpg', KEY) == token
+
+
+def test_encode_is_deterministic():
+	best = ImageType(1, ImageType.FitAll(200, 100))
+	fast = ImageType(1, ImageType.FitAll(200, 100), speed='fast')
+	assert best.Encode('a.jpg', KEY) == best.Encode('a.jpg', KEY)
+	assert best.Encode('a.jpg', KEY) != fast.Encode('a.jpg', KEY)
+	assert best.Encode('a.jpg', KEY, speed='fast') == fast.Encode('a.jpg', KEY)
+
+
+def test_get_ops_keeps_thumb():
+	thumb = ImageType.MaxBox(200, 200)
+	it = ImageType(1, thumb, speed='fast')
+	op, = it.GetOps()
+	assert op.speed == 'fast' and op.w == 200
+	assert thumb.speed == 'best'
+	assert list(ImageType(2, thumb).GetOps())[0] is thumb
+
+
+def test_create_thumb_fast():
+	src = BytesIO()
+	gradient((1600, 1200)).save(src, 'JPEG')
+	src.seek(0)
+
+	it = ImageType(1, ImageType.FitWidth(320), speed='fast')
+	out = BytesIO()
+	CreateThumb(Image.open(src), out, list(it.GetOps()), it.save_to)
+	out.seek(0)
+	assert Image.open(out).size == (320, 240)
@@ -0,0 +1,128 @@
+import json
+import math
+import statistics
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from tru.gfx.coder import ImageType
+from tru.gfx.signature import BlurHash, DHash, PHash, HammingDistance, HammingDistances, ImageSignature, PHASH_SIZE
+from tru.gfx.thumbs import CreateThumb, CreateThumbs, Operations
+
+
+def picture(size=(400, 300), seed=0):
+	im = Image.effect_mandelbrot(size, (-2 + seed * 0.3, -1.2, 1, 1.2), 64).convert('RGB')
+	draw = ImageDraw.Draw(im)
+	draw.ellipse((size[0] // 4, size[1] // 4, size[0] // 2, size[1] // 2), fill=(200, 40, 40))
+	return im
+
+
+def naive_dhash(img):
+	gray = img.convert('L').resize((9, 8), Image.BILINEAR)
+	value = 0
+	for y in range(8):
+		for x in range(8):
+			value = (value << 1) | int(gray.getpixel((x + 1, y)) > gray.getpixel((x, y)))
+	return value
+
+
+def naive_phash(img):
+	n = PHASH_SIZE
+	gray = img.convert('L').resize((n, n), Image.BILINEAR)
+	pixels = [[float(gray.getpixel((x, y))) for x in range(n)] for y in range(n)]
+
+	def c(k):
+		return math.sqrt((1.0 if k else 0.5) * 2.0 / n)
+
+	low = []
+	for u in range(8):
+		for v in range(8):
+			total = sum(
+				pixels[y][x] * math.cos(math.pi * (2 * y + 1) * u / (2 * n)) * math.cos(math.pi * (2 * x + 1) * v / (2 * n))
+				for y in range(n) for x in range(n)
+			)
+			low.append(c(u) * c(v) * total)
+
+	median = statistics.median(low[1:])
+	value = 0
+	for i in low:
+		value = (value << 1) | int(i > median)
+	return value
+
+
+def test_dhash_matches_naive():
+	for seed in range(3):
+		im = picture(seed=seed)
+		assert DHash(im) == naive_dhash(im)
+
+
+def test_phash_matches_naive():
+	for seed in range(2):
+		im = picture(seed=seed)
+		assert HammingDistance(PHash(im), naive_phash(im)) <= 1  # float rounding at the median
+
+
+def test_blurhash_reference():
+	# the value of the reference implementation (https://github.com/woltapp/blurhash)
+	im = Image.linear_gradient('L').resize((31, 22)).convert('RGB')
+	assert BlurHash(im) == 'LyHV9woffQof00WBfQWBxuj[fQj['
+	assert len(BlurHash(im, (1, 1))) == 6
+	with pytest.raises(ValueError):
+		BlurHash(im, (0, 3))
+
+
+def test_similar_images():
+	im = picture()
+	similar = im.resize((200, 150), Image.ANTIALIAS).filter(ImageFilter.GaussianBlur(1))
+	other = Image.open('tests/gfx/op/linux.png').convert('RGB').resize(im.size)
+
+	for func in (DHash, PHash):
+		assert HammingDistance(func(im), func(similar)) <= 8
+		assert HammingDistance(func(im), func(other)) > 16
+
+
+def test_hamming_distances():
+	hashes = [0, 1, 0xFFFFFFFFFFFFFFFF, 0x8000000000000001]
+	assert list(HammingDistances(1, hashes)) == [HammingDistance(1, i) for i in hashes] == [1, 0, 63, 1]
+
+
+def test_create_thumb_signature(tmp_path):
+	src = BytesIO()
+	picture((800, 600)).save(src, 'PNG')
+	src.seek(0)
+
+	sig_path = str(tmp_path / 'thumb.png.json')
+	CreateThumb(Image.open(src), str(tmp_path / 'thumb.png'), [Operations.MaxBox(200, 200)], Operations.SaveToBuf(format='PNG'), signature_path=sig_path)
+
+	with open(sig_path) as f:
+		sig = json.load(f)
+	thumb = Image.open(str(tmp_path / 'thumb.png'))
+	assert sig == ImageSignature(thumb.convert('RGB'))
+	assert (sig['width'], sig['height']) == thumb.size
+
+
+def test_create_thumbs_signature(tmp_path):
+	src = str(tmp_path / 'src.png')
+	picture((800, 600)).save(src)
+
+	variants = [ImageType(1, ImageType.MaxBox(400, 400), 'PNG'), ImageType(2, ImageType.FitWidth(100), 'PNG')]
+	CreateThumbs(src, [(it.get_path(src), it) for it in variants], signature_path=src + '.json')
+
+	with open(src + '.json') as f:
+		sig = json.load(f)
+	assert (sig['width'], sig['height']) == (100, 75)
+	assert HammingDistance(int(sig['dhash'], 16), DHash(Image.open(src))) <= 4
+
+
+def test_animated_signature(tmp_path):
+	frames = [picture((120, 90), seed=i).convert('P', palette=Image.ADAPTIVE) for i in range(3)]
+	src = str(tmp_path / 'anim.gif')
+	frames[0].save(src, save_all=True, append_images=frames[1:], duration=100)
+
+	from PIL import GifImagePlugin
+	sig_path = str(tmp_path / 'anim.json')
+	CreateThumb(GifImagePlugin.GifImageFile(src), str(tmp_path / 'out.gif'), [Operations.FitWidth(60, 0)], Operations.SaveToBuf(format='GIF'), signature_path=sig_path)
+
+	with open(sig_path) as f:
+		assert json.load(f)['width'] == 60
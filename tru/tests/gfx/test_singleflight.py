@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+import multiprocessing
+
+import pytest
+from PIL import Image
+
+from tru.gfx.coder import ImageType
+from tru.gfx.singleflight import SingleFlight, CreateThumbOnce
+from tru.gfx.thumbs import ThumbError
+
+
+def slow_render(path, delay=0.3):
+	def render():
+		time.sleep(delay)
+		with open(path, 'wb') as f:
+			f.write(b'x')
+		return path
+	return render
+
+
+def test_threads(tmp_path):
+	path = str(tmp_path / 'thumb.jpg')
+	flight = SingleFlight()
+	calls = []
+
+	def render():
+		calls.append(1)
+		return slow_render(path)()
+
+	results = []
+	threads = [threading.Thread(target=lambda: results.append(flight.Do(path, render))) for i in range(8)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+
+	assert len(calls) == 1
+	assert results == [path] * 8
+	assert flight.GetStats() == {'rendered': 1, 'coalesced': 7, 'timeouts': 0}
+	assert not os.path.exists(path + '.lock')
+
+
+def test_error_propagated(tmp_path):
+	flight = SingleFlight()
+
+	def render():
+		time.sleep(0.2)
+		raise ThumbError("broken")
+
+	errors = []
+
+	def call():
+		try:
+			flight.Do(str(tmp_path / 'thumb.jpg'), render)
+		except ThumbError as ex:
+			errors.append(ex)
+
+	threads = [threading.Thread(target=call) for i in range(3)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert len(errors) == 3
+
+
+def _process(path, queue):
+	flight = SingleFlight()
+	flight.Do(path, slow_render(path, 0.5))
+	queue.put(flight.GetStats())
+
+
+def test_processes(tmp_path):
+	path = str(tmp_path / 'thumb.jpg')
+	ctx = multiprocessing.get_context('fork')
+	queue = ctx.Queue()
+	procs = [ctx.Process(target=_process, args=(path, queue)) for i in range(3)]
+	for p in procs:
+		p.start()
+		time.sleep(0.05)
+	for p in procs:
+		p.join(10)
+
+	stats = [queue.get(timeout=1) for p in procs]
+	assert sum(s['rendered'] for s in stats) == 1
+	assert sum(s['coalesced'] for s in stats) == 2
+
+
+def test_timeout(tmp_path):
+	path = str(tmp_path / 'thumb.jpg')
+	flight = SingleFlight(timeout=0.1)
+	t = threading.Thread(target=lambda: flight.Do(path, slow_render(path, 0.5)))
+	t.start()
+	time.sleep(0.05)
+	with pytest.raises(ThumbError):
+		flight.Do(path, slow_render(path))
+	t.join()
+	assert flight.GetStats()['timeouts'] == 1
+
+
+def test_create_thumb_once(tmp_path):
+	it = ImageType(1, ImageType.FitWidth(100), 'PNG')
+	path = str(tmp_path / 'linux.png')
+	assert CreateThumbOnce('tests/gfx/op/linux.png', path, it.GetOps(), it.save_to, flight=SingleFlight()) == path
+	assert Image.open(path).width == 100
@@ -0,0 +1,124 @@
+import os
+import subprocess
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+from tru.gfx import thumbs
+from tru.gfx.coder import ImageType
+from tru.gfx.thumbs import CreateThumb, CreateThumbs, DecodeSource, EstimateMemory, FrameLimits, Operations, ThumbError, Transform
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+
+
+def jpeg(path, size):
+	im = Image.new('RGB', size, (40, 90, 160))
+	ImageDraw.Draw(im).ellipse((size[0] // 4, size[1] // 4, size[0] // 2, size[1] // 2), fill=(250, 200, 0))
+	im.save(path, quality=80)
+	return path
+
+
+def test_opaque_sources_stay_rgb():
+	assert Transform(Image.new('L', (200, 100)), [Operations.FitWidth(100, 0)]).mode == 'RGB'
+	assert Transform(Image.new('P', (200, 100)), [Operations.FitWidth(100, 0)]).mode == 'RGB'
+	assert Transform(Image.new('CMYK', (200, 100)), [Operations.FitWidth(100, 0)]).mode == 'RGB'
+
+	transparent = Image.new('P', (200, 100))
+	transparent.info['transparency'] = 0
+	assert Transform(transparent, [Operations.FitWidth(100, 0)]).mode == 'RGBA'
+	assert Transform(Image.new('LA', (200, 100)), [Operations.FitWidth(100, 0)]).mode == 'RGBA'
+	assert Transform(Image.new('RGBA', (200, 100)), [Operations.FitWidth(100, 0)]).mode == 'RGBA'
+
+
+def test_too_many_pixels(tmp_path):
+	path = jpeg(str(tmp_path / 'a.jpg'), (400, 300))
+	with pytest.raises(ThumbError):
+		CreateThumb(path, BytesIO(), [Operations.FitWidth(100, 0)], Operations.SaveToBuf(), limits=FrameLimits(max_source_pixels=100000))
+	CreateThumb(path, BytesIO(), [Operations.FitWidth(100, 0)], Operations.SaveToBuf(), limits=FrameLimits(max_source_pixels=120000))
+
+
+def test_gif_limits(tmp_path):
+	path = str(tmp_path / 'a.gif')
+	frames = [Image.new('P', (3000, 3000), i) for i in range(2)]
+	frames[0].save(path, save_all=True, append_images=frames[1:])
+	thumbs = [(str(tmp_path / 'a_thumb.gif'), ImageType(1, ImageType.FitWidth(100), 'GIF'))]
+
+	for limits in (FrameLimits(max_source_pixels=1000 * 1000), FrameLimits(memory_budget=EstimateMemory(Image.open(path), 1, 'RGBA') - 1)):
+		with pytest.raises(ThumbError):
+			CreateThumb(path, BytesIO(), [Operations.FitWidth(100, 0)], Operations.SaveToBuf(format='GIF', animated=True), limits=limits)
+		with pytest.raises(ThumbError):
+			CreateThumbs(path, thumbs, limits=limits)
+
+	CreateThumbs(path, thumbs, limits=FrameLimits(max_source_pixels=3000 * 3000))
+	assert Image.open(thumbs[0][0]).width == 100
+
+
+def test_memory_budget_jpeg(tmp_path):
+	path = jpeg(str(tmp_path / 'a.jpg'), (4000, 3000))
+	limits = FrameLimits(memory_budget=20 * 1024 * 1024)
+
+	assert EstimateMemory(Image.open(path), 2, 'RGB') > 20 * 1024 * 1024 >= EstimateMemory(Image.open(path), 4, 'RGB')
+
+	# draft decoding: the scale of the plan (1/4) fits into 20 MB
+	assert Transform(Image.open(path), [Operations.FitWidth(500, 0)], limits=limits).size == (500, 375)
+
+	# the scale is not raised (the result would be smaller than requested)
+	assert Transform(Image.open(path), [Operations.FitWidth(3000, 0)]).size == (3000, 2250)
+	for width in (3000, 1000):
+		with pytest.raises(ThumbError):
+			Transform(Image.open(path), [Operations.FitWidth(width, 0)], limits=limits)
+
+	with pytest.raises(ThumbError):
+		Transform(Image.open(path), [Operations.FitWidth(500, 0)], limits=FrameLimits(memory_budget=1024))
+
+
+def test_memory_budget_strips(monkeypatch):
+	monkeypatch.setattr(thumbs, 'STRIP_PIXELS', 10000)
+
+	im = Image.effect_mandelbrot((1001, 703), (-2, -1.2, 1, 1.2), 64).convert('P')
+	budget = EstimateMemory(im, 4, 'RGB')
+	assert EstimateMemory(im, 2, 'RGB') > budget
+
+	with pytest.raises(ThumbError):
+		DecodeSource(im, 2, limits=FrameLimits(memory_budget=budget))
+
+	res = DecodeSource(im, 4, limits=FrameLimits(memory_budget=budget))
+	expected = im.convert('RGB').reduce(4)
+	assert res.mode == 'RGB' and res.size == expected.size == (251, 176)
+	assert res.tobytes() == expected.tobytes()
+
+
+CHILD = """
+import resource, sys
+from io import BytesIO
+from tru.gfx.thumbs import CreateThumb, FrameLimits, Operations
+
+budget = int(sys.argv[2])
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+out = BytesIO()
+CreateThumb(sys.argv[1], out, [Operations.FitWidth(int(sys.argv[3]), 0)], Operations.SaveToBuf(format='JPEG'), limits=FrameLimits(memory_budget=budget))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base, len(out.getvalue()))
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='ru_maxrss in kB')
+def test_peak_rss(tmp_path):
+	path = jpeg(str(tmp_path / 'large.jpg'), (10000, 8000))
+	budget = 64 * 1024 * 1024
+	# without the budget the source needs more than 5x more
+	assert EstimateMemory(Image.open(path), 1, 'RGB') > 5 * budget
+
+	env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+	res = subprocess.run([sys.executable, '-c', CHILD, path, str(budget), '1000'], env=env, stdout=subprocess.PIPE, check=True)
+	peak, size = map(int, res.stdout.split())
+
+	assert size > 0
+	# the budget and the encoder's buffers
+	assert peak * 1024 < budget + 32 * 1024 * 1024
+
+	# a full size thumbnail does not fit
+	res = subprocess.run([sys.executable, '-c', CHILD, path, str(budget), '8000'], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	assert res.returncode != 0 and b'ThumbError' in res.stderr
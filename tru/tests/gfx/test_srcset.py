@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from tru.gfx.coder import ImageType, BuildSrcSets, FormatSrcSet, SrcSetItem
+
+
+KEY = b'secret'
+
+IMAGE_TYPES = [
+	ImageType(1, ImageType.FitWidth(320), 'JPEG'),
+	ImageType(2, ImageType.FitWidth(640, 480), 'WEBP'),
+	ImageType(3, ImageType.FitWidth(0)),
+	ImageType(4, ImageType.FitAll(120, 80), 'PNG'),
+	ImageType(5, ImageType.FitAll(80, 120)),
+	ImageType(6, ImageType.FitAll(333, 333)),
+	ImageType(7, ImageType.MaxBox(1024, 768)),
+	ImageType(8, ImageType.MaxBox(77, 1000)),
+	ImageType(9, ImageType.Force(200, 100)),
+	ImageType(10, ImageType.Manual(300, 200, (10, 20, 600, 150))),
+	ImageType(11, ImageType.Manual(300, 200)),
+	ImageType(12, ImageType.Original()),
+]
+
+
+def sizes():
+	rnd = random.Random(5)
+	result = [(1, 1), (1, 5000), (5000, 1), (320, 240), (321, 1), (640, 480), (120, 80), (119, 81), (333, 333), (334, 332)]
+	result += [(rnd.randint(1, 6000), rnd.randint(1, 6000)) for i in range(2000)]
+	result += [(rnd.randint(1, 400), rnd.randint(1, 400)) for i in range(2000)]
+	return result
+
+
+@pytest.mark.parametrize('it', IMAGE_TYPES, ids=lambda it: str(it.id))
+def test_final_sizes(it):
+	widths, heights = zip(*sizes())
+	assert list(zip(*it.GetFinalSizes(widths, heights))) == [it.GetFinalSize(w, h) for w, h in sizes()]
+
+
+def test_build():
+	records = [('upload/{}.jpg'.format(i), w, h) for i, (w, h) in enumerate(sizes()[:50])]
+	srcsets = BuildSrcSets(records, IMAGE_TYPES, KEY)
+
+	assert len(srcsets) == len(records)
+	for (filename, w, h), items in zip(records, srcsets):
+		assert items == [SrcSetItem(it.Encode(filename, KEY), it.get_path(filename), *it.GetFinalSize(w, h)) for it in IMAGE_TYPES]
+
+	url = lambda filename, token, path: '/thumb/{}/{}'.format(token, filename)  # noqa
+	srcsets = BuildSrcSets(records[:1], IMAGE_TYPES[:1], KEY, url=url)
+	assert srcsets[0][0].url == '/thumb/{}/upload/0.jpg'.format(IMAGE_TYPES[0].Encode('upload/0.jpg', KEY))
+
+	assert BuildSrcSets([], IMAGE_TYPES, KEY) == []
+
+
+def test_format():
+	types = [ImageType(i, ImageType.FitWidth(w)) for i, w in enumerate((320, 640, 1280))]
+	large, small = BuildSrcSets([('img/a.jpg', 2000, 1000), ('img/b.jpg', 500, 300)], types, KEY, url=lambda f, token, path: path)
+	assert FormatSrcSet(large) == 'img/a_0.jpg 320w, img/a_1.jpg 640w, img/a_2.jpg 1280w'
+	# the larger thumbnails are the same as the source
+	assert FormatSrcSet(small) == 'img/b_0.jpg 320w, img/b_1.jpg 500w'
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+
+from tru.gfx.cache import ThumbCache, main
+from tru.gfx.thumbs import CreateThumb
+from tru.gfx.coder import ImageType
+
+
+def touch(path, size=100):
+	with open(path, 'wb') as f:
+		f.write(b'0' * size)
+	return str(path)
+
+
+def make_cache(tmp_path, max_bytes, policy='lru', files=5):
+	cache = ThumbCache(str(tmp_path / 'cache.sqlite'), max_bytes, policy=policy)
+	src = touch(tmp_path / 'src.jpg', 1000)
+	thumbs = [touch(tmp_path / 'src_{}.jpg'.format(i)) for i in range(files)]
+	for i, path in enumerate(thumbs):
+		cache.Add(path, src)
+		time.sleep(0.001)
+	return cache, src, thumbs
+
+
+def test_lru_eviction(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 300)
+
+	cache.Hit(thumbs[0])
+	cache.Hit(thumbs[1])
+	cache.Flush()
+
+	assert cache.Evict() == (2, 200)
+	assert [os.path.exists(i) for i in thumbs] == [True, True, False, False, True]
+	assert os.path.exists(src)
+	assert cache.GetTotalBytes() == 300
+	assert cache.Evict() == (0, 0)
+
+
+def test_lfu_eviction(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 300, policy='lfu')
+
+	for i in range(3):
+		cache.Hit(thumbs[0])
+	cache.Hit(thumbs[4])
+	cache.Hit(thumbs[4])
+	cache.Hit(thumbs[1])
+	cache.Flush()
+
+	cache.Evict()
+	assert [os.path.exists(i) for i in thumbs] == [True, True, False, False, True]
+
+
+def test_incremental_batches(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 0, files=10)
+	assert cache.Evict(max_files=3) == (3, 300)
+	assert cache.Evict(max_files=3) == (3, 300)
+	assert cache.GetStats()['files'] == 4
+
+
+def test_never_removes_sources(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 0)
+	# a thumbnail rendered from another thumbnail
+	derived = touch(tmp_path / 'src_0_x.jpg')
+	cache.Add(derived, thumbs[0])
+
+	while cache.Evict()[0]:
+		pass
+
+	assert os.path.exists(src)
+	assert os.path.exists(thumbs[0])
+	assert not os.path.exists(derived)
+
+
+def test_missing_files(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 250)
+	os.remove(thumbs[0])
+	os.remove(thumbs[1])
+	assert cache.Evict() == (1, 100)
+	assert cache.GetStats()['files'] == 2
+
+
+def test_many_missing_files(tmp_path):
+	# e.g. after tru.fs.blobs.BlobStore.GC, more batches than the recursion limit
+	files = sys.getrecursionlimit() + 100
+	cache, src, thumbs = make_cache(tmp_path, 100, files=files)
+	for i in thumbs[:-2]:
+		os.remove(i)
+	assert cache.Evict(max_files=1) == (1, 100)
+	assert cache.GetStats()['files'] == 1
+
+
+def test_stats(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 10000)
+
+	cache.Hit(thumbs[0])
+	cache.Hit(thumbs[0], nbytes=50)
+	cache.Hit(thumbs[1])
+	cache.Miss(thumbs[2])
+
+	stats = cache.GetStats()
+	assert stats['hits'] == 3
+	assert stats['misses'] == 1
+	assert stats['hit_ratio'] == 0.75
+	assert stats['bytes_served'] == 150
+	assert stats['files'] == 5
+	assert stats['bytes'] == 500
+
+	# persistent
+	assert ThumbCache(cache.db_path, 10000).GetStats()['hits'] == 3
+
+
+def test_background(tmp_path):
+	cache, src, thumbs = make_cache(tmp_path, 200)
+	cache.Start(interval=0.01)
+	try:
+		for i in range(100):
+			if cache.GetTotalBytes() <= 200:
+				break
+			time.sleep(0.01)
+	finally:
+		cache.Stop()
+	assert sum(os.path.exists(i) for i in thumbs) == 2
+
+
+def test_on_new_image(tmp_path):
+	from PIL import Image
+
+	src = str(tmp_path / 'src.png')
+	Image.new('RGB', (400, 300), (10, 20, 30)).save(src)
+	cache = ThumbCache(str(tmp_path / 'cache.sqlite'), 10 ** 6)
+
+	it = ImageType(1, ImageType.MaxBox(100, 100), format='PNG')
+	thumb_path = it.get_path(src)
+
+	CreateThumb.OnNewImage.append(cache.OnNewImage)
+	try:
+		CreateThumb(src, thumb_path, list(it.GetOps()), it.save_to)
+	finally:
+		CreateThumb.OnNewImage.remove(cache.OnNewImage)
+
+	stats = cache.GetStats()
+	assert stats['files'] == 1 and stats['bytes'] == os.path.getsize(thumb_path)
+
+
+def test_cli(tmp_path, capsys):
+	thumbs = [touch(tmp_path / 'a_{}.jpg'.format(i)) for i in range(3)]
+	db = str(tmp_path / 'cache.sqlite')
+	assert main(['--db', db, '--max-bytes', '100', 'add'] + thumbs) == 0
+	assert main(['--db', db, '--max-bytes', '100', 'evict']) == 0
+	assert sum(os.path.exists(i) for i in thumbs) == 1
+	assert 'Removed: 2 files, 200 bytes' in capsys.readouterr().out
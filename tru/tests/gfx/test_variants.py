@@ -0,0 +1,108 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from tru.gfx.coder import ImageType, ParseAccept
+from tru.gfx.variants import GetThumbVariant
+from tru.gfx.thumbs import CanSave
+
+
+KEY = b'secret'
+CHROME = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+OLD = 'image/png,image/*;q=0.8,*/*;q=0.5'
+
+
+def test_parse_accept():
+	assert ParseAccept('image/webp, image/*;q=0.8, */*; q=0.5') == {'image/webp': 1.0, 'image/*': 0.8, '*/*': 0.5}
+	assert ParseAccept('image/webp;q=0') == {'image/webp': 0.0}
+	assert ParseAccept(None) == {}
+
+
+def test_variant_format():
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	expected = 'AVIF' if CanSave('AVIF') else 'WEBP'
+	assert it.GetVariantFormat(CHROME) == expected
+	assert it.GetVariantFormat('image/webp') == 'WEBP'
+	assert it.GetVariantFormat('image/webp;q=0') is None
+	assert it.GetVariantFormat(OLD) is None
+	assert it.GetVariantFormat(None) is None
+
+	assert ImageType(1, ImageType.FitWidth(100), 'GIF').GetVariantFormat(CHROME) == 'WEBP'
+	assert ImageType(1, ImageType.FitWidth(100), 'GIF').GetVariant('WEBP').save_to.animated
+	assert ImageType(1, ImageType.FitWidth(100), 'WEBP').GetVariantFormat(CHROME) is None
+	# the format of the source
+	assert ImageType(1, ImageType.FitWidth(100), None).GetVariantFormat('image/webp', 'a.png') == 'WEBP'
+	assert ImageType(1, ImageType.FitWidth(100), None).GetVariantFormat('image/avif', 'a.gif') is None
+
+
+def test_token_stays_valid():
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG', quality=80)
+	token = it.Encode('a.jpg', KEY)
+	decoded = ImageType.Decode(token, 'a.jpg', KEY)
+	variant = decoded.GetVariant('WEBP')
+	assert variant.save_to.format == 'WEBP' and variant.save_to.quality == 80
+	assert decoded.save_to.format == 'JPEG'
+	assert decoded.Encode('a.jpg', KEY) == token
+
+
+def test_avif_encode_decode():
+	it = ImageType(1, ImageType.FitWidth(100), 'AVIF')
+	assert ImageType.Decode(it.Encode('a.jpg', KEY), 'a.jpg', KEY).save_to.format == 'AVIF'
+	assert it.get_path('/x/a.jpg').endswith('a_1.avif')
+	assert it.GetMimeType() == 'image/avif'
+
+
+def test_lazy_render(tmp_path):
+	src = str(tmp_path / 'src.jpg')
+	Image.new('RGB', (400, 300), (200, 100, 50)).save(src)
+
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	thumb_path = it.get_path(src)
+
+	path, mimetype = GetThumbVariant('image/webp', src, thumb_path, it)
+	assert (path, mimetype) == (thumb_path + '.webp', 'image/webp')
+	assert Image.open(path).format == 'WEBP'
+	assert Image.open(path).width == 100
+
+	# cached
+	mtime = os.path.getmtime(path)
+	time.sleep(0.01)
+	GetThumbVariant('image/webp', src, thumb_path, it)
+	assert os.path.getmtime(path) == mtime
+
+	# rendered again for a newer source
+	future = time.time() + 10
+	os.utime(src, (future, future))
+	GetThumbVariant('image/webp', src, thumb_path, it)
+	assert os.path.getmtime(path) != mtime
+
+	assert GetThumbVariant(OLD, src, thumb_path, it) == (thumb_path, 'image/jpeg')
+	assert not os.path.exists(thumb_path)
+
+
+def test_response(tmp_path):
+	django = pytest.importorskip('django')
+	from django.conf import settings
+
+	if not settings.configured:
+		settings.configure(DEBUG=False, UPLOAD_DIR=str(tmp_path))
+		django.setup()
+	elif getattr(settings, 'UPLOAD_DIR', None) is None:
+		pytest.skip('UPLOAD_DIR is not configured')
+
+	from django.test import RequestFactory
+	from tru.dj.responses import ImageVariantResponse
+
+	upload_dir = settings.UPLOAD_DIR
+	os.makedirs(os.path.join(upload_dir, 'img'), exist_ok=True)
+	Image.new('RGB', (400, 300)).save(os.path.join(upload_dir, 'img/src.jpg'))
+
+	it = ImageType(1, ImageType.FitWidth(100), 'JPEG')
+	request = RequestFactory().get('/thumb', HTTP_ACCEPT='image/webp,*/*')
+	response = ImageVariantResponse(request, 'img/src.jpg', 'img/src_1.jpg', it)
+
+	assert response['Vary'] == 'Accept'
+	assert response['Content-Type'] == 'image/webp'
+	assert response['X-Accel-Redirect'] == '/protected-files/img/src_1.jpg.webp'
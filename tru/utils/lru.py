@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+	""" Thread-safe LRU cache limited by the number of items and/or the total size.
+
+	sizeof(value) returns the size of a single value (in bytes), it is required
+	when max_bytes is set.
+	"""
+
+	def __init__(self, max_items=None, max_bytes=None, sizeof=None):
+		assert max_bytes is None or sizeof is not None, "sizeof is required for max_bytes"
+		self.max_items = max_items
+		self.max_bytes = max_bytes
+		self.sizeof = sizeof
+		self.items = OrderedDict()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.items)
+
+	def __contains__(self, key):
+		return key in self.items
+
+	def Get(self, key, default=None):
+		with self.lock:
+			try:
+				value = self.items[key]
+			except KeyError:
+				self.misses += 1
+				return default
+			self.items.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def Set(self, key, value):
+
+		size = self.sizeof(value) if self.sizeof is not None else 0
+
+		with self.lock:
+			if key in self.items:
+				self._Remove(key)
+
+			if self.max_bytes is not None and size > self.max_bytes:
+				return value
+
+			self.items[key] = value
+			self.bytes += size
+
+			while (self.max_items is not None and len(self.items) > self.max_items) or (self.max_bytes is not None and self.bytes > self.max_bytes):
+				self._Remove(next(iter(self.items)))
+
+		return value
+
+	def Delete(self, key):
+		with self.lock:
+			if key in self.items:
+				self._Remove(key)
+
+	def Clear(self):
+		with self.lock:
+			self.items.clear()
+			self.bytes = 0
+
+	def _Remove(self, key):
+		value = self.items.pop(key)
+		if self.sizeof is not None:
+			self.bytes -= self.sizeof(value)
@@ -0,0 +1,23 @@
+import sqlite3
+import threading
+
+
+class LocalConnections:
+	""" sqlite3 connections to a database, one per thread (they cannot be shared between threads):
+
+		self.connections = LocalConnections(db_path)
+		self.connections.Get().execute(...)
+	"""
+
+	TIMEOUT = 30
+
+	def __init__(self, path, timeout=None):
+		self.path = path
+		self.timeout = timeout if timeout is not None else self.TIMEOUT
+		self.local = threading.local()
+
+	def Get(self):
+		conn = getattr(self.local, 'conn', None)
+		if conn is None:
+			conn = self.local.conn = sqlite3.connect(self.path, timeout=self.timeout)
+		return conn